@@ -0,0 +1,317 @@
+"""
+A stand-in for pyodbc to benchmark etl_db_tools without a database.
+
+Every round trip to the "server" (execute, fetchmany, executemany, commit)
+sleeps round_trip seconds, plus per_row seconds for every row fetched or
+inserted. Sleeping releases the GIL like a real driver waiting on the network
+does, so threaded copies overlap the way they would against SQL Server.
+
+Tables are defined with define_table(); select queries on them return
+synthetic rows and a matching cursor.description, and the information_schema
+queries of Table.from_connection and many_from_connection return their column
+definitions. Inserted rows, by executemany or by multi-row and table-valued
+parameter insert statements, are counted and thrown away.
+
+install() puts this module in sys.modules as pyodbc, call it before importing
+etl_db_tools.
+"""
+
+import datetime
+import decimal
+import itertools
+import re
+import sys
+import threading
+import time
+
+# settings, see configure()
+round_trip = 0.0
+per_row = 0.0
+
+# the ODBC sql types used with setinputsizes
+SQL_CHAR = 1
+SQL_NUMERIC = 2
+SQL_DECIMAL = 3
+SQL_INTEGER = 4
+SQL_SMALLINT = 5
+SQL_REAL = 7
+SQL_DOUBLE = 8
+SQL_VARCHAR = 12
+SQL_TYPE_DATE = 91
+SQL_TYPE_TIMESTAMP = 93
+SQL_LONGVARCHAR = -1
+SQL_BINARY = -2
+SQL_VARBINARY = -3
+SQL_LONGVARBINARY = -4
+SQL_BIGINT = -5
+SQL_TINYINT = -6
+SQL_BIT = -7
+SQL_WCHAR = -8
+SQL_WVARCHAR = -9
+SQL_WLONGVARCHAR = -10
+SQL_GUID = -11
+
+_lock = threading.Lock()
+_tables = {}
+_existing = set()
+inserted_rows = 0
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+def configure(round_trip_latency: float = 0.0, row_latency: float = 0.0) -> None:
+    """Set the latency per round trip and per row, in seconds."""
+    global round_trip, per_row
+    round_trip = round_trip_latency
+    per_row = row_latency
+
+
+def define_table(name: str, columns: list[tuple], rows: int) -> None:
+    """
+    Define a source table of rows synthetic rows. columns is a list of
+    (name, type) or (name, type, length) or (name, type, precision, scale)
+    with SQL Server type names.
+    """
+    with _lock:
+        _tables[name] = (columns, rows)
+        _existing.add(name)
+
+
+def reset() -> None:
+    global inserted_rows
+    with _lock:
+        _tables.clear()
+        _existing.clear()
+        inserted_rows = 0
+
+
+def install() -> None:
+    sys.modules["pyodbc"] = sys.modules[__name__]
+
+
+def connect(connection_string: str, **kwargs) -> "Connection":
+    _wait(1, 0)
+    return Connection()
+
+
+def _wait(trips: int, rows: int) -> None:
+    seconds = trips * round_trip + rows * per_row
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+def _name(text: str) -> str:
+    return text.replace("[", "").replace("]", "").strip()
+
+
+# name, python type, internal size and the value for row i of a column
+def _describe(column: tuple) -> tuple:
+    name, sql_type, *size = column
+    if sql_type in ("int", "bigint", "smallint", "tinyint"):
+        return name, int, 10, lambda i: i
+    if sql_type == "bit":
+        return name, bool, 1, lambda i: i % 2 == 0
+    if sql_type in ("float", "real"):
+        return name, float, 15, lambda i: i * 0.5
+    if sql_type in ("decimal", "numeric", "money"):
+        return name, decimal.Decimal, 18, lambda i: decimal.Decimal(i) / 100
+    if sql_type == "date":
+        start = datetime.date(2020, 1, 1)
+        return name, datetime.date, 10, lambda i: start + datetime.timedelta(i % 3650)
+    if sql_type in ("datetime", "datetime2", "smalldatetime"):
+        start = datetime.datetime(2020, 1, 1)
+        return (
+            name,
+            datetime.datetime,
+            27,
+            lambda i: start + datetime.timedelta(seconds=i),
+        )
+    if sql_type in ("varbinary", "binary"):
+        length = size[0] if size else 16
+        return name, bytes, length, lambda i: i.to_bytes(8, "little")
+    length = size[0] if size else 50
+    return name, str, length, lambda i: f"{name} {i}"
+
+
+def _definition_row(table_name: str, column: tuple) -> tuple:
+    name, sql_type, *size = column
+    length = precision = scale = None
+    if sql_type in ("decimal", "numeric"):
+        precision, scale = (size + [18, 2])[:2]
+    elif sql_type in ("varchar", "nvarchar", "char", "nchar", "varbinary", "binary"):
+        length = size[0] if size else 50
+    return (table_name, name, sql_type, True, length, precision, scale, None)
+
+
+_DEFINITION_DESCRIPTION = [
+    (c, str, None, 128, 128, 0, True)
+    for c in (
+        "table_name",
+        "COLUMN_NAME",
+        "DATA_TYPE",
+        "IS_NULLABLE",
+        "CHARACTER_MAXIMUM_LENGTH",
+        "NUMERIC_PRECISION",
+        "NUMERIC_SCALE",
+        "COLUMN_DEFAULT",
+    )
+]
+
+
+class Cursor:
+    def __init__(self, connection: "Connection") -> None:
+        self.connection = connection
+        self.description = None
+        self.fast_executemany = False
+        self._rows = iter(())
+
+    def _result(self, description: list, rows) -> None:
+        self.description = description
+        self._rows = iter(rows)
+
+    def execute(self, query: str, *params) -> "Cursor":
+        _wait(1, 0)
+        self.description = None
+        self._rows = iter(())
+        text = " ".join(query.split())
+        lowered = text.lower()
+
+        schema = re.search(r"sc\.name = '([^']+)'", text)
+        if "information_schema.columns" in lowered:
+            single = re.search(r"table_name\) = '([^']+)'", text, re.IGNORECASE)
+            tables = self._tables(schema.group(1) if schema else None)
+            if single:
+                tables = {k: v for k, v in tables.items() if k == single.group(1)}
+            rows = [
+                _definition_row(name, column)
+                for name, (columns, _) in tables.items()
+                for column in columns
+            ]
+            self._result(_DEFINITION_DESCRIPTION, rows)
+        elif "from sys.tables" in lowered and schema is None:
+            # if_exists
+            found = re.search(r"s\.name\) = '([^']+)'", text)
+            with _lock:
+                exists = found is not None and found.group(1) in _existing
+            self._result([("name", str, None, 128, 128, 0, False)], [("x",)] * exists)
+        elif "from sys.tables" in lowered:
+            # list_tables and table_row_counts
+            tables = self._tables(schema.group(1))
+            self._result(
+                [
+                    ("table_name", str, None, 256, 256, 0, False),
+                    ("row_count", int, None, 19, 19, 0, False),
+                ],
+                sorted(((k, v[1]) for k, v in tables.items()), key=lambda r: -r[1]),
+            )
+        elif "sp_rename" in lowered:
+            # finalize_copy, the temporary table takes the name of the target
+            temp, target = re.findall(r"\[([^\]]+)\]", text)[-2:]
+            with _lock:
+                _existing.discard(temp)
+                _existing.add(f"{temp.rsplit('.', 1)[0]}.{target}")
+        elif lowered.startswith("create table"):
+            name = _name(re.match(r"create table\s+([^\s(]+)", text, re.I).group(1))
+            with _lock:
+                _existing.add(name)
+        elif lowered.startswith("drop table"):
+            name = _name(re.search(r"exists\s+([^\s;]+)", text, re.I).group(1))
+            with _lock:
+                _existing.discard(name)
+        elif lowered.startswith("insert"):
+            # the values and tvp insert engines send many rows per statement
+            if lowered.endswith("select * from ?"):
+                n = len(params[0][0]) - 2
+            else:
+                n = lowered.count("(?")
+            _wait(0, n)
+            self._inserted(n)
+        elif lowered.startswith("select"):
+            found = re.search(r"\bfrom\s+([\w.\[\]]+)", text, re.IGNORECASE)
+            with _lock:
+                table = _tables.get(_name(found.group(1))) if found else None
+            if table is None:
+                self._result([("value", int, None, 10, 10, 0, True)], [])
+            else:
+                columns, count = table
+                described = [_describe(c) for c in columns]
+                makers = [d[3] for d in described]
+                self._result(
+                    [(n, t, None, s, s, 0, True) for n, t, s, _ in described],
+                    (tuple(m(i) for m in makers) for i in range(count)),
+                )
+        return self
+
+    @staticmethod
+    def _tables(schema: str = None) -> dict:
+        with _lock:
+            tables = dict(_tables)
+        if schema is None:
+            return tables
+        return {k: v for k, v in tables.items() if k.split(".")[0] == schema}
+
+    def fetchmany(self, size: int) -> list:
+        rows = list(itertools.islice(self._rows, size))
+        _wait(1, len(rows))
+        return rows
+
+    def fetchall(self) -> list:
+        rows = list(self._rows)
+        _wait(1, len(rows))
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def executemany(self, query: str, rows) -> None:
+        n = len(rows)
+        # without fast_executemany every row is a round trip
+        _wait(1 if self.fast_executemany else n, n)
+        self._inserted(n)
+
+    @staticmethod
+    def _inserted(n: int) -> None:
+        global inserted_rows
+        with _lock:
+            inserted_rows += n
+
+    def setinputsizes(self, sizes) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def cancel(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class Connection:
+    def cursor(self) -> Cursor:
+        return Cursor(self)
+
+    def commit(self) -> None:
+        _wait(1, 0)
+
+    def rollback(self) -> None:
+        _wait(1, 0)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,326 @@
+"""
+Offline benchmarks of select_data, the inserts, copy_table and the table
+metadata lookups against the fake driver in fake_pyodbc.py.
+
+    python benchmarks/run_benchmarks.py --rows 100000 --output results.json
+    python benchmarks/run_benchmarks.py --compare old.json new.json
+
+Each benchmark runs --repeat times, the fastest run counts. Results are
+written as JSON, with the package version, git commit and the settings, so
+runs of different versions can be compared with --compare.
+"""
+
+from pathlib import Path
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import fake_pyodbc
+
+fake_pyodbc.install()
+
+# run from a checkout without installing the package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from etl_db_tools.sqlservertools.sqlservertools import (  # noqa: E402
+    Row,
+    SQLserverconnection,
+    Table,
+    compare_insert_engines,
+    copy_table,
+)
+from etl_db_tools.sqlservertools.insert_engines import ENGINES  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TABLE = "bench.source"
+SOURCE_COLUMNS = [
+    ("id", "int"),
+    ("name", "nvarchar", 50),
+    ("amount", "decimal", 18, 2),
+    ("created", "datetime2"),
+    ("flag", "bit"),
+    ("score", "float"),
+]
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, setup=None):
+    """
+    Register a function(data) that returns the number of rows (or lookups)
+    processed. data is the result of setup(rows), which runs untimed, or the
+    number of rows without a setup.
+    """
+
+    def register(func):
+        BENCHMARKS[name] = (setup, func)
+        return func
+
+    return register
+
+
+def make_connection() -> SQLserverconnection:
+    return SQLserverconnection(
+        driver="ODBC Driver 18 for SQL Server", server="fake", database="bench"
+    )
+
+
+def source_rows(rows: int) -> list[tuple]:
+    with make_connection().connect() as cnxn:
+        return list(cnxn.select_data(f"select * from {SOURCE_TABLE}", tuple))[:rows]
+
+
+def source_dicts(rows: int) -> list[dict]:
+    names = [c[0] for c in SOURCE_COLUMNS]
+    return [dict(zip(names, r)) for r in source_rows(rows)]
+
+
+@benchmark("select_dict")
+def bench_select_dict(rows: int) -> int:
+    with make_connection().connect() as cnxn:
+        return sum(1 for _ in cnxn.select_data(f"select * from {SOURCE_TABLE}"))
+
+
+@benchmark("select_tuple")
+def bench_select_tuple(rows: int) -> int:
+    with make_connection().connect() as cnxn:
+        query = f"select * from {SOURCE_TABLE}"
+        return sum(1 for _ in cnxn.select_data(query, row_type=tuple))
+
+
+@benchmark("select_row")
+def bench_select_row(rows: int) -> int:
+    with make_connection().connect() as cnxn:
+        query = f"select * from {SOURCE_TABLE}"
+        return sum(1 for _ in cnxn.select_data(query, row_type=Row))
+
+
+@benchmark("select_auto_fetch_size")
+def bench_select_auto(rows: int) -> int:
+    with make_connection().connect() as cnxn:
+        query = f"select * from {SOURCE_TABLE}"
+        return sum(1 for _ in cnxn.select_data(query, tuple, fetch_size="auto"))
+
+
+@benchmark("select_batches")
+def bench_select_batches(rows: int) -> int:
+    with make_connection().connect() as cnxn:
+        query = f"select * from {SOURCE_TABLE}"
+        return sum(b.num_rows for b in cnxn.select_batches(query, 5000))
+
+
+@benchmark("insert_dictionary", setup=source_dicts)
+def bench_insert_dictionary(data: list[dict]) -> int:
+    with make_connection().connect() as cnxn:
+        return cnxn.sql_insert_dictionary(SOURCE_TABLE, data)
+
+
+@benchmark("insert_list", setup=source_rows)
+def bench_insert_list(data: list[tuple]) -> int:
+    with make_connection().connect() as cnxn:
+        return cnxn.sql_insert_list(SOURCE_TABLE, data)
+
+
+def register_engine_benchmark(engine: str) -> None:
+    @benchmark(f"insert_list_{engine}", setup=source_rows)
+    def bench_insert_engine(data: list[tuple]) -> int:
+        with make_connection().connect() as cnxn:
+            return cnxn.sql_insert_list(SOURCE_TABLE, data, engine=engine)
+
+
+# streaming pays a round trip per row, it is meant for rows too large to buffer
+BENCHMARKED_ENGINES = [e for e in ENGINES if e != "streaming"]
+
+for name in BENCHMARKED_ENGINES:
+    register_engine_benchmark(name)
+
+
+@benchmark("compare_insert_engines", setup=source_rows)
+def bench_compare_insert_engines(data: list[tuple]) -> int:
+    sample = data[:5000]
+    with make_connection().connect() as cnxn:
+        results = compare_insert_engines(
+            cnxn, SOURCE_TABLE, sample, engines=BENCHMARKED_ENGINES, repeat=1
+        )
+    logger.info(
+        "%-24s %s",
+        "  engine ranking",
+        ", ".join(
+            f"{r['engine']} {r.get('rows_per_second') or 0:.0f}" for r in results
+        ),
+    )
+    return len(sample) * len(results)
+
+
+@benchmark("copy_table")
+def bench_copy_table(rows: int) -> int:
+    source, target = make_connection(), make_connection()
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(s, SOURCE_TABLE, t, into="bench.target")
+    return stats["copy"].rows
+
+
+@benchmark("copy_table_pipeline")
+def bench_copy_table_pipeline(rows: int) -> int:
+    source, target = make_connection(), make_connection()
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(
+            s, SOURCE_TABLE, t, into="bench.target", pipeline=True, writers=2
+        )
+    return stats["copy"].rows
+
+
+@benchmark("table_definition")
+def bench_table_definition(rows: int) -> int:
+    lookups = 200
+    with make_connection().connect() as cnxn:
+        for _ in range(lookups):
+            Table.from_connection(cnxn, SOURCE_TABLE, use_cache=False)
+    return lookups
+
+
+@benchmark("table_definition_cached")
+def bench_table_definition_cached(rows: int) -> int:
+    lookups = 200
+    with make_connection().connect() as cnxn:
+        for _ in range(lookups):
+            Table.from_connection(cnxn, SOURCE_TABLE)
+    return lookups
+
+
+@benchmark("many_from_connection")
+def bench_many_from_connection(rows: int) -> int:
+    lookups = 200
+    with make_connection().connect() as cnxn:
+        for _ in range(lookups):
+            Table.many_from_connection(cnxn, "bench")
+    return lookups
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).resolve().parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def package_version() -> str | None:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("etl-db-tools")
+    except PackageNotFoundError:
+        return None
+
+
+def run(names: list[str], rows: int, repeat: int) -> list[dict]:
+    results = []
+    for name in names:
+        setup, func = BENCHMARKS[name]
+        data = setup(rows) if setup is not None else rows
+        timings = []
+        processed = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            processed = func(data)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        result = {
+            "name": name,
+            "rows": processed,
+            "seconds": best,
+            "median_seconds": statistics.median(timings),
+            "rows_per_second": processed / best if best else None,
+            "repeat": repeat,
+        }
+        logger.info(
+            "%-24s %10s rows %9.3fs %12.0f rows/s",
+            name,
+            processed,
+            best,
+            result["rows_per_second"] or 0,
+        )
+        results.append(result)
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """Print the rows/sec of new relative to old per benchmark."""
+    old = {r["name"]: r for r in json.loads(Path(old_path).read_text())["results"]}
+    new = json.loads(Path(new_path).read_text())["results"]
+    for result in new:
+        before = old.get(result["name"])
+        if before is None or not before["rows_per_second"]:
+            print(f"{result['name']:<24} new")
+            continue
+        ratio = result["rows_per_second"] / before["rows_per_second"]
+        print(
+            f"{result['name']:<24} {before['rows_per_second']:>12.0f} -> "
+            f"{result['rows_per_second']:>12.0f} rows/s  x{ratio:.2f}"
+        )
+
+
+def main(argv: list[str] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--round-trip",
+        type=float,
+        default=0.0005,
+        help="seconds per round trip to the fake server",
+    )
+    parser.add_argument(
+        "--per-row", type=float, default=0.000001, help="seconds per row"
+    )
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument(
+        "--only", nargs="*", choices=sorted(BENCHMARKS), help="benchmarks to run"
+    )
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # keep the per copy stats of copy_table out of the benchmark output
+    logging.getLogger("etl_db_tools").setLevel(logging.WARNING)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    fake_pyodbc.reset()
+    fake_pyodbc.configure(args.round_trip, args.per_row)
+    fake_pyodbc.define_table(SOURCE_TABLE, SOURCE_COLUMNS, args.rows)
+
+    results = run(args.only or list(BENCHMARKS), args.rows, args.repeat)
+    report = {
+        "version": package_version(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "rows": args.rows,
+            "repeat": args.repeat,
+            "round_trip": args.round_trip,
+            "per_row": args.per_row,
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    logger.info("results written to %s", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+from array import array
+from collections.abc import Mapping
+import datetime
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, fall back to arrays and lists
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+# kind of column by the python type the driver reports in cursor.description
+_KINDS = {
+    bool: "bool",
+    int: "int",
+    float: "float",
+    datetime.datetime: "datetime",
+    datetime.date: "date",
+}
+
+# value to store in place of null, so numeric columns stay dense
+_FILL = {"bool": False, "int": 0, "float": 0.0}
+
+_NUMPY_DTYPES = {
+    "bool": "bool",
+    "int": "int64",
+    "float": "float64",
+    "datetime": "datetime64[us]",
+    "date": "datetime64[D]",
+}
+
+_ARRAY_TYPECODES = {"bool": "b", "int": "q", "float": "d"}
+
+
+def column_kind(type_code) -> str:
+    """Return the kind of a column from its cursor.description type code."""
+    return _KINDS.get(type_code, "object")
+
+
+def _to_array(values: tuple, kind: str, mask):
+    if mask is not None and kind in _FILL:
+        fill = _FILL[kind]
+        values = [fill if v is None else v for v in values]
+
+    if np is not None and kind in _NUMPY_DTYPES:
+        # nulls in date columns become NaT
+        return np.array(values, dtype=_NUMPY_DTYPES[kind])
+    if kind in _ARRAY_TYPECODES:
+        return array(_ARRAY_TYPECODES[kind], values)
+    # strings, decimals (kept exact), dates without numpy, etc.
+    return list(values)
+
+
+class ColumnBatch(Mapping):
+    """
+    A batch of rows stored per column. Maps every column name to an array of
+    values. Null values are tracked in masks: masks[name] is a sequence of
+    booleans (True is null), or None when the column has no nulls in this
+    batch. In the arrays nulls are stored as 0 / 0.0 / False for numeric
+    columns and as NaT for dates when NumPy is used, so those stay dense.
+    """
+
+    def __init__(self, columns: dict, masks: dict, num_rows: int) -> None:
+        self.columns = columns
+        self.masks = masks
+        self.num_rows = num_rows
+
+    @classmethod
+    def from_rows(cls, names: list[str], type_codes: list, rows: list):
+        """Pivot a list of row tuples into a column batch."""
+        if rows:
+            pivoted = list(zip(*rows))
+        else:
+            pivoted = [() for _ in names]
+
+        columns = {}
+        masks = {}
+        for name, type_code, values in zip(names, type_codes, pivoted):
+            kind = column_kind(type_code)
+            if None in values:
+                mask = [v is None for v in values]
+                if np is not None:
+                    mask = np.array(mask, dtype="bool")
+            else:
+                mask = None
+            columns[name] = _to_array(values, kind, mask)
+            masks[name] = mask
+
+        return cls(columns=columns, masks=masks, num_rows=len(rows))
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def __str__(self) -> str:
+        return f"batch: rows: {self.num_rows}, columns: {', '.join(self.columns)}"
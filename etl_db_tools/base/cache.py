@@ -0,0 +1,73 @@
+from etl_db_tools.base.schema import BaseTable
+from collections import OrderedDict
+import copy
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(table_name: str) -> str:
+    # sql server names are case insensitive and may be quoted
+    return table_name.replace("[", "").replace("]", "").lower()
+
+
+class TableCache:
+    """
+    Cache of table definitions, keyed by connection and table name. Entries
+    expire after ttl seconds (None keeps them until evicted) and the least
+    recently used entry is evicted when there are more than maxsize. Tables are
+    copied in and out, so callers can change the table they get.
+    """
+
+    def __init__(self, ttl: float = 300.0, maxsize: int = 256) -> None:
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, connection_key: str, table_name: str) -> BaseTable | None:
+        key = (connection_key, _normalize(table_name))
+        with self._lock:
+            entry = self._tables.get(key)
+            if entry is None:
+                return None
+            expires, table = entry
+            if expires is not None and expires <= time.monotonic():
+                del self._tables[key]
+                return None
+            self._tables.move_to_end(key)
+        logger.debug("table definition of %s from cache", table_name)
+        return copy.deepcopy(table)
+
+    def put(self, connection_key: str, table_name: str, table: BaseTable) -> None:
+        key = (connection_key, _normalize(table_name))
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        table = copy.deepcopy(table)
+        with self._lock:
+            self._tables[key] = (expires, table)
+            self._tables.move_to_end(key)
+            while len(self._tables) > self.maxsize:
+                self._tables.popitem(last=False)
+
+    def invalidate(self, table_name: str = None, connection_key: str = None) -> None:
+        """
+        Forget table_name, or every table when it is None. Limited to one
+        connection when connection_key is given.
+        """
+        name = None if table_name is None else _normalize(table_name)
+        with self._lock:
+            for key in list(self._tables):
+                if connection_key is not None and key[0] != connection_key:
+                    continue
+                if name is not None and key[1] != name:
+                    continue
+                del self._tables[key]
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+
+# process wide cache, pass it as table_cache to share definitions between connections
+shared_cache = TableCache()
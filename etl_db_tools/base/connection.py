@@ -1,6 +1,8 @@
 from abc import ABC
-from collections.abc import Iterator
+from collections.abc import Iterable, Iterator, Sequence
+from etl_db_tools.base.batch import ColumnBatch
 from etl_db_tools.base.schema import BaseTable
+from etl_db_tools.base.stats import Stats
 
 
 class Connection(ABC):
@@ -10,22 +12,109 @@ class Connection(ABC):
     def to_string(self):
         pass
 
-    def select_data(self, query: str) -> Iterator[list[dict]]:
+    def clone(self):
         pass
 
-    def execute_sql(self, query):
+    def connect(self):
+        pass
+
+    # the implementations take extra options, pass params and stats by keyword
+    def select_data(
+        self,
+        query: str,
+        row_type: type = dict,
+        fetch_size: int | str = 5000,
+        table: BaseTable = None,
+        params: Sequence = None,
+        stats: Stats = None,
+    ) -> Iterator[dict]:
+        pass
+
+    def select_batches(
+        self, query: str, batch_size: int = 5000, params: Sequence = None
+    ) -> Iterator[ColumnBatch]:
+        pass
+
+    def execute_sql(self, query, params: Sequence = None, commit: bool = True):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def transaction(self):
         pass
 
     def if_exists(self, table_name):
         pass
 
+    def drop_table(self, table_name: str):
+        pass
+
     def create_table(self, table: BaseTable, drop_if_exists: bool):
         pass
 
-    def sql_insert_dictionary(self, table: str | BaseTable, data: list[dict]):
+    def sql_insert_dictionary(
+        self,
+        table: str | BaseTable,
+        data: Iterable[dict],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> int:
+        pass
+
+    def sql_insert_list(
+        self,
+        table: str | BaseTable,
+        data: Iterable[list],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> int:
+        pass
+
+    def upsert(
+        self,
+        table: str | BaseTable,
+        rows: Iterable,
+        key_columns: list[str],
+        columns: list[str] = None,
+        chunk_size: int = 10_000,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> dict:
+        pass
+
+    def invalidate_table_cache(self, table_name: str = None):
+        pass
+
+    def quote_table_name(self, table_name: str) -> str:
+        pass
+
+    def table_definition(self, table_name: str) -> BaseTable:
+        pass
+
+    def insert_plan(
+        self,
+        table: BaseTable,
+        columns: list[str] = None,
+        mapping: bool = True,
+        stats: Stats = None,
+        engine: str | type = None,
+    ):
+        pass
+
+    def replace_table(self, temp_name: str, target_name: str):
         pass
 
-    def sql_insert_list(self, table: str | BaseTable, data: list[list]):
+    def list_tables(
+        self, schema: str, startswith: str = None, contains: str = None
+    ) -> list[str]:
         pass
 
     def __print__(self):
@@ -0,0 +1,204 @@
+from etl_db_tools.base.connection import Connection
+from etl_db_tools.base.insert_engines import (
+    ENGINES,
+    InsertEngine,
+    make_engine,
+    row_converter,
+)
+from etl_db_tools.base.schema import BaseTable
+from etl_db_tools.base.sizing import AdaptiveBatchSize
+from etl_db_tools.base.stats import NO_STATS, Stats
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from operator import itemgetter
+import copy
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class InsertPlan:
+    """Insert statement and row extraction for a table, prepared once.
+
+    columns is the order in which values are taken from each row: the keys to
+    read when the rows are mappings (mapping=True), or the position of each
+    value when the rows are sequences. It defaults to all columns of the table.
+    Build the plan once and call write() for every chunk. With stats, the time
+    spent rendering, preparing rows, inserting and committing is recorded.
+
+    engine sets how the rows are sent: "fast_executemany" (the default),
+    "values" (multi-row insert statements), "auto" (chosen per chunk from the
+    column types and the chunk size), another name in engines, or an
+    InsertEngine subclass, see insert_engines.
+
+    The parameter types (setinputsizes, see input_sizes) and the conversion of
+    the values to the python type of their column are derived from the table
+    definition once, when the plan is made, so the driver doesn't guess them
+    per chunk.
+
+    Each database subclasses the plan for its insert statement (render).
+    """
+
+    # the engines by name
+    engines = ENGINES
+
+    def __init__(
+        self,
+        connection: Connection,
+        table: BaseTable,
+        columns: list[str] = None,
+        mapping: bool = True,
+        stats: Stats = None,
+        engine: str | type[InsertEngine] = "fast_executemany",
+    ) -> None:
+        table_columns = {c.name: c for c in table.columns}
+        if columns is None:
+            columns = list(table_columns)
+
+        # All columns must be a column in the table, if not raise error
+        for c in columns:
+            if c not in table_columns:
+                raise KeyError(
+                    f"data column {c} does not match any column in the table object"
+                )
+
+        self.connection = connection
+        self.table = table
+        self.columns = list(columns)
+        self.mapping = mapping
+        self.index = {c: i for i, c in enumerate(self.columns)}
+        self.stats = stats if stats is not None else NO_STATS
+
+        # render the insert statement for exactly these columns, in this order
+        insert_table = copy.copy(table)
+        insert_table.columns = [table_columns[c] for c in self.columns]
+        with self.stats.measure("render insert"):
+            self.sql = self.render(insert_table)
+            self.engine = make_engine(
+                engine,
+                self.sql,
+                insert_table.columns,
+                table.name,
+                self.input_sizes(insert_table),
+                self.engines,
+            )
+            self._convert = row_converter(insert_table.columns)
+
+        if len(self.columns) == 1:
+            key = self.columns[0]
+            self._extract = lambda row: (row[key],)
+        else:
+            self._extract = itemgetter(*self.columns)
+
+    def render(self, table: BaseTable) -> str:
+        """The insert statement for exactly the columns of table."""
+        raise NotImplementedError
+
+    def input_sizes(self, table: BaseTable) -> list | None:
+        """The setinputsizes specification for exactly the columns of table,
+        None lets the driver bind every value by its python type."""
+        return None
+
+    def bind(self, connection: Connection, stats: Stats = None) -> "InsertPlan":
+        """Return the same plan writing to another connection, recording in
+        stats when given."""
+        plan = copy.copy(self)
+        plan.connection = connection
+        # engines keep state, e.g. whether their table type exists, per plan
+        plan.engine = self.engine.copy()
+        if stats is not None:
+            plan.stats = stats
+        return plan
+
+    def rows(self, chunk: list) -> list:
+        """Return the chunk as a list of value sequences in column order, with
+        the values converted to the python type of their column."""
+        if self.mapping:
+            try:
+                rows = list(map(self._extract, chunk))
+            except KeyError:
+                # some rows lack a key, those values are inserted as null
+                rows = [[row.get(c) for c in self.columns] for row in chunk]
+        else:
+            N = len(self.columns)
+            for row in chunk:
+                if len(row) != N:
+                    raise ValueError(f"expected a row with {N} values, got {len(row)}.")
+            rows = chunk
+
+        if self._convert is not None:
+            rows = list(map(self._convert, rows))
+        return rows
+
+    def write(self, chunk: list, commit: bool = True) -> None:
+        """Insert a chunk of rows and commit unless commit is False."""
+        if not chunk:
+            return
+        with self.stats.measure("prepare rows") as counts:
+            rows = self.rows(chunk)
+            counts.rows = len(rows)
+        engine = self.engine.choose(rows)
+        engine.prepare(self.connection)
+        with self.stats.measure(engine.stage) as counts:
+            engine.insert(self.connection.cursor, rows)
+            counts.rows = len(rows)
+        if commit:
+            with self.stats.measure("commit"):
+                self.connection.commit()
+
+    def write_all(
+        self,
+        rows: Iterable,
+        chunk_size: int | AdaptiveBatchSize = 10_000,
+        commit_every: int = None,
+    ) -> int:
+        """Insert any iterable of rows in chunks of chunk_size rows, or of the
+        size an AdaptiveBatchSize gives.
+
+        Commits once at the end, or whenever at least commit_every rows were
+        inserted since the last commit. Returns the number of rows inserted.
+        When a chunk fails, e.g. on a row of the wrong length, the rows inserted
+        since the last commit are rolled back (inside transaction(), the whole
+        transaction is) and the error is raised.
+        """
+        if isinstance(chunk_size, int) and chunk_size < 1:
+            raise ValueError(f"chunk_size must be at least 1, got {chunk_size}")
+
+        inserted = 0
+        uncommitted = 0
+        try:
+            for chunk in _chunks(rows, chunk_size):
+                self.write(chunk, commit=False)
+                inserted += len(chunk)
+                uncommitted += len(chunk)
+                if commit_every is not None and uncommitted >= commit_every:
+                    with self.stats.measure("commit"):
+                        self.connection.commit()
+                    uncommitted = 0
+        except BaseException:
+            # don't leave the earlier chunks for the next commit on the connection
+            self.connection.rollback()
+            raise
+        if uncommitted:
+            with self.stats.measure("commit"):
+                self.connection.commit()
+        return inserted
+
+
+def _chunks(rows: Iterable, chunk_length: int | AdaptiveBatchSize) -> Iterator[list]:
+    """Yield the rows as lists of at most chunk_length rows. With an
+    AdaptiveBatchSize every chunk takes its current size and is observed."""
+    iterator = iter(rows)
+    if isinstance(chunk_length, AdaptiveBatchSize):
+        sizer = chunk_length
+        while True:
+            chunk = list(islice(iterator, sizer.size))
+            if not chunk:
+                return
+            sizer.observe(chunk)
+            yield chunk
+    while True:
+        chunk = list(islice(iterator, chunk_length))
+        if not chunk:
+            return
+        yield chunk
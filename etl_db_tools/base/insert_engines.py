@@ -0,0 +1,348 @@
+from etl_db_tools.base.schema import Column
+from etl_db_tools.base.sizing import is_lob
+from collections.abc import Callable
+from itertools import chain
+import copy
+import datetime
+import decimal
+import logging
+
+logger = logging.getLogger(__name__)
+
+# SQL Server accepts at most 2100 parameters per statement and 1000 rows per
+# values list, lower than SQLite's limits
+MAX_PARAMETERS = 2099
+MAX_VALUES_ROWS = 1000
+
+
+def _to_decimal(value):
+    if isinstance(value, decimal.Decimal):
+        return value
+    if isinstance(value, float):
+        # through str, so 0.1 becomes Decimal("0.1")
+        return decimal.Decimal(str(value))
+    return decimal.Decimal(value)
+
+
+def _to_float(value):
+    return value if type(value) is float else float(value)
+
+
+def _to_bool(value):
+    return bool(value) if isinstance(value, int) else value
+
+
+def _to_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(value, datetime.time())
+    return value
+
+
+# the python type of the values of a column and the converter to it
+_CONVERTERS = {
+    "decimal": (decimal.Decimal, _to_decimal),
+    "numeric": (decimal.Decimal, _to_decimal),
+    "money": (decimal.Decimal, _to_decimal),
+    "smallmoney": (decimal.Decimal, _to_decimal),
+    "float": (float, _to_float),
+    "real": (float, _to_float),
+    "bit": (bool, _to_bool),
+    "date": (datetime.date, _to_date),
+    "smalldatetime": (datetime.datetime, _to_datetime),
+    "datetime": (datetime.datetime, _to_datetime),
+    "datetime2": (datetime.datetime, _to_datetime),
+}
+
+
+def value_converters(columns: list[Column]) -> list[tuple[int, type, Callable]]:
+    """
+    (position, python type, converter) for the columns whose values are
+    converted to the python type matching the column, e.g. floats to Decimal
+    for a decimal column. With one python type per column pyodbc binds a
+    column once, instead of rebinding when a value of another type turns up
+    mid chunk.
+    """
+    return [
+        (i, *_CONVERTERS[c.type])
+        for i, c in enumerate(columns)
+        if c.type in _CONVERTERS
+    ]
+
+
+def row_converter(columns: list[Column]) -> Callable | None:
+    """A function converting the values of a row in column order, see
+    value_converters, or None when no column needs converting. Rows with
+    values of the right type already are returned as they are."""
+    converters = value_converters(columns)
+    if not converters:
+        return None
+
+    def convert(row):
+        converted = None
+        for i, python_type, converter in converters:
+            value = row[i]
+            if value is None or type(value) is python_type:
+                continue
+            new = converter(value)
+            if new is not value:
+                if converted is None:
+                    converted = list(row)
+                converted[i] = new
+        return row if converted is None else converted
+
+    return convert
+
+
+class InsertEngine:
+    """
+    How an InsertPlan sends a chunk of rows to the database. An engine is made
+    once per plan from the rendered insert statement and the columns of the
+    insert, in order. stage is the name under which the inserts are timed.
+    input_sizes is the setinputsizes specification of one row (see
+    input_sizes), or None to let the driver derive the parameter types.
+    """
+
+    name = None
+    stage = None
+
+    def __init__(
+        self,
+        sql: str,
+        columns: list[Column],
+        table_name: str,
+        input_sizes: list = None,
+    ) -> None:
+        self.sql = sql
+        self.columns = columns
+        self.table_name = table_name
+        self.input_sizes = input_sizes
+
+    def choose(self, rows: list) -> "InsertEngine":
+        """The engine that inserts these rows, see AutoInsert."""
+        return self
+
+    def prepare(self, connection) -> None:
+        """Set up what the engine needs in the database, e.g. a table type.
+        Called before every insert, returns at once when it is done."""
+
+    def copy(self) -> "InsertEngine":
+        """The same engine with its own state, for a plan on another
+        connection."""
+        return copy.copy(self)
+
+    def insert(self, cursor, rows: list) -> None:
+        raise NotImplementedError
+
+
+class FastExecutemany(InsertEngine):
+    """executemany with pyodbc's fast_executemany: the rows are bound as
+    arrays and sent in as few round trips as the driver can."""
+
+    name = "fast_executemany"
+    stage = "executemany"
+
+    def insert(self, cursor, rows: list) -> None:
+        cursor.fast_executemany = True
+        if self.input_sizes is None:
+            cursor.executemany(self.sql, rows)
+            return
+        cursor.setinputsizes(self.input_sizes)
+        try:
+            cursor.executemany(self.sql, rows)
+        finally:
+            # the sizes would apply to the next statement on the cursor
+            cursor.setinputsizes(None)
+
+
+class ValuesInsert(InsertEngine):
+    """
+    Multi-row insert into ... values (?, ?), (?, ?) statements, each with as
+    many rows as fit in the parameter limit. Beats fast_executemany for (max)
+    columns and for small chunks.
+    """
+
+    name = "values"
+    stage = "values insert"
+
+    def __init__(
+        self,
+        sql: str,
+        columns: list[Column],
+        table_name: str,
+        input_sizes: list = None,
+    ) -> None:
+        super().__init__(sql, columns, table_name, input_sizes)
+        if len(columns) > MAX_PARAMETERS:
+            raise ValueError(
+                f"a values insert takes at most {MAX_PARAMETERS} columns, "
+                f"got {len(columns)}"
+            )
+        self.batch_rows = min(MAX_VALUES_ROWS, MAX_PARAMETERS // len(columns))
+        self._head = sql.rpartition("values")[0]
+        self._row = "(" + ", ".join("?" for _ in columns) + ")"
+        self._statements = {}
+
+    def statement(self, n: int) -> str:
+        """The insert statement for n rows, rendered once per size."""
+        sql = self._statements.get(n)
+        if sql is None:
+            sql = self._head + "values " + ", ".join([self._row] * n)
+            self._statements[n] = sql
+        return sql
+
+    def insert(self, cursor, rows: list) -> None:
+        sized = None
+        try:
+            for start in range(0, len(rows), self.batch_rows):
+                batch = rows[start : start + self.batch_rows]
+                if self.input_sizes is not None and len(batch) != sized:
+                    cursor.setinputsizes(self.input_sizes * len(batch))
+                    sized = len(batch)
+                cursor.execute(
+                    self.statement(len(batch)), list(chain.from_iterable(batch))
+                )
+        finally:
+            if sized is not None:
+                cursor.setinputsizes(None)
+
+
+class StreamingInsert(InsertEngine):
+    """
+    executemany without fast_executemany: one row per round trip, so the
+    driver holds no parameter arrays and streams the (max) values of each
+    row. Slower, but the memory it takes doesn't grow with the chunk.
+    """
+
+    name = "streaming"
+    stage = "streaming insert"
+
+    def insert(self, cursor, rows: list) -> None:
+        cursor.fast_executemany = False
+        if self.input_sizes is None:
+            cursor.executemany(self.sql, rows)
+            return
+        cursor.setinputsizes(self.input_sizes)
+        try:
+            cursor.executemany(self.sql, rows)
+        finally:
+            cursor.setinputsizes(None)
+
+
+class StreamingFallback(InsertEngine):
+    """
+    Inserts with engine until sizer reports that the rows are too large to
+    buffer many at once (see base.sizing.TableBatchSize), then with
+    StreamingInsert.
+    """
+
+    name = "streaming fallback"
+
+    def __init__(self, engine: InsertEngine, sizer) -> None:
+        super().__init__(
+            engine.sql, engine.columns, engine.table_name, engine.input_sizes
+        )
+        self.engine = engine
+        self.sizer = sizer
+        self.streaming = StreamingInsert(
+            engine.sql, engine.columns, engine.table_name, engine.input_sizes
+        )
+        self._logged = False
+
+    def copy(self) -> InsertEngine:
+        # the sizer is shared, it observes the chunks of every copy
+        engine = copy.copy(self)
+        engine.engine = self.engine.copy()
+        engine.streaming = self.streaming.copy()
+        return engine
+
+    def choose(self, rows: list) -> InsertEngine:
+        if not self.sizer.streaming:
+            return self.engine.choose(rows)
+        if not self._logged:
+            self._logged = True
+            logger.info(
+                "rows of %s take about %.0f bytes, inserting them one by one",
+                self.table_name,
+                self.sizer.row_bytes,
+            )
+        return self.streaming
+
+    def insert(self, cursor, rows: list) -> None:
+        self.choose(rows).insert(cursor, rows)
+
+
+class AutoInsert(InsertEngine):
+    """
+    Picks an engine per chunk: multi-row values for tables with (max)
+    columns and for chunks that fit in one statement, fast_executemany
+    otherwise. TVPs need permission to create types, pick them explicitly.
+    """
+
+    name = "auto"
+
+    def __init__(
+        self,
+        sql: str,
+        columns: list[Column],
+        table_name: str,
+        input_sizes: list = None,
+    ) -> None:
+        super().__init__(sql, columns, table_name, input_sizes)
+        self.fast = FastExecutemany(sql, columns, table_name, input_sizes)
+        self.values = None
+        if len(columns) <= MAX_PARAMETERS:
+            self.values = ValuesInsert(sql, columns, table_name, input_sizes)
+        self.has_lob = any(is_lob(c) for c in columns)
+
+    def copy(self) -> InsertEngine:
+        engine = copy.copy(self)
+        engine.fast = self.fast.copy()
+        if self.values is not None:
+            engine.values = self.values.copy()
+        return engine
+
+    def choose(self, rows: list) -> InsertEngine:
+        if self.values is None:
+            return self.fast
+        if self.has_lob or len(rows) * len(self.columns) <= MAX_PARAMETERS:
+            return self.values
+        return self.fast
+
+    def insert(self, cursor, rows: list) -> None:
+        self.choose(rows).insert(cursor, rows)
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (
+        FastExecutemany,
+        ValuesInsert,
+        StreamingInsert,
+        AutoInsert,
+    )
+}
+
+
+def make_engine(
+    engine: str | type,
+    sql: str,
+    columns: list[Column],
+    table_name: str,
+    input_sizes: list = None,
+    engines: dict = None,
+) -> InsertEngine:
+    """Make an engine by name or from an InsertEngine subclass. The names are
+    those of engines, ENGINES by default."""
+    if engines is None:
+        engines = ENGINES
+    if isinstance(engine, str):
+        if engine not in engines:
+            raise ValueError(
+                f"engine must be one of {', '.join(engines)}, got {engine}"
+            )
+        engine = engines[engine]
+    return engine(sql, columns, table_name, input_sizes)
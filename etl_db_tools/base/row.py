@@ -0,0 +1,48 @@
+from collections.abc import Mapping
+
+
+class Row(Mapping):
+    """
+    Read only view of one result row. The values stay in the tuple returned by
+    the driver, the column names are looked up in an index that is shared by
+    all rows of the same result set. Supports row['col'], row.get('col') and
+    the rest of the (read only) dict interface.
+    """
+
+    __slots__ = ("_values", "_index")
+
+    def __init__(self, values, index: dict[str, int]) -> None:
+        self._values = values
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._values[self._index[key]]
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        if i is None:
+            return default
+        return self._values[i]
+
+    def __contains__(self, key) -> bool:
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self):
+        return self._index.keys()
+
+    def to_tuple(self) -> tuple:
+        return tuple(self._values)
+
+    def __repr__(self) -> str:
+        return f"Row({dict(self)})"
+
+    @staticmethod
+    def index(columns: list[str]) -> dict[str, int]:
+        """Build the column index to share between the rows of a result set."""
+        return {c: i for i, c in enumerate(columns)}
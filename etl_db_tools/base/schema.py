@@ -1,11 +1,19 @@
 from abc import ABC
+from functools import lru_cache
 from jinja2 import Environment, PackageLoader
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+@lru_cache(maxsize=None)
+def _environment() -> Environment:
+    # one environment for the whole process, so templates are loaded and compiled once
+    return Environment(loader=PackageLoader("etl_db_tools", "templates"))
+
+
 def sql_render(template: str, data) -> str:
-    env = Environment(loader=PackageLoader("etl_db_tools", "templates"))
+    env = _environment()
 
     template = env.get_template(template)
 
@@ -128,10 +136,32 @@ class Column(ABC):
                     ]
                 )
 
+            case "binary" | "varbinary":
+                defaultpart = (
+                    None if self.default is None else f"default (({self.default}))"
+                )
+                if self.length == -1 or self.length > 8000:
+                    type_complete = f"{self.type}(max)"
+                else:
+                    type_complete = f"{self.type}({self.length})"
+                sql = " ".join(
+                    [
+                        x
+                        for x in [self.name, type_complete, nullpart, defaultpart]
+                        if x is not None
+                    ]
+                )
+
+            case "timestamp" | "rowversion":
+                # the server fills a rowversion itself, a copy keeps the value as binary
+                sql = " ".join(
+                    [x for x in [self.name, "binary(8)", nullpart] if x is not None]
+                )
+
             case _:
                 raise ValueError(f"Data type not implemented: {self.type}")
 
-        logger.debug()
+        logger.debug("column sql: %s", sql)
 
         return sql.strip()
 
@@ -143,6 +173,9 @@ class Column(ABC):
 
 
 class BaseTable(ABC):
+    # the column class of the dialect, see from_table
+    column_class = Column
+
     def __init__(self, name, columns: list[Column] = None) -> None:
         self.name = name
         self.columns = []
@@ -150,11 +183,25 @@ class BaseTable(ABC):
             for col in columns:
                 self.add_column(col)
 
+    @classmethod
+    def from_table(cls, table: "BaseTable") -> "BaseTable":
+        """The same table definition in the dialect of cls, e.g. to create a
+        table read from one database in another."""
+        columns = [
+            cls.column_class(
+                c.name, c.type, c.nullable, c.length, c.precission, c.scale, c.default
+            )
+            for c in table.columns
+        ]
+        return cls(table.name, columns)
+
     def column_names(self) -> list[str]:
         return [x.name for x in self.columns]
 
     def add_column(self, column: Column) -> None:
-        logger.debug("this column is an Column instance: %s ", isinstance(column, Column))
+        logger.debug(
+            "this column is an Column instance: %s ", isinstance(column, Column)
+        )
         if isinstance(column, Column):
             self.columns.append(column)
         else:
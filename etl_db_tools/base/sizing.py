@@ -0,0 +1,204 @@
+from etl_db_tools.base.schema import BaseTable, Column
+import datetime
+import decimal
+import logging
+
+logger = logging.getLogger(__name__)
+
+# assumed size of one (max) value, we can't know it until we see the data
+LOB_BYTES = 16 * 1024
+
+# bytes per value for types without a length
+_TYPE_BYTES = {
+    "bit": 1,
+    "tinyint": 1,
+    "smallint": 2,
+    "int": 4,
+    "bigint": 8,
+    "float": 8,
+    "real": 4,
+    "decimal": 17,
+    "numeric": 17,
+    "money": 8,
+    "date": 3,
+    "datetime": 8,
+    "datetime2": 8,
+    "smalldatetime": 4,
+    "uniqueidentifier": 16,
+}
+
+_PYTHON_TYPE_BYTES = {
+    bool: 1,
+    int: 8,
+    float: 8,
+    decimal.Decimal: 17,
+    datetime.date: 3,
+    datetime.datetime: 8,
+}
+
+
+def is_lob(column: Column) -> bool:
+    """
+    True for (max) and other large object columns, whose length says nothing
+    about their values and whose values the driver streams. Lengths are in
+    characters, at most 4000 for the unicode types and 8000 for the others.
+    """
+    if column.type in ("nvarchar", "nchar", "varchar", "char", "varbinary", "binary"):
+        if column.length is None or column.length == -1:
+            return True
+        limit = 4000 if column.type in ("nvarchar", "nchar") else 8000
+        return column.length > limit
+    return column.type in ("text", "ntext", "image", "xml")
+
+
+def column_bytes(column: Column) -> int:
+    """Estimate the size of one value of a column from its definition."""
+    if is_lob(column):
+        return LOB_BYTES
+    if column.type in ("nvarchar", "nchar", "varchar", "char", "varbinary", "binary"):
+        # unicode types take two bytes per character
+        width = 2 if column.type in ("nvarchar", "nchar") else 1
+        return column.length * width
+    return _TYPE_BYTES.get(column.type, 16)
+
+
+def description_bytes(description, table=None) -> int:
+    """
+    Estimate the size of one row from a cursor.description. Column definitions
+    from table are used where the names match, those know about (max) columns.
+    """
+    columns = {c.name: c for c in table.columns} if table is not None else {}
+
+    total = 0
+    for name, type_code, _display_size, internal_size, *_ in description:
+        if name in columns:
+            total += column_bytes(columns[name])
+        elif type_code in (str, bytes, bytearray):
+            if not internal_size or internal_size > 8000:
+                total += LOB_BYTES
+            else:
+                total += internal_size * (2 if type_code is str else 1)
+        else:
+            total += _PYTHON_TYPE_BYTES.get(type_code, 16)
+    return max(total, 1)
+
+
+def value_bytes(value) -> int:
+    """Size of an actual value, as used by the driver buffers."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return 2 * len(value)
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return _PYTHON_TYPE_BYTES.get(type(value), 16)
+
+
+def rows_bytes(rows: list, sample: int = 50) -> float:
+    """Average size of a row, measured on at most sample rows spread over rows."""
+    if not rows:
+        return 0.0
+    step = max(len(rows) // sample, 1)
+    measured = rows[::step]
+    total = sum(value_bytes(v) for row in measured for v in row)
+    return total / len(measured)
+
+
+class AdaptiveBatchSize:
+    """
+    Number of rows per batch that keeps a batch within target_bytes. Starts from
+    an estimated row size and follows the sizes of the rows that are observed.
+    """
+
+    def __init__(
+        self,
+        row_bytes: float,
+        target_bytes: int = 8 * 1024 * 1024,
+        minimum: int = 1,
+        maximum: int = 100_000,
+    ) -> None:
+        self.target_bytes = target_bytes
+        self.minimum = minimum
+        self.maximum = maximum
+        self.row_bytes = max(row_bytes, 1)
+        self.observed = False
+
+    @property
+    def size(self) -> int:
+        size = int(self.target_bytes // self.row_bytes)
+        return min(max(size, self.minimum), self.maximum)
+
+    def observe(self, rows: list) -> None:
+        """Adjust the row size estimate with a batch of rows."""
+        self.update(rows_bytes(rows))
+
+    def update(self, measured: float) -> None:
+        """Adjust the row size estimate with a measured average row size."""
+        if measured <= 0:
+            return
+        if self.observed:
+            # smooth, so one odd batch doesn't swing the size
+            self.row_bytes = (self.row_bytes + measured) / 2
+        else:
+            self.row_bytes = measured
+            self.observed = True
+        logger.debug(
+            "row size %.0f bytes, batch size %s rows", self.row_bytes, self.size
+        )
+
+
+class TableBatchSize(AdaptiveBatchSize):
+    """
+    Number of rows per insert chunk that keeps a chunk within target_bytes.
+    The driver buffers a value of every column with a length at its full
+    length, so those count with the size of their definition. The (max)
+    columns are measured on the observed rows; until rows are observed a table
+    with (max) columns is sized from LOB_BYTES per value and probed with at
+    most probe rows.
+
+    streaming is True when fewer than stream_below rows of the observed size
+    fit in target_bytes, the rows are then better sent one by one.
+    """
+
+    def __init__(
+        self,
+        table: BaseTable,
+        target_bytes: int = 64 * 1024 * 1024,
+        minimum: int = 1,
+        maximum: int = 100_000,
+        probe: int = 100,
+        stream_below: int = 100,
+    ) -> None:
+        self.lob_positions = [i for i, c in enumerate(table.columns) if is_lob(c)]
+        self.fixed_bytes = sum(column_bytes(c) for c in table.columns if not is_lob(c))
+        self.probe = probe
+        self.stream_below = stream_below
+        super().__init__(
+            self.fixed_bytes + LOB_BYTES * len(self.lob_positions),
+            target_bytes,
+            minimum,
+            maximum,
+        )
+
+    @property
+    def size(self) -> int:
+        size = super().size
+        if self.lob_positions and not self.observed:
+            return min(size, max(self.probe, self.minimum))
+        return size
+
+    @property
+    def streaming(self) -> bool:
+        return (
+            bool(self.lob_positions)
+            and self.observed
+            and self.target_bytes / self.row_bytes < self.stream_below
+        )
+
+    def observe(self, rows: list) -> None:
+        """Adjust the row size estimate with the (max) values of rows."""
+        if not self.lob_positions or not rows:
+            return
+        step = max(len(rows) // 50, 1)
+        values = [[row[i] for i in self.lob_positions] for row in rows[::step]]
+        self.update(self.fixed_bytes + rows_bytes(values, sample=len(values)))
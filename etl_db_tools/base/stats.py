@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """Cumulative totals of one stage: wall time, number of calls, rows and bytes."""
+
+    __slots__ = ("seconds", "calls", "rows", "bytes")
+
+    def __init__(self) -> None:
+        self.seconds = 0.0
+        self.calls = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "seconds": self.seconds,
+            "calls": self.calls,
+            "rows": self.rows,
+            "bytes": self.bytes,
+        }
+
+    def __repr__(self) -> str:
+        return (
+            f"Stage(seconds={self.seconds:.3f}, calls={self.calls}, "
+            f"rows={self.rows}, bytes={self.bytes})"
+        )
+
+
+class Stats:
+    """
+    Wall time and row/byte counts per stage of a copy or insert, e.g. fetch,
+    build rows, prepare rows, executemany. Stages run on several threads (in a
+    pipelined or parallel copy) are summed, so their time can exceed the
+    elapsed time. Safe to share between threads.
+
+        stats = Stats()
+        with stats.measure("fetch") as counts:
+            rows = cursor.fetchmany(1000)
+            counts.rows = len(rows)
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float, rows: int = 0, bytes: int = 0) -> None:
+        with self._lock:
+            totals = self.stages.get(stage)
+            if totals is None:
+                totals = self.stages[stage] = Stage()
+            totals.seconds += seconds
+            totals.calls += 1
+            totals.rows += rows
+            totals.bytes += bytes
+
+    @contextmanager
+    def measure(self, stage: str):
+        """Time the block as one call of stage. Set rows and bytes on the
+        yielded object to count them."""
+        counts = _Counts()
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(stage, time.perf_counter() - start, counts.rows, counts.bytes)
+
+    def merge(self, other: "Stats") -> None:
+        """Add the totals of other to these stats."""
+        for name, stage in list(other.stages.items()):
+            with self._lock:
+                totals = self.stages.get(name)
+                if totals is None:
+                    totals = self.stages[name] = Stage()
+                totals.seconds += stage.seconds
+                totals.calls += stage.calls
+                totals.rows += stage.rows
+                totals.bytes += stage.bytes
+
+    def __getitem__(self, stage: str) -> Stage:
+        return self.stages[stage]
+
+    def __contains__(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def to_dict(self) -> dict:
+        return {name: stage.to_dict() for name, stage in self.stages.items()}
+
+    def log(self, level: int = logging.INFO, title: str = "stats", log=logger) -> None:
+        """Write one line per stage to log at level."""
+        if not log.isEnabledFor(level):
+            return
+        for name, stage in self.stages.items():
+            log.log(
+                level,
+                "%s %s: %.3fs in %s calls, %s rows, %s bytes",
+                title,
+                name,
+                stage.seconds,
+                stage.calls,
+                stage.rows,
+                stage.bytes,
+            )
+
+    def __repr__(self) -> str:
+        return f"Stats({self.stages!r})"
+
+
+class _Counts:
+    __slots__ = ("rows", "bytes")
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.bytes = 0
+
+
+class _NoStats(Stats):
+    """Stands in when no stats are asked for, measure() only runs the block."""
+
+    def add(self, stage: str, seconds: float, rows: int = 0, bytes: int = 0) -> None:
+        pass
+
+    @contextmanager
+    def measure(self, stage: str):
+        yield _Counts()
+
+
+NO_STATS = _NoStats()
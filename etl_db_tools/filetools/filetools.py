@@ -0,0 +1,491 @@
+from etl_db_tools.base.connection import Connection
+from etl_db_tools.base.schema import BaseTable, Column
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from itertools import chain, islice
+import csv
+import datetime
+import decimal
+import gzip
+import os
+import queue
+import threading
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed for parquet files
+    pa = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, only needed for zstd compression
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def _batches(rows, batch_size: int) -> Iterator[list]:
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _compression_from_path(path: str) -> str | None:
+    if path.endswith(".gz"):
+        return "gzip"
+    if path.endswith(".zst"):
+        return "zstd"
+    return None
+
+
+def _open_text(path: str, mode: str, compression: str = None):
+    """Open a text file for csv, optionally gzip or zstd compressed."""
+    if compression is None:
+        return open(path, mode, newline="", encoding="utf-8")
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", newline="", encoding="utf-8")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package")
+        return zstandard.open(path, mode + "t", newline="", encoding="utf-8")
+    raise ValueError(f"compression must be None, 'gzip' or 'zstd', got {compression}")
+
+
+@contextmanager
+def _remove_on_error(path: str):
+    """Remove the file at path when the block fails, so no partial file is left."""
+    try:
+        yield
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+
+
+# sentinel that tells the background thread there is no more work
+_END_OF_DATA = object()
+
+
+class _BackgroundWriter:
+    """
+    Calls write(item) for every item that is put, on a separate thread. At most
+    queue_depth items wait in between. An error on the writing thread is raised
+    by the next put() or at exit.
+    """
+
+    def __init__(self, write, queue_depth: int = 4) -> None:
+        self._write = write
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run, name="file-writer", daemon=True
+        )
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _END_OF_DATA:
+                return
+            if self._error is not None:
+                # keep draining, so put() never blocks on a dead writer
+                continue
+            try:
+                self._write(item)
+            except BaseException as e:
+                self._error = e
+
+    def put(self, item) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(item)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._queue.put(_END_OF_DATA)
+        self._thread.join()
+        if exc_type is None and self._error is not None:
+            raise self._error
+
+
+def _export_csv(
+    connection: Connection,
+    query: str,
+    path: str,
+    compression: str,
+    batch_size: int,
+    delimiter: str,
+    header: bool,
+    params: Sequence,
+    queue_depth: int,
+) -> int:
+    rows = connection.select_data(
+        query, row_type=tuple, fetch_size=batch_size, params=params
+    )
+    batches = _batches(rows, batch_size)
+    # fetch the first batch, after that the cursor knows the columns
+    first = next(batches, [])
+    description = connection.cursor.description
+    binary = [i for i, d in enumerate(description) if d[1] in (bytes, bytearray)]
+
+    with _remove_on_error(path), _open_text(path, "w", compression) as f:
+        writer = csv.writer(f, delimiter=delimiter)
+
+        def write(batch: list) -> None:
+            if binary:
+                # write binary values as hex instead of python's b'...'
+                batch = [list(row) for row in batch]
+                for row in batch:
+                    for i in binary:
+                        if row[i] is not None:
+                            row[i] = row[i].hex()
+            writer.writerows(batch)
+
+        written = 0
+        with _BackgroundWriter(write, queue_depth) as background:
+            if header:
+                background.put([[d[0] for d in description]])
+            for batch in chain([first], batches):
+                if batch:
+                    background.put(batch)
+                    written += len(batch)
+    return written
+
+
+def _arrow_type(description_row):
+    _name, type_code, _display_size, _internal_size, precision, scale, _ = (
+        description_row
+    )
+    if type_code is bool:
+        return pa.bool_()
+    if type_code is int:
+        return pa.int64()
+    if type_code is float:
+        return pa.float64()
+    if type_code is decimal.Decimal:
+        return pa.decimal128(precision or 38, scale or 0)
+    if type_code is datetime.datetime:
+        return pa.timestamp("us")
+    if type_code is datetime.date:
+        return pa.date32()
+    if type_code in (bytes, bytearray):
+        return pa.binary()
+    return pa.string()
+
+
+def _arrow_array(values, mask, arrow_type):
+    if np is not None and isinstance(values, np.ndarray):
+        return pa.array(values, type=arrow_type, mask=mask)
+    values = list(values)
+    if mask is not None:
+        values = [None if m else v for v, m in zip(values, mask)]
+    return pa.array(values, type=arrow_type)
+
+
+def _export_parquet(
+    connection: Connection,
+    query: str,
+    path: str,
+    compression: str,
+    batch_size: int,
+    row_group_size: int,
+    params: Sequence,
+) -> int:
+    if pa is None:
+        raise ImportError("parquet files need the pyarrow package")
+
+    batches = connection.select_batches(query, batch_size, params=params)
+    first = next(batches, None)
+    description = connection.cursor.description
+    schema = pa.schema([(d[0], _arrow_type(d)) for d in description])
+
+    written = 0
+    pending = []
+    pending_rows = 0
+    with (
+        _remove_on_error(path),
+        pq.ParquetWriter(path, schema, compression=compression or "none") as writer,
+    ):
+        for batch in chain([first], batches):
+            if batch is None:
+                continue
+            arrays = [
+                _arrow_array(batch[field.name], batch.masks[field.name], field.type)
+                for field in schema
+            ]
+            pending.append(pa.record_batch(arrays, schema=schema))
+            pending_rows += batch.num_rows
+            written += batch.num_rows
+            # only keep one row group in memory: write full groups and carry
+            # the rest over, so every group but the last has row_group_size rows
+            if pending_rows >= row_group_size:
+                table = pa.Table.from_batches(pending, schema=schema)
+                start = 0
+                while pending_rows - start >= row_group_size:
+                    writer.write_table(
+                        table.slice(start, row_group_size),
+                        row_group_size=row_group_size,
+                    )
+                    start += row_group_size
+                pending = table.slice(start).to_batches()
+                pending_rows -= start
+        if pending:
+            writer.write_table(
+                pa.Table.from_batches(pending, schema=schema),
+                row_group_size=row_group_size,
+            )
+    return written
+
+
+class _Prefetch:
+    """
+    Iterates over items on a separate thread, at most queue_depth items ahead
+    of the consumer. An error on that thread is raised to the consumer.
+    """
+
+    def __init__(self, items, queue_depth: int = 4) -> None:
+        self._items = items
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="file-reader", daemon=True
+        )
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self) -> None:
+        try:
+            for item in self._items:
+                if not self._put(item):
+                    return
+        except BaseException as e:
+            self._put(e)
+            return
+        self._put(_END_OF_DATA)
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _END_OF_DATA:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # the consumer stopped early or failed, stop reading
+            self._stop.set()
+            self._thread.join()
+            if hasattr(self._items, "close"):
+                self._items.close()
+
+
+def _parse_bit(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+def _converter(column: Column):
+    """Function that turns a text field into a value for column, None for text."""
+    match column.type:
+        case "int" | "tinyint" | "smallint" | "bigint":
+            return int
+        case "bit":
+            return _parse_bit
+        case "decimal" | "numeric" | "money":
+            return decimal.Decimal
+        case "float" | "real":
+            return float
+        case "date":
+            return datetime.date.fromisoformat
+        case "datetime" | "datetime2" | "smalldatetime":
+            return datetime.datetime.fromisoformat
+        case "binary" | "varbinary" | "timestamp" | "rowversion":
+            return bytes.fromhex
+        case _:
+            return None
+
+
+def _parse_rows(rows, converters: list, null_value: str) -> Iterator[list]:
+    """Convert text rows, fields equal to null_value become None."""
+    converting = [(i, f) for i, f in enumerate(converters) if f is not None]
+    for row in rows:
+        values = [None if v == null_value else v for v in row]
+        for i, f in converting:
+            v = values[i]
+            if v is not None:
+                values[i] = f(v)
+        yield values
+
+
+def _csv_chunks(
+    path: str,
+    table: BaseTable,
+    columns: list[str] | None,
+    header: bool,
+    delimiter: str,
+    null_value: str,
+    compression: str,
+    chunk_size: int,
+):
+    """Return the column names and an iterator of converted chunks of a csv file."""
+    f = _open_text(path, "r", compression)
+    reader = csv.reader(f, delimiter=delimiter)
+    file_columns = next(reader, None) if header else None
+    if columns is None:
+        columns = file_columns if file_columns is not None else table.column_names()
+
+    table_columns = {c.name: c for c in table.columns}
+    for c in columns:
+        if c not in table_columns:
+            f.close()
+            raise KeyError(f"file column {c} does not match any column in {table.name}")
+    converters = [_converter(table_columns[c]) for c in columns]
+
+    def chunks():
+        with f:
+            yield from _batches(_parse_rows(reader, converters, null_value), chunk_size)
+
+    return columns, chunks()
+
+
+def _parquet_chunks(
+    path: str, table: BaseTable, columns: list[str] | None, chunk_size: int
+):
+    """Return the column names and an iterator of row chunks of a parquet file."""
+    if pa is None:
+        raise ImportError("parquet files need the pyarrow package")
+    parquet_file = pq.ParquetFile(path)
+    if columns is None:
+        columns = parquet_file.schema_arrow.names
+
+    def chunks():
+        for batch in parquet_file.iter_batches(batch_size=chunk_size, columns=columns):
+            yield list(zip(*(batch.column(c).to_pylist() for c in columns)))
+
+    return columns, chunks()
+
+
+def load_file(
+    connection: Connection,
+    path: str,
+    table: str | BaseTable,
+    format: str = "csv",
+    columns: list[str] = None,
+    header: bool = True,
+    delimiter: str = ",",
+    null_value: str = "",
+    compression: str = "infer",
+    chunk_size: int = 10_000,
+    queue_depth: int = 4,
+) -> int:
+    """Load a csv or parquet file into an existing table.
+
+    The file is read and converted in chunks of chunk_size rows on a separate
+    thread, at most queue_depth chunks ahead of the inserts, so memory use
+    doesn't depend on the size of the file. csv fields are converted to the
+    types of the table columns, fields equal to null_value become null.
+    columns are the table columns in the order of the file; by default the csv
+    header (or all table columns when header is False) or the parquet column
+    names. compression "infer" looks at the .gz / .zst extension. Returns the
+    number of rows loaded.
+    """
+    if isinstance(table, str):
+        table = connection.table_definition(table)
+
+    if format == "csv":
+        if compression == "infer":
+            compression = _compression_from_path(path)
+        columns, chunks = _csv_chunks(
+            path,
+            table,
+            columns,
+            header=header,
+            delimiter=delimiter,
+            null_value=null_value,
+            compression=compression,
+            chunk_size=chunk_size,
+        )
+    elif format == "parquet":
+        columns, chunks = _parquet_chunks(path, table, columns, chunk_size)
+    else:
+        raise ValueError(f"format must be 'csv' or 'parquet', got {format}")
+
+    plan = connection.insert_plan(table, columns, mapping=False)
+    loaded = 0
+    for chunk in _Prefetch(chunks, queue_depth):
+        connection.sql_insert_list(plan, chunk)
+        loaded += len(chunk)
+
+    logger.info("loaded %s rows from %s into %s", loaded, path, table.name)
+    return loaded
+
+
+def export_query(
+    connection: Connection,
+    query: str,
+    path: str,
+    format: str = "csv",
+    compression: str = None,
+    batch_size: int = 10_000,
+    row_group_size: int = 100_000,
+    delimiter: str = ",",
+    header: bool = True,
+    params: Sequence = None,
+    queue_depth: int = 4,
+) -> int:
+    """Write the result of a query to a csv or parquet file.
+
+    The result is streamed in batches of batch_size rows, so memory use doesn't
+    depend on the size of the result. csv files can be gzip or zstd compressed
+    and are written on a background thread, so fetching and writing overlap.
+    parquet files (which need pyarrow) are written in row groups of
+    row_group_size rows, compression is passed on to pyarrow. A file that
+    could not be written completely is removed. Returns the number of rows.
+    """
+    if format == "csv":
+        written = _export_csv(
+            connection,
+            query,
+            path,
+            compression=compression,
+            batch_size=batch_size,
+            delimiter=delimiter,
+            header=header,
+            params=params,
+            queue_depth=queue_depth,
+        )
+    elif format == "parquet":
+        written = _export_parquet(
+            connection,
+            query,
+            path,
+            compression=compression,
+            batch_size=batch_size,
+            row_group_size=row_group_size,
+            params=params,
+        )
+    else:
+        raise ValueError(f"format must be 'csv' or 'parquet', got {format}")
+
+    logger.info("exported %s rows to %s", written, path)
+    return written
@@ -0,0 +1,724 @@
+from etl_db_tools.base.batch import ColumnBatch
+from etl_db_tools.base.connection import Connection
+from etl_db_tools.base.insert import InsertPlan as BaseInsertPlan
+from etl_db_tools.base.insert_engines import value_converters
+from etl_db_tools.base.row import Row
+from etl_db_tools.base.schema import BaseTable, Column
+from etl_db_tools.base.stats import NO_STATS, Stats
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from itertools import chain
+import copy
+import datetime
+import decimal
+import re
+import sqlite3
+import warnings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# SQLite tables keep the SQL Server type names of their columns, e.g.
+# nvarchar(50) or decimal(18,2). SQLite derives the storage of a column from
+# the type name, and the declared names give back the column definitions.
+# Decimals and dates are stored as text and converted here, not with
+# sqlite3.register_adapter/register_converter, which change every sqlite3
+# connection in the process: on the way in by the python type of the value,
+# on the way out by the column type in a table definition.
+
+
+def _datetime_to_text(value: datetime.datetime) -> str:
+    return value.isoformat(" ")
+
+
+# storage of the python types sqlite3 doesn't bind itself
+_TO_STORAGE = {
+    decimal.Decimal: str,
+    datetime.date: datetime.date.isoformat,
+    datetime.datetime: _datetime_to_text,
+}
+
+
+def _to_storage(value):
+    adapter = _TO_STORAGE.get(type(value))
+    return value if adapter is None else adapter(value)
+
+
+def _to_datetime(value) -> datetime.datetime:
+    return datetime.datetime.fromisoformat(value)
+
+
+def _to_date(value) -> datetime.date:
+    return datetime.date.fromisoformat(value[:10])
+
+
+def _to_decimal(value) -> decimal.Decimal:
+    # the numeric affinity of the column may have stored the text as a number
+    return decimal.Decimal(str(value))
+
+
+# the python type of the stored values of a column, by its SQL Server type
+_FROM_STORAGE = {
+    "datetime": _to_datetime,
+    "datetime2": _to_datetime,
+    "smalldatetime": _to_datetime,
+    "date": _to_date,
+    "decimal": _to_decimal,
+    "numeric": _to_decimal,
+    "money": _to_decimal,
+    "smallmoney": _to_decimal,
+    "bit": bool,
+}
+
+
+def _storage_converters(columns: list[Column]) -> list[tuple[int, Callable]]:
+    """(position, converter to storage) for the values inserted in columns,
+    which the insert plan already converted to the python type of their
+    column."""
+    return [
+        (i, _TO_STORAGE[python_type])
+        for i, python_type, _ in value_converters(columns)
+        if python_type in _TO_STORAGE
+    ]
+
+
+def _read_converters(names: list[str], table: BaseTable) -> list[tuple[int, Callable]]:
+    """(position, converter) for the result columns named like a column of
+    table whose stored values are converted when reading."""
+    if table is None:
+        return []
+    types = {c.name: c.type for c in table.columns}
+    return [
+        (i, _FROM_STORAGE[types[name]])
+        for i, name in enumerate(names)
+        if types.get(name) in _FROM_STORAGE
+    ]
+
+
+def _convert(rows: list, converters: list[tuple[int, Callable]]) -> list:
+    """Apply converters to the non null values of rows."""
+    converted = []
+    for row in rows:
+        row = list(row)
+        for i, converter in converters:
+            if row[i] is not None:
+                row[i] = converter(row[i])
+        converted.append(row)
+    return converted
+
+
+# names of the SQLite storage classes, as SQL Server types
+_NATIVE_TYPES = {
+    "integer": ("bigint", None),
+    "text": ("nvarchar", -1),
+    "real": ("float", None),
+    "blob": ("varbinary", -1),
+    "": ("nvarchar", -1),
+}
+
+_LENGTH_TYPES = ("nvarchar", "nchar", "varchar", "char", "varbinary", "binary")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _default_literal(default) -> str:
+    if default == "getdate()":
+        return "current_timestamp"
+    if isinstance(default, (int, float, decimal.Decimal)):
+        return str(default)
+    try:
+        float(default)
+        return str(default)
+    except ValueError:
+        return "'" + str(default).replace("'", "''") + "'"
+
+
+class Column(Column):
+    def __init__(
+        self,
+        name: str,
+        type: str,
+        nullable: bool,
+        length: int = None,
+        precission: int = None,
+        scale=None,
+        default=None,
+    ) -> None:
+        super().__init__(name, type, nullable, length, precission, scale, default)
+
+    def quoted_name(self):
+        return _quote(self.name)
+
+    def type_declaration(self) -> str:
+        match self.type:
+            case "nvarchar" | "nchar" | "char" | "varchar" | "binary" | "varbinary":
+                # SQLite has no (max), a type without length is unlimited
+                if self.length is None or self.length == -1:
+                    return self.type
+                return f"{self.type}({self.length})"
+            case "decimal" | "numeric":
+                return f"{self.type}({self.precission},{self.scale})"
+            case "float":
+                if self.precission is not None:
+                    return f"float({self.precission})"
+                return "float"
+            case "timestamp" | "rowversion":
+                return "binary(8)"
+            case (
+                "int"
+                | "tinyint"
+                | "smallint"
+                | "bigint"
+                | "bit"
+                | "real"
+                | "money"
+                | "uniqueidentifier"
+                | "date"
+                | "datetime"
+                | "datetime2"
+                | "smalldatetime"
+            ):
+                return self.type
+            case _:
+                raise ValueError(f"Data type not implemented: {self.type}")
+
+    def to_sql(self) -> str:
+        parts = [self.quoted_name(), self.type_declaration()]
+        if not self.nullable:
+            parts.append("not null")
+        if self.default is not None:
+            parts.append(f"default {_default_literal(self.default)}")
+        sql = " ".join(parts)
+        logger.debug("column sql: %s", sql)
+        return sql
+
+
+def _column_from_info(info: dict) -> Column:
+    """Make a column from a row of pragma table_info."""
+    found = re.match(
+        r"\s*(\w*)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?", info.get("type") or ""
+    )
+    type_name = found.group(1).lower()
+    first = int(found.group(2)) if found.group(2) else None
+    second = int(found.group(3)) if found.group(3) else None
+
+    length = precission = scale = None
+    if type_name in _NATIVE_TYPES:
+        type_name, length = _NATIVE_TYPES[type_name]
+    elif type_name in _LENGTH_TYPES:
+        length = first if first is not None else -1
+    elif type_name in ("decimal", "numeric"):
+        precission = first if first is not None else 38
+        scale = second if second is not None else 10
+    elif type_name == "float":
+        precission = first
+
+    default = info.get("dflt_value")
+    if default is not None:
+        if default.lower() == "current_timestamp":
+            default = "getdate()"
+        elif default.startswith("'") and default.endswith("'"):
+            default = default[1:-1].replace("''", "'")
+
+    return Column(
+        name=info.get("name"),
+        type=type_name,
+        nullable=not info.get("notnull"),
+        length=length,
+        precission=precission,
+        scale=scale,
+        default=default,
+    )
+
+
+class Table(BaseTable):
+    column_class = Column
+
+    def __init__(self, name, columns: list[Column] = None) -> None:
+        super().__init__(name, columns)
+
+    @classmethod
+    def from_connection(cls, connection: Connection, table_name: str):
+        schema, table = connection.split_table_name(table_name)
+        prefix = f"{_quote(schema)}." if schema else ""
+        res_gen = connection.select_data(f"pragma {prefix}table_info({_quote(table)})")
+        columns = [_column_from_info(info) for info in res_gen]
+        return cls(name=table_name, columns=columns)
+
+    def create_table_statement(self, quoted_name: str = None) -> str:
+        columns = ",\n    ".join(c.to_sql() for c in self.columns)
+        return f"create table {quoted_name or _quote(self.name)} (\n    {columns}\n);"
+
+
+class InsertPlan(BaseInsertPlan):
+    """InsertPlan with SQLite quoting, see base.insert.InsertPlan. sqlite3
+    binds every value by its python type, so there are no input sizes;
+    decimals and dates are bound as text."""
+
+    def __init__(
+        self,
+        connection: Connection,
+        table: BaseTable,
+        columns: list[str] = None,
+        mapping: bool = True,
+        stats: Stats = None,
+        engine: str | type = "fast_executemany",
+    ) -> None:
+        super().__init__(connection, table, columns, mapping, stats, engine)
+        table_columns = {c.name: c for c in table.columns}
+        self._storage = _storage_converters([table_columns[c] for c in self.columns])
+
+    def render(self, table: Table) -> str:
+        names = ", ".join(_quote(c.name) for c in table.columns)
+        values = ", ".join("?" for _ in table.columns)
+        name = self.connection.quote_table_name(table.name)
+        return f"insert into {name} ({names}) values ({values})"
+
+    def rows(self, chunk: list) -> list:
+        rows = super().rows(chunk)
+        if self._storage:
+            rows = _convert(rows, self._storage)
+        return rows
+
+
+class _Cursor:
+    """
+    sqlite3 cursor with the pyodbc extras the shared code uses: commit() and
+    the fast_executemany and setinputsizes settings, which SQLite ignores.
+    """
+
+    def __init__(self, connection: sqlite3.Connection) -> None:
+        self.connection = connection
+        self._cursor = connection.cursor()
+        self.fast_executemany = False
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def execute(self, query: str, params: Sequence = ()) -> "_Cursor":
+        self._cursor.execute(query, [_to_storage(p) for p in params])
+        return self
+
+    def executemany(self, query: str, rows: Iterable) -> None:
+        self._cursor.executemany(query, rows)
+
+    def fetchmany(self, size: int) -> list:
+        return self._cursor.fetchmany(size)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def setinputsizes(self, sizes) -> None:
+        pass
+
+    def commit(self) -> None:
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        self.connection.rollback()
+
+    def close(self) -> None:
+        self._cursor.close()
+
+
+class SQLiteconnection(Connection):
+    """
+    Connection to a SQLite database file, e.g. as a local staging area. Works
+    with copy_table in either direction. A table name schema.table uses an
+    attached database (main, temp or attached) when there is one with that
+    name, otherwise the whole name is the table name, so dbo.myTable can be
+    copied from SQL Server as is. Every connect() opens a new connection, use
+    a file (not :memory:) to share the data with clones, e.g. in parallel or
+    pipelined copies.
+    """
+
+    def __init__(self, database: str = ":memory:", **kwargs) -> None:
+        self.database = database
+        self.other_params = kwargs
+        self.connection = None
+        self.cursor = None
+        self.table_cache = None
+        self._transaction_depth = 0
+
+    def to_string(self) -> str:
+        return self.database
+
+    def clone(self):
+        """Return a new, not yet connected, connection to the same database."""
+        return type(self)(self.database, **self.other_params)
+
+    def invalidate_table_cache(self, table_name: str = None) -> None:
+        pass
+
+    @contextmanager
+    def connect(self):
+        self.connection = sqlite3.connect(
+            self.database,
+            check_same_thread=False,
+            **self.other_params,
+        )
+        self.cursor = _Cursor(self.connection)
+        try:
+            yield (self)
+        finally:
+            if self.cursor is not None:
+                self.cursor.close()
+                self.cursor = None
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def select_data(
+        self,
+        query: str,
+        row_type: type = dict,
+        fetch_size: int = 5000,
+        table: BaseTable = None,
+        params: Sequence = None,
+        stats: Stats = None,
+    ) -> Iterator[dict]:
+        """Yield the rows of the query result as dict, tuple or Row, see
+        SQLserverconnection.select_data.
+
+        SQLite stores decimals, dates and bits as text or numbers. The values
+        of the result columns named like a column of table are converted back
+        to the python type of that column, the other values are returned as
+        stored."""
+        if stats is None:
+            stats = NO_STATS
+        with stats.measure("execute"):
+            self.cursor.execute(query, params or ())
+        columns = [column[0] for column in self.cursor.description or ()]
+        converters = _read_converters(columns, table)
+
+        if row_type is dict:
+
+            def make_row(result):
+                return dict(zip(columns, result))
+
+        elif row_type is tuple:
+            make_row = tuple
+        elif row_type is Row:
+            index = Row.index(columns)
+
+            def make_row(result):
+                return Row(result, index)
+
+        else:
+            raise ValueError(f"row_type must be dict, tuple or Row, got {row_type}")
+
+        while True:
+            with stats.measure("fetch") as counts:
+                results = self.cursor.fetchmany(fetch_size)
+                counts.rows = len(results)
+            if not results:
+                break
+            if converters:
+                results = _convert(results, converters)
+            yield from map(make_row, results)
+
+    def select_batches(
+        self, query: str, batch_size: int = 5000, params: Sequence = None
+    ) -> Iterator[ColumnBatch]:
+        """Yield the query result as column oriented batches of batch_size rows."""
+        self.cursor.execute(query, params or ())
+        names = [column[0] for column in self.cursor.description]
+        while True:
+            results = self.cursor.fetchmany(batch_size)
+            if not results:
+                break
+            # SQLite doesn't report column types, the batch finds out per value
+            yield ColumnBatch.from_rows(names, [None] * len(names), results)
+
+    def commit(self) -> None:
+        """Commit, unless inside transaction(), which commits at its end."""
+        if self._transaction_depth:
+            return
+        self.connection.commit()
+
+    def rollback(self) -> None:
+        """Roll back, unless inside transaction(), see
+        SQLserverconnection.rollback."""
+        if self._transaction_depth:
+            return
+        self.connection.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """Run the block as one transaction, see SQLserverconnection.transaction.
+        Table changes (create, drop, rename) are part of it."""
+        if self._transaction_depth == 0:
+            self.connection.commit()
+            self.cursor.execute("begin")
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.connection.rollback()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.connection.commit()
+
+    def execute_sql(self, query, params: Sequence = None, commit: bool = True):
+        self.cursor.execute(query, params or ())
+        if commit:
+            self.commit()
+
+    def _schemas(self) -> set[str]:
+        return {
+            row[1] for row in self.connection.execute("pragma database_list").fetchall()
+        }
+
+    def split_table_name(self, table_name: str) -> tuple[str | None, str]:
+        """Split schema.table into the attached database and the table name."""
+        schema, dot, table = table_name.partition(".")
+        if dot and schema in self._schemas():
+            return schema, table
+        return None, table_name
+
+    def quote_table_name(self, table_name: str) -> str:
+        schema, table = self.split_table_name(table_name)
+        if schema is None:
+            return _quote(table)
+        return f"{_quote(schema)}.{_quote(table)}"
+
+    def if_exists(self, table_name: str) -> bool:
+        schema, table = self.split_table_name(table_name)
+        master = f"{_quote(schema)}.sqlite_master" if schema else "sqlite_master"
+        res = self.select_data(
+            f"select name from {master} where type = 'table' and name = ?",
+            params=[table],
+        )
+        return len(list(res)) > 0
+
+    def drop_table(self, table_name: str) -> None:
+        self.execute_sql(f"drop table if exists {self.quote_table_name(table_name)}")
+
+    def create_table(self, table: BaseTable, drop_if_exists: bool):
+        # e.g. a table read from SQL Server
+        if not isinstance(table, Table):
+            table = Table.from_table(table)
+
+        if self.if_exists(table.name):
+            if drop_if_exists is False:
+                warnings.warn(
+                    "can't create table because it allready exists and drop_if_exists is False"
+                )
+                return
+            self.drop_table(table.name)
+
+        q = table.create_table_statement(self.quote_table_name(table.name))
+        self.execute_sql(q)
+
+    def table_definition(self, table_name: str) -> Table:
+        return Table.from_connection(self, table_name)
+
+    def insert_plan(
+        self,
+        table: BaseTable,
+        columns: list[str] = None,
+        mapping: bool = True,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> InsertPlan:
+        """engine is "fast_executemany" (plain executemany in SQLite, the
+        default), "values" or "auto", table-valued parameters are SQL Server
+        only."""
+        if not isinstance(table, Table):
+            table = Table.from_table(table)
+        return InsertPlan(
+            self,
+            table,
+            columns,
+            mapping=mapping,
+            stats=stats,
+            engine=engine or "fast_executemany",
+        )
+
+    def replace_table(self, temp_name: str, target_name: str) -> None:
+        """Replace target_name with the table temp_name, in one transaction."""
+        _, target = self.split_table_name(target_name)
+        with self.transaction():
+            self.cursor.execute(
+                f"drop table if exists {self.quote_table_name(target_name)}"
+            )
+            self.cursor.execute(
+                f"alter table {self.quote_table_name(temp_name)} rename to {_quote(target)}"
+            )
+
+    def sql_insert_dictionary(
+        self,
+        table: str | BaseTable | InsertPlan,
+        data: Iterable[dict],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> int:
+        """Insert dictionaries from any iterable, see
+        SQLserverconnection.sql_insert_dictionary."""
+        rows = iter(data)
+        if isinstance(table, BaseInsertPlan):
+            plan = table.bind(self, stats)
+        else:
+            if isinstance(table, str):
+                table = self.table_definition(table)
+
+            # peek at the first row for the columns, then put it back
+            first = next(rows, None)
+            if first is None:
+                return 0
+            rows = chain([first], rows)
+
+            # All keys must be a column name, if not raise error
+            data_columns = first.keys()
+            for c in data_columns:
+                if c not in table.column_names():
+                    raise KeyError(
+                        f"data column {c} does not match any column in the table object"
+                    )
+
+            columns = [c for c in table.column_names() if c in data_columns]
+            plan = self.insert_plan(table, columns, stats=stats, engine=engine)
+
+        return plan.write_all(rows, chunk_size=chunk_size, commit_every=commit_every)
+
+    def sql_insert_list(
+        self,
+        table: str | BaseTable | InsertPlan,
+        data: Iterable[list],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> int:
+        """Insert lists from any iterable, see SQLserverconnection.sql_insert_list."""
+        if isinstance(table, BaseInsertPlan):
+            plan = table.bind(self, stats)
+        else:
+            if isinstance(table, str):
+                table = self.table_definition(table)
+            plan = self.insert_plan(table, mapping=False, stats=stats, engine=engine)
+
+        return plan.write_all(data, chunk_size=chunk_size, commit_every=commit_every)
+
+    def upsert(
+        self,
+        table: str | BaseTable,
+        rows: Iterable[dict] | Iterable[list],
+        key_columns: list[str],
+        columns: list[str] = None,
+        chunk_size: int = 10_000,
+        stats: Stats = None,
+        engine: str | type = None,
+    ) -> dict:
+        """Insert rows whose key is new and update the rows whose key exists,
+        see SQLserverconnection.upsert. The rows are loaded into a temporary
+        table, from which one update changes the existing keys and one insert
+        adds the new ones, all in one transaction. Returns the counts:
+        {"inserted": 10, "updated": 5}.
+        """
+        if isinstance(table, str):
+            with (stats or NO_STATS).measure("table definition"):
+                table = self.table_definition(table)
+        elif not isinstance(table, Table):
+            table = Table.from_table(table)
+
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return {"inserted": 0, "updated": 0}
+        rows = chain([first], rows)
+
+        mapping = hasattr(first, "keys")
+        if mapping:
+            columns = list(first.keys())
+        elif columns is None:
+            columns = table.column_names()
+        table_columns = {c.name: c for c in table.columns}
+        for c in columns:
+            if c not in table_columns:
+                raise KeyError(
+                    f"data column {c} does not match any column in the table object"
+                )
+        for k in key_columns:
+            if k not in columns:
+                raise KeyError(f"key column {k} is not one of the columns of the rows")
+        # mappings are read in the order of the table, lists keep their order
+        if mapping:
+            columns = [c for c in table.column_names() if c in columns]
+
+        # a temp table is seen only by this connection
+        _, base_name = self.split_table_name(table.name)
+        staging = Table(
+            f"temp.upsert_{base_name}",
+            columns=[copy.copy(table_columns[c]) for c in columns],
+        )
+        for c in staging.columns:
+            c.default = None
+
+        target = self.quote_table_name(table.name)
+        source = self.quote_table_name(staging.name)
+        keys = " and ".join(f"t.{_quote(k)} = s.{_quote(k)}" for k in key_columns)
+        assignments = ", ".join(
+            f"{_quote(c)} = s.{_quote(c)}" for c in columns if c not in key_columns
+        )
+        names = ", ".join(_quote(c) for c in columns)
+        stats = stats if stats is not None else NO_STATS
+
+        with self.transaction():
+            self.cursor.execute(f"drop table if exists {source}")
+            self.cursor.execute(staging.create_table_statement(source))
+            plan = self.insert_plan(
+                staging, columns, mapping=mapping, stats=stats, engine=engine
+            )
+            staged = plan.write_all(rows, chunk_size=chunk_size)
+            with stats.measure("merge") as counts:
+                updated = 0
+                if assignments:
+                    self.cursor.execute(
+                        f"update {target} as t set {assignments} "
+                        f"from {source} as s where {keys}"
+                    )
+                    updated = self.cursor.rowcount
+                self.cursor.execute(
+                    f"insert into {target} ({names}) select {names} from {source} as s "
+                    f"where not exists (select 1 from {target} as t where {keys})"
+                )
+                inserted = self.cursor.rowcount
+                counts.rows = staged
+            self.cursor.execute(f"drop table {source}")
+
+        logger.info(
+            "upserted %s rows into %s: %s inserted, %s updated",
+            staged,
+            table.name,
+            inserted,
+            updated,
+        )
+        return {"inserted": inserted, "updated": updated}
+
+    def list_tables(
+        self, schema: str = "main", startswith: str = None, contains: str = None
+    ) -> list[str]:
+        q = f"""select name from {_quote(schema)}.sqlite_master
+        where type = 'table' and name not like 'sqlite%'"""
+        params = []
+        if startswith:
+            q += " and name like ?"
+            params.append(f"{startswith}%")
+        if contains:
+            q += " and name like ?"
+            params.append(f"%{contains}%")
+        q += " order by name"
+        return [x.get("name") for x in self.select_data(q, params=params)]
@@ -0,0 +1,213 @@
+from etl_db_tools.sqlservertools.sqlservertools import (
+    InsertPlan,
+    SQLserverconnection,
+    Table,
+)
+from collections.abc import AsyncIterator, Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import pyodbc
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSQLserverconnection:
+    """
+    asyncio front-end for SQLserverconnection. pyodbc blocks, so every active
+    connection gets one dedicated thread that runs all of its pyodbc calls;
+    the event loop only awaits them. At most max_connections connections (and
+    so threads) are active at the same time, further connect() calls wait.
+
+    Each connect() opens its own connection, so several queries can run
+    concurrently from one event loop:
+
+        async with cnxn.connect() as active_cnxn:
+            async for row in active_cnxn.select_data(query):
+                ...
+    """
+
+    def __init__(
+        self,
+        driver: str,
+        server: str,
+        database: str,
+        max_connections: int = 10,
+        **kwargs,
+    ) -> None:
+        self.sync = SQLserverconnection(driver, server, database, **kwargs)
+        self.max_connections = max_connections
+        self._semaphore = None
+        self._executor = None
+
+    @classmethod
+    def from_connection(
+        cls, connection: SQLserverconnection, max_connections: int = 10
+    ) -> "AsyncSQLserverconnection":
+        """Async front-end with the settings of an existing connection."""
+        async_connection = cls.__new__(cls)
+        async_connection.sync = connection.clone()
+        async_connection.max_connections = max_connections
+        async_connection._semaphore = None
+        async_connection._executor = None
+        return async_connection
+
+    def to_string(self) -> str:
+        return self.sync.to_string()
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking call on the thread of this connection."""
+        if self._executor is None:
+            raise RuntimeError("not connected, use 'async with connection.connect()'")
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # the thread can't be interrupted, ask the server to stop the statement
+            cursor = getattr(self.sync, "cursor", None)
+            if cursor is not None:
+                try:
+                    cursor.cancel()
+                except pyodbc.Error:
+                    pass
+            raise
+
+    @asynccontextmanager
+    async def connect(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+
+        async with self._semaphore:
+            session = AsyncSQLserverconnection.from_connection(self.sync)
+            session._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="sqlserver"
+            )
+            context = session.sync.connect()
+            try:
+                await session._run(context.__enter__)
+                try:
+                    yield session
+                finally:
+                    await session._run(context.__exit__, None, None, None)
+            finally:
+                session._executor.shutdown(wait=False)
+                session._executor = None
+
+    async def select_data(
+        self,
+        query: str,
+        row_type: type = dict,
+        fetch_size: int | str = 5000,
+        table: Table = None,
+        fetch_bytes: int = 8 * 1024 * 1024,
+        params: Sequence = None,
+    ) -> AsyncIterator[dict]:
+        """Async generator of the rows of the query result, see
+        SQLserverconnection.select_data. Every round trip of fetch_size rows
+        (or with fetch_size="auto" about fetch_bytes) runs on the connection
+        thread, the rows are built there too."""
+        fetches = self.sync._fetch_rows(
+            query, row_type, fetch_size, table, fetch_bytes, params, None
+        )
+        while True:
+            batch = await self._run(lambda: list(next(fetches, ())))
+            if not batch:
+                return
+            for row in batch:
+                yield row
+
+    async def select_batches(
+        self, query: str, batch_size: int = 5000, params: Sequence = None
+    ):
+        """Async generator of column oriented batches, see select_batches."""
+        batches = self.sync.select_batches(query, batch_size, params=params)
+        while True:
+            batch = await self._run(next, batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    async def execute_sql(self, query, params: Sequence = None, commit: bool = True):
+        await self._run(self.sync.execute_sql, query, params=params, commit=commit)
+
+    async def commit(self) -> None:
+        await self._run(self.sync.commit)
+
+    async def if_exists(self, table_name: str) -> bool:
+        return await self._run(self.sync.if_exists, table_name)
+
+    async def drop_table(self, table_name: str) -> None:
+        await self._run(self.sync.drop_table, table_name)
+
+    async def create_table(self, table: Table, drop_if_exists: bool) -> None:
+        await self._run(self.sync.create_table, table, drop_if_exists)
+
+    async def list_tables(
+        self, schema: str, startswith: str = None, contains: str = None
+    ) -> list[str]:
+        return await self._run(self.sync.list_tables, schema, startswith, contains)
+
+    async def table_definition(self, table_name: str) -> Table:
+        return await self._run(Table.from_connection, self.sync, table_name)
+
+    async def sql_insert_dictionary(
+        self,
+        table: str | Table | InsertPlan,
+        data: Iterable[dict],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        engine: str = None,
+    ) -> int:
+        """Insert dictionaries, see SQLserverconnection.sql_insert_dictionary.
+        data is consumed on the connection thread."""
+        return await self._run(
+            self.sync.sql_insert_dictionary,
+            table,
+            data,
+            chunk_size=chunk_size,
+            commit_every=commit_every,
+            engine=engine,
+        )
+
+    async def sql_insert_list(
+        self,
+        table: str | Table | InsertPlan,
+        data: Iterable[list],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        engine: str = None,
+    ) -> int:
+        """Insert lists, see SQLserverconnection.sql_insert_list. data is
+        consumed on the connection thread."""
+        return await self._run(
+            self.sync.sql_insert_list,
+            table,
+            data,
+            chunk_size=chunk_size,
+            commit_every=commit_every,
+            engine=engine,
+        )
+
+    async def upsert(
+        self,
+        table: str | Table,
+        rows: Iterable,
+        key_columns: list[str],
+        columns: list[str] = None,
+        chunk_size: int = 10_000,
+        engine: str = None,
+    ) -> dict:
+        """Upsert rows, see SQLserverconnection.upsert. rows are consumed on
+        the connection thread."""
+        return await self._run(
+            self.sync.upsert,
+            table,
+            rows,
+            key_columns,
+            columns=columns,
+            chunk_size=chunk_size,
+            engine=engine,
+        )
@@ -0,0 +1,175 @@
+from etl_db_tools.base.schema import Column
+from etl_db_tools.base.insert_engines import (  # noqa: F401 shared engines
+    ENGINES as _SHARED_ENGINES,
+    MAX_PARAMETERS,
+    MAX_VALUES_ROWS,
+    AutoInsert,
+    FastExecutemany,
+    InsertEngine,
+    StreamingFallback,
+    StreamingInsert,
+    ValuesInsert,
+    is_lob,
+    make_engine as _make_engine,
+    row_converter,
+    value_converters,
+)
+from functools import lru_cache
+import copy
+import hashlib
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _sql_types() -> tuple[dict, dict, dict]:
+    """
+    The (sql type, size, decimal digits) of the types with a fixed size, and
+    the sql type of the types with a length and of those with a precision.
+    Made on first use, so pyodbc is imported only when it is needed.
+    """
+    import pyodbc
+
+    fixed = {
+        "bit": (pyodbc.SQL_BIT, 0, 0),
+        "tinyint": (pyodbc.SQL_TINYINT, 0, 0),
+        "smallint": (pyodbc.SQL_SMALLINT, 0, 0),
+        "int": (pyodbc.SQL_INTEGER, 0, 0),
+        "bigint": (pyodbc.SQL_BIGINT, 0, 0),
+        "float": (pyodbc.SQL_DOUBLE, 0, 0),
+        "real": (pyodbc.SQL_REAL, 0, 0),
+        "money": (pyodbc.SQL_DECIMAL, 19, 4),
+        "smallmoney": (pyodbc.SQL_DECIMAL, 10, 4),
+        "date": (pyodbc.SQL_TYPE_DATE, 10, 0),
+        "smalldatetime": (pyodbc.SQL_TYPE_TIMESTAMP, 16, 0),
+        "datetime": (pyodbc.SQL_TYPE_TIMESTAMP, 23, 3),
+        "datetime2": (pyodbc.SQL_TYPE_TIMESTAMP, 27, 7),
+        "uniqueidentifier": (pyodbc.SQL_GUID, 16, 0),
+        "text": (pyodbc.SQL_LONGVARCHAR, 0, 0),
+        "ntext": (pyodbc.SQL_WLONGVARCHAR, 0, 0),
+        "image": (pyodbc.SQL_LONGVARBINARY, 0, 0),
+    }
+    sized = {
+        "nvarchar": pyodbc.SQL_WVARCHAR,
+        "nchar": pyodbc.SQL_WCHAR,
+        "varchar": pyodbc.SQL_VARCHAR,
+        "char": pyodbc.SQL_CHAR,
+        "varbinary": pyodbc.SQL_VARBINARY,
+        "binary": pyodbc.SQL_BINARY,
+    }
+    precise = {"decimal": pyodbc.SQL_DECIMAL, "numeric": pyodbc.SQL_NUMERIC}
+    return fixed, sized, precise
+
+
+def input_size(column: Column) -> tuple | None:
+    """
+    The setinputsizes entry of a column: (sql type, size, decimal digits), or
+    None for types the driver should work out itself. (max) columns get size
+    0, so the driver streams their values instead of allocating a buffer of
+    the largest possible value for every row.
+    """
+    fixed, sized, precise = _sql_types()
+    if column.type in fixed:
+        return fixed[column.type]
+    if column.type in sized:
+        length = 0 if is_lob(column) else column.length
+        return (sized[column.type], length, 0)
+    if column.type in precise:
+        return (precise[column.type], column.precission or 18, column.scale or 0)
+    return None
+
+
+def input_sizes(columns: list[Column]) -> list | None:
+    """The setinputsizes specification of columns, None if no column has one."""
+    sizes = [input_size(c) for c in columns]
+    if all(s is None for s in sizes):
+        return None
+    return sizes
+
+
+class TVPInsert(InsertEngine):
+    """
+    Sends the whole chunk as one table-valued parameter:
+    insert into ... select * from ?. The table type is created in the schema
+    of the table the first time, named after the table and a hash of the
+    column definitions, and reused after that.
+    """
+
+    name = "tvp"
+    stage = "tvp insert"
+
+    # one type is created at a time in this process, see prepare
+    _create_lock = threading.Lock()
+
+    def __init__(
+        self,
+        sql: str,
+        columns: list[Column],
+        table_name: str,
+        input_sizes: list = None,
+    ) -> None:
+        # the table type declares the parameter types, input_sizes is unused
+        super().__init__(sql, columns, table_name, input_sizes)
+        self.type_columns = []
+        for c in columns:
+            # every value is passed, defaults don't apply
+            c = copy.copy(c)
+            c.default = None
+            self.type_columns.append(c)
+        signature = ";".join(c.to_sql() for c in self.type_columns)
+        digest = hashlib.sha1(signature.encode()).hexdigest()[:10]
+
+        parts = table_name.replace("[", "").replace("]", "").split(".")
+        self.type_schema = parts[-2] if len(parts) > 1 else "dbo"
+        self.type_name = f"etl_{parts[-1][:80]}_{digest}"
+        self._created = False
+        self._statement = sql.rpartition("values")[0] + "select * from ?"
+
+    def create_statement(self) -> str:
+        """Create the table type unless it exists, also when another process
+        creates it between the check and the create."""
+        name = f"[{self.type_schema}].[{self.type_name}]"
+        columns = ",\n        ".join(c.to_sql() for c in self.type_columns)
+        return (
+            f"if type_id(N'{name}') is null\n"
+            "begin try\n"
+            f"    create type {name} as table (\n        {columns}\n    )\n"
+            "end try\n"
+            "begin catch\n"
+            f"    if type_id(N'{name}') is null throw;\n"
+            "end catch"
+        )
+
+    def prepare(self, connection) -> None:
+        """Create the table type on a connection of its own, which commits it
+        at once: the writers on other connections see it, and a rollback of
+        the transaction on connection doesn't drop it."""
+        if self._created:
+            return
+        with self._create_lock:
+            if self._created:
+                return
+            with connection.clone().connect() as own:
+                own.execute_sql(self.create_statement())
+            self._created = True
+
+    def insert(self, cursor, rows: list) -> None:
+        # pyodbc takes the type name and schema as the first two elements
+        cursor.execute(self._statement, [[self.type_name, self.type_schema, *rows]])
+
+
+# the shared engines and the SQL Server only table-valued parameters
+ENGINES = {**_SHARED_ENGINES, TVPInsert.name: TVPInsert}
+
+
+def make_engine(
+    engine: str | type,
+    sql: str,
+    columns: list[Column],
+    table_name: str,
+    input_sizes: list = None,
+) -> InsertEngine:
+    """Make an engine by name (see ENGINES) or from an InsertEngine subclass."""
+    return _make_engine(engine, sql, columns, table_name, input_sizes, ENGINES)
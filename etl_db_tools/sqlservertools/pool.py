@@ -0,0 +1,213 @@
+from etl_db_tools.sqlservertools.sqlservertools import SQLserverconnection
+from collections import deque
+from contextlib import contextmanager
+import pyodbc
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _PooledConnection:
+    def __init__(self, connection) -> None:
+        self.connection = connection
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+
+class ConnectionPool:
+    """
+    A bounded set of live pyodbc connections for one SQLserverconnection.
+
+    Use pool.connect() the same way as SQLserverconnection.connect(): it yields
+    a connected SQLserverconnection, but returns the underlying connection to
+    the pool on exit instead of closing it. Idle connections are closed after
+    idle_timeout seconds and every connection after max_lifetime seconds (None
+    disables either). With health_check a connection is tested with a cheap
+    query before it is handed out. dbapi is the module used to open
+    connections, pyodbc by default.
+    """
+
+    def __init__(
+        self,
+        connection: SQLserverconnection,
+        max_size: int = 5,
+        idle_timeout: float = 300.0,
+        max_lifetime: float = 3600.0,
+        health_check: bool = True,
+        checkout_timeout: float = 30.0,
+        dbapi=pyodbc,
+    ) -> None:
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+        self.template = connection
+        self.key = connection.to_string()
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check = health_check
+        self.checkout_timeout = checkout_timeout
+        self.dbapi = dbapi
+
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        """Number of open connections, idle or checked out."""
+        return self._size
+
+    @property
+    def idle(self) -> int:
+        return len(self._idle)
+
+    def _expired(self, pooled: _PooledConnection, now: float) -> bool:
+        if self.max_lifetime is not None and now - pooled.created >= self.max_lifetime:
+            return True
+        if self.idle_timeout is not None and now - pooled.last_used >= self.idle_timeout:
+            return True
+        return False
+
+    def _healthy(self, pooled: _PooledConnection) -> bool:
+        try:
+            cursor = pooled.connection.cursor()
+            try:
+                cursor.execute("select 1")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+        except self.dbapi.Error as e:
+            logger.info("discarding pooled connection that failed the health check: %s", e)
+            return False
+        return True
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+        try:
+            pooled.connection.close()
+        except self.dbapi.Error:
+            pass
+
+    def _checkout(self) -> _PooledConnection:
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            pooled = None
+            create = False
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                if self._idle:
+                    # most recently used first, that one is most likely still alive
+                    pooled = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"no connection available within {self.checkout_timeout} seconds"
+                        )
+                    self._condition.wait(remaining)
+                    continue
+
+            if create:
+                try:
+                    return _PooledConnection(self.dbapi.connect(self.key))
+                except BaseException:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+
+            if self._expired(pooled, time.monotonic()):
+                self._discard(pooled)
+            elif self.health_check and not self._healthy(pooled):
+                self._discard(pooled)
+            else:
+                return pooled
+
+    def _checkin(self, pooled: _PooledConnection) -> None:
+        try:
+            # don't hand uncommitted work to the next user
+            pooled.connection.rollback()
+        except self.dbapi.Error:
+            self._discard(pooled)
+            return
+
+        now = time.monotonic()
+        with self._condition:
+            if not self._closed and not self._expired(pooled, now):
+                pooled.last_used = now
+                self._idle.append(pooled)
+                self._condition.notify()
+                return
+        self._discard(pooled)
+
+    @contextmanager
+    def connect(self):
+        pooled = self._checkout()
+        session = self.template.clone()
+        session.connection = pooled.connection
+        session.cursor = None
+        try:
+            session.cursor = pooled.connection.cursor()
+            yield session
+        finally:
+            try:
+                if session.cursor is not None:
+                    session.cursor.close()
+            except self.dbapi.Error:
+                pass
+            session.cursor = None
+            session.connection = None
+            self._checkin(pooled)
+
+    def close(self) -> None:
+        """Close all idle connections, checked out ones are closed on return."""
+        with self._condition:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._condition.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(connection: SQLserverconnection, **kwargs) -> ConnectionPool:
+    """
+    Return the process wide pool for the connection string of connection,
+    created with kwargs on first use.
+    """
+    key = connection.to_string()
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(connection, **kwargs)
+            _pools[key] = pool
+        return pool
+
+
+@contextmanager
+def pooled(connection: SQLserverconnection):
+    """Drop-in replacement for connection.connect() that uses the shared pool."""
+    with get_pool(connection).connect() as session:
+        yield session
+
+
+def close_pools() -> None:
+    """Close and forget all process wide pools."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
@@ -1,13 +1,40 @@
+from etl_db_tools.base.batch import ColumnBatch
+from etl_db_tools.base.cache import TableCache
 from etl_db_tools.base.connection import Connection
+from etl_db_tools.base.insert import InsertPlan as BaseInsertPlan, _chunks
+from etl_db_tools.base.row import Row
 from etl_db_tools.base.schema import BaseTable, Column, sql_render
-from collections.abc import Iterator
-from contextlib import contextmanager
+from etl_db_tools.base.sizing import (
+    AdaptiveBatchSize,
+    TableBatchSize,
+    description_bytes,
+)
+from etl_db_tools.base.stats import NO_STATS, Stats
+from etl_db_tools.sqlservertools.insert_engines import (
+    ENGINES,
+    InsertEngine,
+    StreamingFallback,
+    input_sizes,
+)
+from collections.abc import Iterable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+from itertools import chain
+import copy
+import datetime
+import decimal
+import json
+import os
 import pyodbc
+import queue
+import threading
+import time
 import warnings
 import logging
 
 logger = logging.getLogger(__name__)
 
+
 class Column(Column):
     def __init__(
         self,
@@ -25,12 +52,39 @@ class Column(Column):
         return f"[{self.name}]"
 
 
+def _column_from_definition(definition: dict) -> Column:
+    """Make a column from a row of the information_schema.columns queries."""
+    c = Column(
+        name=definition.get("COLUMN_NAME"),
+        type=definition.get("DATA_TYPE"),
+        nullable=definition.get("IS_NULLABLE"),
+        length=definition.get("CHARACTER_MAXIMUM_LENGTH"),
+        precission=definition.get("NUMERIC_PRECISION"),
+        scale=definition.get("NUMERIC_SCALE"),
+        default=definition.get("COLUMN_DEFAULT"),
+    )
+    logger.debug("Column def: %s", c)
+    return c
+
+
 class Table(BaseTable):
+    column_class = Column
+
     def __init__(self, name, columns: list[Column] = None) -> None:
         super().__init__(name, columns)
 
     @classmethod
-    def from_connection(cls, connection: Connection, table_name: str):
+    def from_connection(
+        cls, connection: Connection, table_name: str, use_cache: bool = True
+    ):
+        # use the definition cache of the connection, if it has one
+        cache = getattr(connection, "table_cache", None) if use_cache else None
+        if cache is not None:
+            connection_key = connection.to_string()
+            table = cache.get(connection_key, table_name)
+            if table is not None:
+                return table
+
         querystring = f"""
                 select 
                 c.TABLE_NAME
@@ -53,30 +107,95 @@ class Table(BaseTable):
 
         res_gen = connection.select_data(querystring)
 
-        columns = []
-        for column in res_gen:
-            c = Column(
-                name=column.get("COLUMN_NAME"),
-                type=column.get("DATA_TYPE"),
-                nullable=column.get("IS_NULLABLE"),
-                length=column.get("CHARACTER_MAXIMUM_LENGTH"),
-                precission=column.get("NUMERIC_PRECISION"),
-                scale=column.get("NUMERIC_SCALE"),
-                default=column.get("COLUMN_DEFAULT"),
-            )
-            logger.debug('Column def: %s', c)
-            columns.append(c)
+        columns = [_column_from_definition(column) for column in res_gen]
 
         # make instance from output column definition
-        return cls(name=table_name, columns=columns)
+        table = cls(name=table_name, columns=columns)
+
+        # a table without columns doesn't exist (yet), don't remember that
+        if cache is not None and columns:
+            cache.put(connection_key, table_name, table)
+        return table
+
+    @classmethod
+    def many_from_connection(
+        cls,
+        connection: Connection,
+        schema: str,
+        startswith: str = None,
+        contains: str = None,
+    ) -> dict:
+        """
+        Read the definitions of all tables in a schema with one query. Takes the
+        same filters as list_tables and returns a dictionary of table name
+        (schema.table) to table, in the order of list_tables.
+        """
+        data = {"schema": schema, "startswith": startswith, "contains": contains}
+        q = sql_render(template="find_columns.sql", data=data)
+
+        columns = {}
+        for row in connection.select_data(q):
+            column = _column_from_definition(row)
+            columns.setdefault(row.get("table_name"), []).append(column)
+
+        tables = {name: cls(name=name, columns=cols) for name, cols in columns.items()}
+
+        cache = getattr(connection, "table_cache", None)
+        if cache is not None:
+            connection_key = connection.to_string()
+            for name, table in tables.items():
+                cache.put(connection_key, name, table)
+        return tables
+
+
+class InsertPlan(BaseInsertPlan):
+    """InsertPlan rendering the insert.sql template, with the SQL Server
+    engines (also "tvp", a table-valued parameter) and the parameter types of
+    the table definition, see base.insert.InsertPlan."""
+
+    engines = ENGINES
+
+    def render(self, table: Table) -> str:
+        return sql_render(template="insert.sql", data=table)
+
+    def input_sizes(self, table: Table) -> list | None:
+        return input_sizes(table.columns)
 
 
 class SQLserverconnection(Connection):
-    def __init__(self, driver: str, server: str, database: str, **kwargs) -> None:
+    def __init__(
+        self,
+        driver: str,
+        server: str,
+        database: str,
+        table_cache: TableCache | bool = True,
+        insert_engine: str | type[InsertEngine] = "fast_executemany",
+        **kwargs,
+    ) -> None:
+        """
+        Extra keyword arguments are added to the connection string.
+
+        table_cache caches the table definitions read by Table.from_connection:
+        True gives this connection (and its clones) its own cache, False
+        disables caching, or pass a TableCache, e.g. base.cache.shared_cache
+        to share definitions within the process.
+
+        insert_engine is the default engine of the inserts on this
+        connection, see InsertPlan and compare_insert_engines.
+        """
         self.driver = driver
         self.server = server
         self.database = database
+        self.insert_engine = insert_engine
         self.other_params = kwargs
+        self._transaction_depth = 0
+
+        if table_cache is True:
+            self.table_cache = TableCache()
+        elif table_cache is False or table_cache is None:
+            self.table_cache = None
+        else:
+            self.table_cache = table_cache
 
     def to_string(self):
         basic_cnxn = (
@@ -93,6 +212,22 @@ class SQLserverconnection(Connection):
         final_cnxn = ";".join(cnxn_ls)
         return final_cnxn
 
+    def clone(self):
+        """Return a new, not yet connected, connection with the same settings."""
+        return type(self)(
+            self.driver,
+            self.server,
+            self.database,
+            table_cache=self.table_cache if self.table_cache is not None else False,
+            insert_engine=self.insert_engine,
+            **self.other_params,
+        )
+
+    def invalidate_table_cache(self, table_name: str = None) -> None:
+        """Forget the cached definition of table_name, or of all tables if None."""
+        if self.table_cache is not None:
+            self.table_cache.invalidate(table_name, connection_key=self.to_string())
+
     @contextmanager
     def connect(self):
         self.connection = pyodbc.connect(self.to_string())
@@ -107,20 +242,164 @@ class SQLserverconnection(Connection):
                 self.connection.close()
                 self.connection = None
 
-    def select_data(self, query: str) -> Iterator[list[dict]]:
-        self.cursor.execute(query)
+    def select_data(
+        self,
+        query: str,
+        row_type: type = dict,
+        fetch_size: int | str = 5000,
+        table: Table = None,
+        fetch_bytes: int = 8 * 1024 * 1024,
+        params: Sequence = None,
+        stats: Stats = None,
+    ) -> Iterator[dict]:
+        """Yield the rows of the query result.
+
+        row_type sets how each row is returned: dict (the default), tuple, or
+        Row, a light read only view with the same row['col'] and row.get('col')
+        interface as a dict.
+
+        fetch_size is the number of rows fetched per round trip. With
+        fetch_size="auto" it is derived from the estimated row width (from
+        cursor.description, and the column lengths of table when given) and
+        then adjusted to the observed rows to fetch about fetch_bytes per trip.
+
+        params are passed to the driver for the ? placeholders in query.
+
+        With stats, the time spent in execute, fetch (with an estimate of the
+        bytes fetched) and building the rows is recorded.
+        """
+        for rows in self._fetch_rows(
+            query, row_type, fetch_size, table, fetch_bytes, params, stats
+        ):
+            yield from rows
+
+    def _fetch_rows(
+        self,
+        query: str,
+        row_type: type,
+        fetch_size: int | str,
+        table: Table,
+        fetch_bytes: int,
+        params: Sequence,
+        stats: Stats,
+    ) -> Iterator[Iterable]:
+        """Run query and yield the rows of every round trip, see select_data."""
+        if stats is None:
+            stats = NO_STATS
+        with stats.measure("execute"):
+            if params:
+                self.cursor.execute(query, params)
+            else:
+                self.cursor.execute(query)
         columns = [column[0] for column in self.cursor.description]
+        row_bytes = 0
+        if stats is not NO_STATS:
+            row_bytes = description_bytes(self.cursor.description, table)
+
+        if fetch_size == "auto":
+            sizer = AdaptiveBatchSize(
+                description_bytes(self.cursor.description, table),
+                target_bytes=fetch_bytes,
+            )
+        elif isinstance(fetch_size, int) and fetch_size > 0:
+            sizer = None
+        else:
+            raise ValueError(
+                f"fetch_size must be a positive integer or 'auto', got {fetch_size}"
+            )
+
+        if row_type is dict:
+
+            def make_row(result):
+                return dict(zip(columns, result))
+
+        elif row_type is tuple:
+            make_row = tuple
+        elif row_type is Row:
+            index = Row.index(columns)
+
+            def make_row(result):
+                return Row(result, index)
+
+        else:
+            raise ValueError(f"row_type must be dict, tuple or Row, got {row_type}")
+
+        while True:
+            with stats.measure("fetch") as counts:
+                if sizer is None:
+                    results = self.cursor.fetchmany(fetch_size)
+                else:
+                    results = self.cursor.fetchmany(sizer.size)
+                    sizer.observe(results)
+                counts.rows = len(results)
+                counts.bytes = len(results) * row_bytes
+            if not results:
+                break
+            if stats is NO_STATS:
+                yield map(make_row, results)
+            else:
+                with stats.measure("build rows") as counts:
+                    rows = list(map(make_row, results))
+                    counts.rows = len(rows)
+                yield rows
+
+    def select_batches(
+        self, query: str, batch_size: int = 5000, params: Sequence = None
+    ) -> Iterator[ColumnBatch]:
+        """Yield the query result as column oriented batches of batch_size rows."""
+        if params:
+            self.cursor.execute(query, params)
+        else:
+            self.cursor.execute(query)
+        names = [column[0] for column in self.cursor.description]
+        type_codes = [column[1] for column in self.cursor.description]
         while True:
-            results = self.cursor.fetchmany(5000)
+            results = self.cursor.fetchmany(batch_size)
             if not results:
                 break
-            for result in results:
-                yield dict(zip(columns, result))
+            yield ColumnBatch.from_rows(names, type_codes, results)
 
-    def execute_sql(self, query):
-        self.cursor.execute(query)
+    def commit(self) -> None:
+        """Commit, unless inside transaction(), which commits at its end."""
+        if self._transaction_depth:
+            return
         self.cursor.commit()
 
+    def rollback(self) -> None:
+        """Roll back, unless inside transaction(), which rolls back when the
+        block raises."""
+        if self._transaction_depth:
+            return
+        self.connection.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block as one transaction. The commits of execute_sql, the
+        inserts and copy_table inside the block are skipped; the block commits
+        when it ends and rolls back when it raises. A nested transaction() is
+        part of the outer one.
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.connection.rollback()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0:
+            self.cursor.commit()
+
+    def execute_sql(self, query, params: Sequence = None, commit: bool = True):
+        if params:
+            self.cursor.execute(query, params)
+        else:
+            self.cursor.execute(query)
+        if commit:
+            self.commit()
+
     def if_exists(self, table_name):
         query = f"""
         select s.[name], object_id, sc.name
@@ -139,8 +418,13 @@ class SQLserverconnection(Connection):
     def drop_table(self, table_name: str) -> None:
         q = f"drop table if exists {table_name} ;"
         self.execute_sql(q)
+        self.invalidate_table_cache(table_name)
 
     def create_table(self, table: Table, drop_if_exists: bool):
+        # e.g. a table read from another kind of database
+        if not isinstance(table, Table):
+            table = Table.from_table(table)
+
         if self.if_exists(table_name=table.name) and drop_if_exists is False:
             warnings.warn(
                 "can't create table because it allready exists and drop_if_exists is False"
@@ -151,55 +435,220 @@ class SQLserverconnection(Connection):
 
         q = table.create_table_statement()
         self.execute_sql(q)
+        self.invalidate_table_cache(table.name)
+
+    def sql_insert_dictionary(
+        self,
+        table: str | Table | InsertPlan,
+        data: Iterable[dict],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        stats: Stats = None,
+        engine: str | type[InsertEngine] = None,
+    ) -> int:
+        """Insert dictionaries (or Rows) from any iterable, e.g. a generator.
+
+        The rows are inserted in chunks of chunk_size, so only one chunk is in
+        memory at a time. The columns are taken from the keys of the first row.
+        Commits at the end, or every commit_every rows. Returns the number of
+        rows inserted. With stats the time per stage is recorded, see
+        InsertPlan. engine overrides the insert engine of the connection, it
+        is ignored when an InsertPlan is passed.
+        """
+        rows = iter(data)
+        if isinstance(table, BaseInsertPlan):
+            plan = table.bind(self, stats)
+        else:
+            if isinstance(table, str):
+                with (stats or NO_STATS).measure("table definition"):
+                    table_obj = Table.from_connection(self, table)
+            elif isinstance(table, Table):
+                table_obj = table
+
+            # peek at the first row for the columns, then put it back
+            first = next(rows, None)
+            if first is None:
+                return 0
+            rows = chain([first], rows)
+
+            # All keys must be a column name, if not raise error
+            data_columns = first.keys()
+            for c in data_columns:
+                if c not in table_obj.column_names():
+                    raise KeyError(
+                        f"data column {c} does not match any column in the table object"
+                    )
+
+            # only insert the columns in the table object that are in the dataset
+            columns = [c for c in table_obj.column_names() if c in data_columns]
+            plan = self.insert_plan(table_obj, columns, stats=stats, engine=engine)
+
+        return plan.write_all(rows, chunk_size=chunk_size, commit_every=commit_every)
+
+    def sql_insert_list(
+        self,
+        table: str | Table | InsertPlan,
+        data: Iterable[list],
+        chunk_size: int = 10_000,
+        commit_every: int = None,
+        stats: Stats = None,
+        engine: str | type[InsertEngine] = None,
+    ) -> int:
+        """Insert lists (or tuples) from any iterable, e.g. a generator.
+
+        Every row must have a value for each column of the table, or of the
+        plan. Chunking, commits, stats and engine work as in
+        sql_insert_dictionary.
+        Returns the number of rows inserted.
+        """
+        if isinstance(table, BaseInsertPlan):
+            plan = table.bind(self, stats)
+        else:
+            if isinstance(table, str):
+                with (stats or NO_STATS).measure("table definition"):
+                    table_obj = Table.from_connection(self, table)
+            elif isinstance(table, Table):
+                table_obj = table
+            plan = self.insert_plan(
+                table_obj, mapping=False, stats=stats, engine=engine
+            )
+
+        # lists must have the same length as n columns
+        return plan.write_all(data, chunk_size=chunk_size, commit_every=commit_every)
 
-    def sql_insert_dictionary(self, table: str | Table, data: list[dict]):
+    def upsert(
+        self,
+        table: str | Table,
+        rows: Iterable[dict] | Iterable[list],
+        key_columns: list[str],
+        columns: list[str] = None,
+        chunk_size: int = 10_000,
+        stats: Stats = None,
+        engine: str | type[InsertEngine] = None,
+    ) -> dict:
+        """Insert rows whose key is new and update the rows whose key exists.
+
+        The rows are loaded into a temporary #table and merged into table with
+        one merge statement on key_columns, all in one transaction. Rows are
+        dictionaries (or Rows), whose keys give the columns as in
+        sql_insert_dictionary, or lists with a value for each of columns (all
+        columns of the table by default). Keys must be unique within rows.
+        Returns the counts of the merge: {"inserted": 10, "updated": 5}.
+        """
         if isinstance(table, str):
-            table_obj = Table.from_connection(self, table)
-        elif isinstance(table, Table):
-            table_obj = table
-
-        # All keys must be a column name, if not raise error
-        data_columns = data[0].keys()
-        for c in data_columns:
-            if c not in table_obj.column_names():
+            with (stats or NO_STATS).measure("table definition"):
+                table = Table.from_connection(self, table)
+        elif not isinstance(table, Table):
+            table = Table.from_table(table)
+
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return {"inserted": 0, "updated": 0}
+        rows = chain([first], rows)
+
+        mapping = hasattr(first, "keys")
+        if mapping:
+            columns = list(first.keys())
+        elif columns is None:
+            columns = table.column_names()
+        table_columns = {c.name: c for c in table.columns}
+        for c in columns:
+            if c not in table_columns:
                 raise KeyError(
                     f"data column {c} does not match any column in the table object"
                 )
+        for k in key_columns:
+            if k not in columns:
+                raise KeyError(f"key column {k} is not one of the columns of the rows")
+        # mappings are read in the order of the table, lists keep their order
+        if mapping:
+            columns = [c for c in table.column_names() if c in columns]
 
-        # only keep columns in the table object that are in the dataset
-        table_obj.columns = [c for c in table_obj.columns if c.name in data_columns]
+        # a #table lives as long as the session and is seen only by it
+        base_name = table.name.replace("[", "").replace("]", "").split(".")[-1]
+        staging = Table(
+            f"#upsert_{base_name}",
+            columns=[copy.copy(table_columns[c]) for c in columns],
+        )
+        for c in staging.columns:
+            c.default = None
 
-        # render insert statement
-        insert_sql = sql_render(template="insert.sql", data=table_obj)
+        data = {
+            "target_name": table.name,
+            "source_name": staging.name,
+            "key_columns": [table_columns[k] for k in key_columns],
+            "update_columns": [
+                table_columns[c] for c in columns if c not in key_columns
+            ],
+            "columns": staging.columns,
+            "output": "@actions",
+        }
+        stats = stats if stats is not None else NO_STATS
 
-        cleaned_data = []
-        for row in data:
-            rowlist = [row.get(x) for x in table_obj.column_names()]
-            cleaned_data.append(rowlist)
+        # on an error the rollback drops the #table too
+        with self.transaction():
+            self.cursor.execute(f"drop table if exists {staging.name}")
+            self.cursor.execute(staging.create_table_statement())
+            plan = self.insert_plan(
+                staging, columns, mapping=mapping, stats=stats, engine=engine
+            )
+            staged = plan.write_all(rows, chunk_size=chunk_size)
+            with stats.measure("merge") as counts:
+                merged = list(self.select_data(sql_render("upsert.sql", data=data)))
+                counts.rows = staged
+            self.cursor.execute(f"drop table if exists {staging.name}")
 
-        self.cursor.fast_executemany = True
-        self.cursor.executemany(insert_sql, cleaned_data)
-        self.cursor.commit()
+        result = {
+            "inserted": merged[0].get("inserted"),
+            "updated": merged[0].get("updated"),
+        }
+        logger.info(
+            "upserted %s rows into %s: %s inserted, %s updated",
+            staged,
+            table.name,
+            result["inserted"],
+            result["updated"],
+        )
+        return result
 
-    def sql_insert_list(self, table: str | Table, data: list[list]):
-        if isinstance(table, str):
-            table_obj = Table.from_connection(self, table)
-        elif isinstance(table, Table):
-            table_obj = table
+    def quote_table_name(self, table_name: str) -> str:
+        """Table names are used as given, e.g. dbo.myTable or [dbo].[my table]."""
+        return table_name
 
-        # lists must have the same length as n columns
-        N = len(table_obj.columns)
-        for li in data:
-            len_li = len(li)
-            if len_li != N:
-                raise Exception("expected a row with {N} values, got {len_li}.")
+    def table_definition(self, table_name: str) -> Table:
+        return Table.from_connection(self, table_name)
 
-        # render insert statement
-        insert_sql = sql_render(template="insert.sql", data=table_obj)
+    def insert_plan(
+        self,
+        table: BaseTable,
+        columns: list[str] = None,
+        mapping: bool = True,
+        stats: Stats = None,
+        engine: str | type[InsertEngine] = None,
+    ) -> InsertPlan:
+        """An InsertPlan for table on this connection, see InsertPlan. engine
+        defaults to the insert engine of the connection."""
+        if not isinstance(table, Table):
+            table = Table.from_table(table)
+        return InsertPlan(
+            self,
+            table,
+            columns,
+            mapping=mapping,
+            stats=stats,
+            engine=engine or self.insert_engine,
+        )
 
-        self.cursor.fast_executemany = True
-        self.cursor.executemany(insert_sql, data)
-        self.cursor.commit()
+    def replace_table(self, temp_name: str, target_name: str) -> None:
+        """Replace target_name with the table temp_name, in one transaction."""
+        # note: we must remove the schema from the name as it will mess up the sp_rename call
+        data = {"target_name": target_name.split(".")[-1], "temp_table_name": temp_name}
+        q = sql_render("finalize_copy.sql", data=data)
+
+        self.execute_sql(q)
+        self.invalidate_table_cache(target_name)
+        self.invalidate_table_cache(temp_name)
 
     def list_tables(
         self, schema: str, startswith: str = None, contains: str = None
@@ -211,6 +660,540 @@ class SQLserverconnection(Connection):
         ls_flat = [x.get("table_name") for x in ls]
         return ls_flat
 
+    def table_row_counts(
+        self, schema: str, startswith: str = None, contains: str = None
+    ) -> dict[str, int]:
+        """Estimated number of rows per table from sys.partitions, biggest first."""
+        data = {"schema": schema, "startswith": startswith, "contains": contains}
+
+        q = sql_render(template="table_row_counts.sql", data=data)
+        return {x.get("table_name"): x.get("row_count") for x in self.select_data(q)}
+
+
+# sentinel that tells a writer thread there are no more chunks
+_END_OF_DATA = object()
+
+
+def _pipelined_insert(
+    rows: Iterable,
+    plan: InsertPlan,
+    target_connection: Connection,
+    chunk_length: int | AdaptiveBatchSize,
+    queue_depth: int,
+    writers: int,
+    commit_every: int = None,
+) -> int:
+    """Insert rows with plan using a reader thread and one or more writer threads.
+
+    The reader fills a bounded queue with chunks, the writers drain it. The
+    first writer uses target_connection, every extra writer opens its own
+    connection with target_connection.clone(). Each writer commits after every
+    commit_every rows it inserted and when it is done. The first error raised
+    on either side stops all threads and is re-raised in the calling thread.
+    Returns the number of rows inserted.
+    """
+    if queue_depth < 1:
+        raise ValueError(f"queue_depth must be at least 1, got {queue_depth}")
+    if writers < 1:
+        raise ValueError(f"writers must be at least 1, got {writers}")
+
+    chunks = queue.Queue(maxsize=queue_depth)
+    abort = threading.Event()
+    errors = []
+    written = [0] * writers
+
+    def fail(error: BaseException) -> None:
+        errors.append(error)
+        abort.set()
+
+    def put(item) -> bool:
+        # block while the queue is full, but give up as soon as we are aborted
+        while not abort.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read() -> None:
+        try:
+            for chunk in _chunks(rows, chunk_length):
+                if not put(chunk):
+                    return
+        except BaseException as e:
+            fail(e)
+            return
+        for _ in range(writers):
+            put(_END_OF_DATA)
+
+    def drain(connection: Connection, index: int) -> None:
+        writer_plan = plan.bind(connection)
+        uncommitted = 0
+        while True:
+            try:
+                chunk = chunks.get(timeout=0.1)
+            except queue.Empty:
+                if abort.is_set():
+                    return
+                continue
+            if abort.is_set():
+                return
+            if chunk is _END_OF_DATA:
+                break
+            writer_plan.write(chunk, commit=False)
+            written[index] += len(chunk)
+            uncommitted += len(chunk)
+            if commit_every is not None and uncommitted >= commit_every:
+                connection.commit()
+                uncommitted = 0
+        if uncommitted:
+            connection.commit()
+
+    def drain_or_rollback(connection: Connection, index: int) -> None:
+        # a failed or aborted writer doesn't leave its uncommitted chunks behind
+        try:
+            drain(connection, index)
+        except BaseException:
+            connection.rollback()
+            raise
+        if abort.is_set():
+            connection.rollback()
+
+    def write(index: int) -> None:
+        try:
+            if index == 0:
+                drain_or_rollback(target_connection, index)
+            else:
+                with target_connection.clone().connect() as connection:
+                    drain_or_rollback(connection, index)
+        except BaseException as e:
+            fail(e)
+
+    threads = [threading.Thread(target=read, name="copy_table-reader", daemon=True)]
+    for i in range(writers):
+        threads.append(
+            threading.Thread(
+                target=write, args=(i,), name=f"copy_table-writer-{i}", daemon=True
+            )
+        )
+
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    except BaseException:
+        # e.g. KeyboardInterrupt in the calling thread
+        abort.set()
+        for t in threads:
+            t.join()
+        raise
+
+    if errors:
+        logger.error("pipelined copy into %s aborted: %s", plan.table.name, errors[0])
+        raise errors[0]
+
+    return sum(written)
+
+
+# the types of the columns that range partitioning can split
+_RANGE_TYPES = (int, float, decimal.Decimal, datetime.date)
+
+
+def _range_bounds(lowest, highest, partitions: int) -> list:
+    """Split [lowest, highest] in partitions equal ranges, return the inner
+    bounds. Numbers, decimals, dates and datetimes split the same way."""
+    if isinstance(lowest, int) and isinstance(highest, int):
+        width = highest - lowest + 1
+        bounds = [lowest + (width * i) // partitions for i in range(1, partitions)]
+    else:
+        width = highest - lowest
+        bounds = [lowest + (width * i) / partitions for i in range(1, partitions)]
+    # small ranges give duplicate bounds, those would make empty partitions
+    return sorted(b for b in set(bounds) if b > lowest)
+
+
+def _partition_bounds(
+    connection: Connection,
+    table_name: str,
+    partition_column: str,
+    partitions: int,
+    method: str,
+    where: str = None,
+    params: Sequence = None,
+) -> list:
+    """Return the sorted inner bounds that split the rows of table_name that
+    match where in partitions."""
+    if method == "ntile":
+        q = f"""
+        select min(k) as lower_bound
+        from (
+            select [{partition_column}] as k,
+            ntile({partitions}) over (order by [{partition_column}]) as tile
+            from {table_name}
+            where [{partition_column}] is not null{f" and ({where})" if where else ""}
+        ) as t
+        group by tile"""
+        lower_bounds = [
+            r.get("lower_bound") for r in connection.select_data(q, params=params)
+        ]
+        # the first tile starts at the lowest value, it doesn't split anything
+        return sorted(set(lower_bounds))[1:]
+
+    if method == "range":
+        q = f"""
+        select min([{partition_column}]) as lowest, max([{partition_column}]) as highest
+        from {table_name}{f" where {where}" if where else ""}"""
+        limits = list(connection.select_data(q, params=params))[0]
+        lowest, highest = limits.get("lowest"), limits.get("highest")
+        if lowest is None:
+            return []
+        if not isinstance(lowest, _RANGE_TYPES) or isinstance(lowest, bool):
+            raise ValueError(
+                "range partitioning needs a numeric or date column, "
+                f"{partition_column} is {type(lowest).__name__}, "
+                "use partition_method='ntile'"
+            )
+        return _range_bounds(lowest, highest, partitions)
+
+    raise ValueError(f"partition_method must be 'ntile' or 'range', got {method}")
+
+
+def _partition_filters(
+    partition_column: str, bounds: list, where: str = None, params: Sequence = None
+) -> list[tuple[str, list]]:
+    """Turn inner bounds into a where clause and its parameters per partition.
+
+    Every partition is a half open range [lower, upper), so each row is in
+    exactly one partition. Nulls go to the first partition. A where condition
+    with its params is added to every partition.
+    """
+    key = f"[{partition_column}]"
+    if not bounds:
+        filters = [("", [])]
+    else:
+        filters = [(f" where {key} < ? or {key} is null", [bounds[0]])]
+        for lower, upper in zip(bounds, bounds[1:]):
+            filters.append((f" where {key} >= ? and {key} < ?", [lower, upper]))
+        filters.append((f" where {key} >= ?", [bounds[-1]]))
+
+    if not where:
+        return filters
+    params = list(params or [])
+    return [
+        (
+            (
+                f" where ({where}) and ({f.removeprefix(' where ')})"
+                if f
+                else f" where {where}"
+            ),
+            params + p,
+        )
+        for f, p in filters
+    ]
+
+
+def _partitioned_insert(
+    source_connection: Connection,
+    table_name: str,
+    plan: InsertPlan,
+    partition_column: str,
+    parallel: int,
+    partition_method: str,
+    chunk_length: int | AdaptiveBatchSize,
+    commit_every: int = None,
+    select: str = "*",
+    where: str = None,
+    params: Sequence = None,
+) -> int:
+    """Copy table_name with plan in parallel partitions on partition_column.
+
+    Each partition is copied on its own pair of source and target connections,
+    opened with clone(), and commits after every commit_every rows and at its
+    end. The first error stops the remaining partitions and is re-raised.
+    Returns the number of rows copied.
+    """
+    if parallel < 1:
+        raise ValueError(f"parallel must be at least 1, got {parallel}")
+
+    bounds = _partition_bounds(
+        source_connection,
+        table_name,
+        partition_column,
+        parallel,
+        partition_method,
+        where=where,
+        params=params,
+    )
+    filters = _partition_filters(partition_column, bounds, where, params)
+    logger.info(
+        "copying %s in %s partitions on %s", table_name, len(filters), partition_column
+    )
+
+    abort = threading.Event()
+
+    def copy_partition(where: str, params: list) -> int:
+        with (
+            source_connection.clone().connect() as source,
+            plan.connection.clone().connect() as target,
+        ):
+            rows = source.select_data(
+                f"select {select} from {table_name}{where}",
+                row_type=tuple,
+                table=plan.table,
+                params=params,
+                stats=plan.stats,
+            )
+            partition_plan = plan.bind(target)
+            written = 0
+            uncommitted = 0
+            try:
+                for chunk in _chunks(rows, chunk_length):
+                    if abort.is_set():
+                        target.rollback()
+                        return written
+                    partition_plan.write(chunk, commit=False)
+                    written += len(chunk)
+                    uncommitted += len(chunk)
+                    if commit_every is not None and uncommitted >= commit_every:
+                        target.commit()
+                        uncommitted = 0
+            except BaseException:
+                # don't leave the uncommitted chunks of a failed partition behind
+                target.rollback()
+                raise
+            if uncommitted:
+                target.commit()
+            return written
+
+    with ThreadPoolExecutor(
+        max_workers=parallel, thread_name_prefix="copy_table"
+    ) as pool:
+        futures = [
+            pool.submit(copy_partition, where, params) for where, params in filters
+        ]
+        try:
+            return sum(future.result() for future in futures)
+        except BaseException:
+            abort.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+            raise
+
+
+class TableCheckpoint:
+    """
+    Stores the progress of resumable copies in a table in the target database.
+    The progress is saved in the same transaction as the chunk it describes.
+    """
+
+    transactional = True
+
+    def __init__(self, table_name: str = "dbo.etl_copy_checkpoint") -> None:
+        self.table_name = table_name
+
+    def _table(self) -> Table:
+        return Table(
+            self.table_name,
+            columns=[
+                Column(name="copy_name", type="nvarchar", nullable=False, length=256),
+                Column(name="last_key", type="nvarchar", nullable=True, length=100),
+                Column(name="chunk", type="int", nullable=False),
+                Column(name="row_count", type="bigint", nullable=False),
+                Column(
+                    name="updated_at",
+                    type="datetime2",
+                    nullable=False,
+                    default="getdate()",
+                ),
+            ],
+        )
+
+    def prepare(self, connection: Connection) -> None:
+        """Create the checkpoint table, unless it exists."""
+        if not connection.if_exists(self.table_name):
+            connection.create_table(self._table(), drop_if_exists=False)
+
+    def load(self, connection: Connection, copy_name: str) -> dict | None:
+        name = connection.quote_table_name(self.table_name)
+        state = list(
+            connection.select_data(
+                f"select last_key, chunk, row_count from {name} where copy_name = ?",
+                params=[copy_name],
+            )
+        )
+        if not state:
+            return None
+        return {
+            "last_key": state[0].get("last_key"),
+            "chunk": state[0].get("chunk"),
+            "rows": state[0].get("row_count"),
+        }
+
+    def save(
+        self,
+        connection: Connection,
+        copy_name: str,
+        last_key: str,
+        chunk: int,
+        rows: int,
+    ) -> None:
+        # no commit, that happens together with the chunk
+        self.clear(connection, copy_name, commit=False)
+        name = connection.quote_table_name(self.table_name)
+        connection.execute_sql(
+            f"""insert into {name} (copy_name, last_key, chunk, row_count)
+            values (?, ?, ?, ?)""",
+            params=[copy_name, last_key, chunk, rows],
+            commit=False,
+        )
+
+    def clear(
+        self, connection: Connection, copy_name: str, commit: bool = True
+    ) -> None:
+        name = connection.quote_table_name(self.table_name)
+        connection.execute_sql(
+            f"delete from {name} where copy_name = ?",
+            params=[copy_name],
+            commit=commit,
+        )
+
+
+class FileCheckpoint:
+    """
+    Stores the progress of resumable copies in a local json file. The file is
+    written after each chunk is committed, so a crash in between repeats at
+    most that one chunk.
+    """
+
+    transactional = False
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _write(self, states: dict) -> None:
+        # write a new file and swap it in, so a crash never leaves half a file
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(states, f)
+        os.replace(temp_path, self.path)
+
+    def prepare(self, connection: Connection) -> None:
+        pass
+
+    def load(self, connection: Connection, copy_name: str) -> dict | None:
+        return self._read().get(copy_name)
+
+    def save(
+        self,
+        connection: Connection,
+        copy_name: str,
+        last_key: str,
+        chunk: int,
+        rows: int,
+    ) -> None:
+        states = self._read()
+        states[copy_name] = {"last_key": last_key, "chunk": chunk, "rows": rows}
+        self._write(states)
+
+    def clear(self, connection: Connection, copy_name: str) -> None:
+        states = self._read()
+        if states.pop(copy_name, None) is not None:
+            self._write(states)
+
+
+def _resumable_insert(
+    source_connection: Connection,
+    table_name: str,
+    plan: InsertPlan,
+    copy_name: str,
+    checkpoint_column: str,
+    checkpoint: TableCheckpoint | FileCheckpoint,
+    state: dict | None,
+    chunk_length: int | AdaptiveBatchSize,
+    commit_every: int = None,
+    select: str = "*",
+    where: str = None,
+    params: Sequence = None,
+) -> int:
+    """Copy table_name in checkpoint_column order, saving progress with every
+    commit: after each commit_every rows (every chunk when None) and at the end.
+    select, where and params shape the source query, see copy_table.
+
+    Returns the number of rows in the temporary table, including those copied
+    by earlier attempts.
+    """
+    if checkpoint_column not in plan.index:
+        raise KeyError(
+            f"checkpoint column {checkpoint_column} is not a column of {table_name}"
+        )
+    key_index = plan.index[checkpoint_column]
+    key_column = plan.table.columns[key_index]
+    target_connection = plan.connection
+
+    conditions = [f"({where})"] if where else []
+    params = list(params or [])
+    if state is None:
+        state = {"last_key": None, "chunk": 0, "rows": 0}
+    elif state["last_key"] is not None:
+        conditions.append(f"[{checkpoint_column}] > ?")
+        params.append(_value_from_text(state["last_key"], key_column))
+        logger.info(
+            "resuming copy of %s after chunk %s (%s rows)",
+            table_name,
+            state["chunk"],
+            state["rows"],
+        )
+    query = f"select {select} from {table_name}"
+    if conditions:
+        query += " where " + " and ".join(conditions)
+    query += f" order by [{checkpoint_column}]"
+
+    generator = source_connection.select_data(
+        query,
+        row_type=tuple,
+        table=plan.table,
+        params=params or None,
+        stats=plan.stats,
+    )
+    chunk_number = state["chunk"]
+    rows = state["rows"]
+
+    def commit(last_key: str) -> None:
+        if checkpoint.transactional:
+            checkpoint.save(target_connection, copy_name, last_key, chunk_number, rows)
+            target_connection.commit()
+        else:
+            target_connection.commit()
+            checkpoint.save(target_connection, copy_name, last_key, chunk_number, rows)
+
+    uncommitted = 0
+    try:
+        for chunk in _chunks(generator, chunk_length):
+            plan.write(chunk, commit=False)
+            chunk_number += 1
+            rows += len(chunk)
+            uncommitted += len(chunk)
+            last_key = _value_to_text(chunk[-1][key_index])
+            if commit_every is None or uncommitted >= commit_every:
+                commit(last_key)
+                uncommitted = 0
+    except BaseException:
+        # the chunks after the last checkpoint are copied again on the next run
+        target_connection.rollback()
+        raise
+    if uncommitted:
+        commit(last_key)
+
+    return rows
+
 
 # All steps involved in copying a table
 def copy_table(
@@ -218,7 +1201,97 @@ def copy_table(
     table_name: str,
     target_connection: Connection,
     into: str = None,
-) -> None:
+    pipeline: bool = False,
+    queue_depth: int = 4,
+    writers: int = 1,
+    partition_column: str = None,
+    parallel: int = 1,
+    partition_method: str = "ntile",
+    checkpoint_column: str = None,
+    checkpoint: TableCheckpoint | FileCheckpoint = None,
+    stats: Stats = None,
+    stats_level: int = logging.INFO,
+    commit_every: int | None = 1000,
+    single_transaction: bool = False,
+    chunk_length: int = 1000,
+    memory_budget: int | None = 64 * 1024 * 1024,
+    columns: list[str] = None,
+    where: str = None,
+    params: Sequence = None,
+) -> Stats:
+    """Copy a table from the source to the target connection.
+
+    Returns a Stats with the time spent per stage: reading the table
+    definition, creating the table, execute, fetch and building rows on the
+    source, preparing rows, executemany and commit on the target, and the
+    final swap. The "copy" stage covers the whole data transfer and counts the
+    copied rows. The stats are also logged at stats_level, and added to stats
+    when given.
+
+    The data is loaded into a temporary table which replaces the target table
+    once all rows are copied. With pipeline=True the source is read on a
+    separate thread into a queue of at most queue_depth chunks, which is
+    drained by the given number of writer threads. Each extra writer uses its
+    own target connection.
+
+    With a partition_column the source is split in parallel ranges on that
+    column, with ntile (evenly filled) or range (evenly wide, numeric, decimal
+    and date columns only) boundaries. Each range is copied on its own
+    connection pair into the same temporary table, which replaces the target
+    once every range is done.
+
+    With a checkpoint_column the copy is resumable. The source is read in the
+    order of that column, which must be unique, and after each committed chunk
+    the last key, the chunk number and the row count are saved in checkpoint
+    (a TableCheckpoint in the target database by default, or a FileCheckpoint).
+    When a copy fails, running it again continues after the last saved key
+    into the existing temporary table.
+
+    The target commits after every commit_every rows (per writer or
+    partition), or once at the end when commit_every is None (a resumable copy
+    then commits, and saves its checkpoint, after every chunk). Fewer commits
+    mean fewer log flushes on the target. With single_transaction=True the
+    whole copy, from creating the temporary table to the final swap, is one
+    transaction that is rolled back when the copy fails; it needs a single
+    target connection, so no partitions, extra writers or checkpoints.
+
+    Rows are inserted in chunks of at most chunk_length rows, fewer when a
+    chunk would take more than memory_budget bytes of driver buffers. The
+    size of a row is estimated from the column definitions and, for (max)
+    columns, from the values in the chunks copied so far; until the first
+    chunk is seen a table with (max) columns is copied in chunks of at most
+    100 rows. When fewer than 100 rows fit in the budget the rows are
+    inserted one by one (the "streaming insert" stage), so the driver streams
+    the large values instead of buffering a chunk of them. The budget is per
+    chunk: a pipelined copy holds up to queue_depth chunks plus one per
+    writer. memory_budget=None keeps chunks of chunk_length rows.
+
+    columns copies only those columns, in that order, and where (a condition
+    in the SQL of the source, with ? placeholders for params) only the rows
+    that match it. Both are part of the source query, so other data stays on
+    the source, and the target table only has the copied columns. In a
+    partitioned copy the condition also applies to the partition bounds; a
+    checkpoint_column must be one of the columns.
+    """
+    modes = [pipeline, partition_column is not None, checkpoint_column is not None]
+    if sum(modes) > 1:
+        raise ValueError(
+            "pipeline, partition_column and checkpoint_column can't be combined"
+        )
+    if single_transaction and (
+        partition_column is not None or checkpoint_column is not None or writers > 1
+    ):
+        raise ValueError(
+            "single_transaction can't be combined with partition_column, "
+            "checkpoint_column or more than one writer"
+        )
+    if commit_every is not None and commit_every < 1:
+        raise ValueError(f"commit_every must be at least 1, got {commit_every}")
+    if chunk_length < 1:
+        raise ValueError(f"chunk_length must be at least 1, got {chunk_length}")
+    if memory_budget is not None and memory_budget < 1:
+        raise ValueError(f"memory_budget must be at least 1, got {memory_budget}")
+
     # override name if asked
     if into is not None:
         target_name = into
@@ -226,36 +1299,567 @@ def copy_table(
         target_name = table_name
 
     temp_name = f"{target_name}_temporary"
+    if stats is None:
+        stats = Stats()
 
     # Get the table definition
-    table = Table.from_connection(source_connection, table_name)
+    with stats.measure("table definition"):
+        table = source_connection.table_definition(table_name)
+
+    if columns is not None:
+        definitions = {c.name: c for c in table.columns}
+        for c in columns:
+            if c not in definitions:
+                raise KeyError(f"column {c} is not a column of {table_name}")
+        table.columns = [definitions[c] for c in columns]
+    if columns is None:
+        select = "*"
+    else:
+        select = ", ".join(c.quoted_name() for c in table.columns)
 
     # set the name to temporary name
     table.name = temp_name
 
-    # create the table in the target database, drop if exists
-    target_connection.create_table(table, drop_if_exists=False)
-
-    # get the data
-    generator = source_connection.select_data(f"select * from {table_name}")
-
-    # write data from the generator in chunks to the temp table
-    chunk = []
-    chunk_length = 1000
-    i = 0
-    for row in generator:
-        chunk.append(row)
-        i += 1
-        if i == chunk_length:
-            target_connection.sql_insert_dictionary(table, chunk)
-            chunk.clear()
-            i = 0
-    if i > 0 and i < chunk_length:
-        target_connection.sql_insert_dictionary(table, chunk)
-
-    # now switch by dropping the old table and renaming the temp table
-    # note: we must remove the schema from the name as it will mess up the sp_rename call
-    data = {"target_name": target_name.split(".")[-1], "temp_table_name": temp_name}
-    q = sql_render("finalize_copy.sql", data=data)
-
-    target_connection.execute_sql(q)
+    # in a single transaction the commits inside are skipped, it commits at the end
+    if single_transaction:
+        transaction = target_connection.transaction()
+    else:
+        transaction = nullcontext()
+
+    with transaction:
+        with stats.measure("create table"):
+            if checkpoint_column is not None:
+                if checkpoint is None:
+                    checkpoint = TableCheckpoint()
+                # before the first save, also when no earlier copy left a table
+                checkpoint.prepare(target_connection)
+                state = None
+                if target_connection.if_exists(temp_name):
+                    state = checkpoint.load(target_connection, target_name)
+                # a temporary table without checkpoint is left from an unknown copy, start over
+                if state is None:
+                    target_connection.create_table(table, drop_if_exists=True)
+            else:
+                # create the table in the target database, drop if exists
+                target_connection.create_table(table, drop_if_exists=False)
+
+        # prepare the insert once for all chunks, select * returns the values in
+        # the same order as the columns of the table definition
+        plan = target_connection.insert_plan(table, mapping=False, stats=stats)
+        chunk_size = chunk_length
+        if memory_budget is not None:
+            chunk_size = TableBatchSize(
+                table, target_bytes=memory_budget, maximum=chunk_length
+            )
+            plan.engine = StreamingFallback(plan.engine, chunk_size)
+
+        with stats.measure("copy") as copied:
+            copied.rows = _copy_rows(
+                source_connection,
+                source_connection.quote_table_name(table_name),
+                target_name,
+                plan,
+                pipeline=pipeline,
+                queue_depth=queue_depth,
+                writers=writers,
+                partition_column=partition_column,
+                parallel=parallel,
+                partition_method=partition_method,
+                checkpoint_column=checkpoint_column,
+                checkpoint=checkpoint,
+                state=state if checkpoint_column is not None else None,
+                chunk_length=chunk_size,
+                commit_every=commit_every,
+                select=select,
+                where=where,
+                params=params,
+            )
+
+        # now switch by dropping the old table and renaming the temp table
+        with stats.measure("finalize"):
+            target_connection.replace_table(temp_name, target_name)
+
+            if checkpoint_column is not None:
+                checkpoint.clear(target_connection, target_name)
+
+    stats.log(stats_level, title=f"copy of {table_name}", log=logger)
+    return stats
+
+
+def _copy_rows(
+    source_connection: Connection,
+    table_name: str,
+    target_name: str,
+    plan: InsertPlan,
+    pipeline: bool,
+    queue_depth: int,
+    writers: int,
+    partition_column: str | None,
+    parallel: int,
+    partition_method: str,
+    checkpoint_column: str | None,
+    checkpoint: TableCheckpoint | FileCheckpoint | None,
+    state: dict | None,
+    chunk_length: int | AdaptiveBatchSize,
+    commit_every: int | None,
+    select: str = "*",
+    where: str = None,
+    params: Sequence = None,
+) -> int:
+    """Copy the rows of table_name with plan in the mode chosen in copy_table."""
+    target_connection = plan.connection
+    if checkpoint_column is not None:
+        rows = _resumable_insert(
+            source_connection,
+            table_name,
+            plan,
+            copy_name=target_name,
+            checkpoint_column=checkpoint_column,
+            checkpoint=checkpoint,
+            state=state,
+            chunk_length=chunk_length,
+            commit_every=commit_every,
+            select=select,
+            where=where,
+            params=params,
+        )
+    elif partition_column is not None:
+        rows = _partitioned_insert(
+            source_connection,
+            table_name,
+            plan,
+            partition_column=partition_column,
+            parallel=parallel,
+            partition_method=partition_method,
+            chunk_length=chunk_length,
+            commit_every=commit_every,
+            select=select,
+            where=where,
+            params=params,
+        )
+    else:
+        # get the data
+        query = f"select {select} from {table_name}"
+        if where:
+            query += f" where {where}"
+        generator = source_connection.select_data(
+            query, row_type=tuple, table=plan.table, params=params, stats=plan.stats
+        )
+
+        # write data from the generator in chunks to the temp table
+        if pipeline:
+            rows = _pipelined_insert(
+                generator,
+                plan,
+                target_connection,
+                chunk_length=chunk_length,
+                queue_depth=queue_depth,
+                writers=writers,
+                commit_every=commit_every,
+            )
+        else:
+            rows = plan.write_all(
+                generator, chunk_size=chunk_length, commit_every=commit_every
+            )
+    return rows
+
+
+def _value_to_text(value) -> str:
+    """Text to store a watermark or checkpoint key in a state table or file."""
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _value_from_text(text: str, column: Column):
+    """A value stored with _value_to_text, as the type of column."""
+    match column.type:
+        case "int" | "tinyint" | "smallint" | "bigint":
+            return int(text)
+        case "decimal" | "numeric":
+            return decimal.Decimal(text)
+        case "date":
+            return datetime.date.fromisoformat(text)
+        case "datetime" | "datetime2" | "smalldatetime":
+            return datetime.datetime.fromisoformat(text)
+        case "timestamp" | "rowversion" | "binary" | "varbinary":
+            return bytes.fromhex(text)
+        case _:
+            return text
+
+
+def _watermark_state_table(name: str) -> Table:
+    return Table(
+        name,
+        columns=[
+            Column(name="table_name", type="nvarchar", nullable=False, length=256),
+            Column(
+                name="watermark_column", type="nvarchar", nullable=False, length=128
+            ),
+            Column(name="watermark_value", type="nvarchar", nullable=True, length=100),
+            Column(
+                name="updated_at", type="datetime2", nullable=False, default="getdate()"
+            ),
+        ],
+    )
+
+
+def copy_table_incremental(
+    source_connection: Connection,
+    table_name: str,
+    target_connection: Connection,
+    watermark_column: str,
+    into: str = None,
+    key_columns: list[str] = None,
+    state_table: str = "dbo.etl_watermark",
+) -> int:
+    """Copy only the rows added or changed since the previous copy.
+
+    Rows with a watermark_column value (rowversion, identity, modified date)
+    above the watermark stored for the target in state_table are loaded into a
+    staging table, and from there appended to the target. With key_columns
+    they are merged instead: existing keys are updated, new keys inserted.
+    The new watermark is stored in the same transaction. The target table is
+    created when it doesn't exist yet. Returns the number of copied rows.
+
+    A rowversion watermark is read up to min_active_rowversion(), the lowest
+    rowversion of the transactions still open on the source, and that bound is
+    stored as the new watermark, so rows committed later with a lower value
+    are copied by the next run. An identity or date watermark is the highest
+    copied value: a concurrent transaction that commits a lower value after
+    the copy read the table is skipped. Use those only when the source isn't
+    written to during the copy, or use a rowversion column.
+    """
+    # override name if asked
+    if into is not None:
+        target_name = into
+    else:
+        target_name = table_name
+
+    staging_name = f"{target_name}_staging"
+
+    # Get the table definition
+    table = source_connection.table_definition(table_name)
+    columns = {c.name: c for c in table.columns}
+    if watermark_column not in columns:
+        raise KeyError(
+            f"watermark column {watermark_column} is not a column of {table_name}"
+        )
+    for k in key_columns or []:
+        if k not in columns:
+            raise KeyError(f"key column {k} is not a column of {table_name}")
+
+    # read the watermark of the previous copy
+    if not target_connection.if_exists(state_table):
+        target_connection.create_table(
+            _watermark_state_table(state_table), drop_if_exists=False
+        )
+    state = list(
+        target_connection.select_data(
+            f"select watermark_value from {state_table} where table_name = ?",
+            params=[target_name],
+        )
+    )
+    if state and state[0].get("watermark_value") is not None:
+        last_watermark = _value_from_text(
+            state[0].get("watermark_value"), columns[watermark_column]
+        )
+    else:
+        last_watermark = None
+    logger.info("copying %s from watermark %s", table_name, last_watermark)
+
+    if not target_connection.if_exists(target_name):
+        target_table = copy.deepcopy(table)
+        target_table.name = target_name
+        target_connection.create_table(target_table, drop_if_exists=False)
+
+    # load the new rows into the staging table
+    table.name = staging_name
+    target_connection.create_table(table, drop_if_exists=True)
+
+    # rows below the lowest active rowversion are committed, rows above it may
+    # still be joined by rows of open transactions with a lower rowversion
+    upper_bound = None
+    if columns[watermark_column].type in ("timestamp", "rowversion"):
+        upper_bound = list(
+            source_connection.select_data("select min_active_rowversion() as bound")
+        )[0].get("bound")
+
+    conditions = []
+    params = []
+    if last_watermark is not None:
+        # the stored bound itself wasn't read yet
+        operator = ">" if upper_bound is None else ">="
+        conditions.append(f"[{watermark_column}] {operator} ?")
+        params.append(last_watermark)
+    if upper_bound is not None:
+        conditions.append(f"[{watermark_column}] < ?")
+        params.append(upper_bound)
+    query = f"select * from {table_name}"
+    if conditions:
+        query += " where " + " and ".join(conditions)
+    generator = source_connection.select_data(
+        query, row_type=tuple, table=table, params=params or None
+    )
+
+    plan = target_connection.insert_plan(table, mapping=False)
+    copied = 0
+    for chunk in _chunks(generator, 1000):
+        plan.write(chunk)
+        copied += len(chunk)
+
+    if copied == 0:
+        target_connection.drop_table(staging_name)
+        return 0
+
+    if upper_bound is not None:
+        new_watermark = upper_bound
+    else:
+        new_watermark = list(
+            target_connection.select_data(
+                f"select max([{watermark_column}]) as watermark from {staging_name}"
+            )
+        )[0].get("watermark")
+
+    # move the staged rows into the target and store the new watermark, in one transaction
+    if key_columns:
+        data = {
+            "target_name": target_name,
+            "source_name": staging_name,
+            "key_columns": [columns[k] for k in key_columns],
+            "update_columns": [c for c in table.columns if c.name not in key_columns],
+            "columns": table.columns,
+        }
+        q = sql_render("merge.sql", data=data)
+    else:
+        column_list = ", ".join(c.quoted_name() for c in table.columns)
+        q = f"insert into {target_name} ({column_list}) select {column_list} from {staging_name}"
+    target_connection.execute_sql(q, commit=False)
+
+    target_connection.execute_sql(
+        f"delete from {state_table} where table_name = ?",
+        params=[target_name],
+        commit=False,
+    )
+    target_connection.execute_sql(
+        f"""insert into {state_table} (table_name, watermark_column, watermark_value)
+        values (?, ?, ?)""",
+        params=[target_name, watermark_column, _value_to_text(new_watermark)],
+    )
+
+    target_connection.drop_table(staging_name)
+    logger.info(
+        "copied %s rows from %s, new watermark %s", copied, table_name, new_watermark
+    )
+    return copied
+
+
+class TableCopyReport:
+    """Outcome of copying one table with copy_schema."""
+
+    def __init__(
+        self,
+        table_name: str,
+        status: str,
+        rows: int | None,
+        duration: float,
+        estimated_rows: int | None = None,
+        error: BaseException = None,
+        stats: Stats = None,
+    ) -> None:
+        self.table_name = table_name
+        self.status = status
+        self.rows = rows
+        self.duration = duration
+        self.estimated_rows = estimated_rows
+        self.error = error
+        self.stats = stats
+
+    def __repr__(self) -> str:
+        return (
+            f"TableCopyReport(table_name={self.table_name!r}, status={self.status!r}, "
+            f"rows={self.rows!r}, duration={self.duration:.3f})"
+        )
+
+
+def copy_schema(
+    source_connection: Connection,
+    target_connection: Connection,
+    schema: str,
+    startswith: str = None,
+    contains: str = None,
+    into_schema: str = None,
+    workers: int = 4,
+    **copy_options,
+) -> list[TableCopyReport]:
+    """Copy all tables of a schema with copy_table on a pool of worker threads.
+
+    Tables are selected like list_tables and copied biggest first, by the row
+    count estimates in sys.partitions. Each worker copies one table at a time
+    on its own pair of connections, opened with clone(). A failed copy is
+    logged and reported, and the worker reconnects before the next table.
+    copy_options are passed on to copy_table, except into: the target names
+    follow from into_schema. Returns one report per table, in the order the
+    copies were started.
+    """
+    if workers < 1:
+        raise ValueError(f"workers must be at least 1, got {workers}")
+    if "into" in copy_options:
+        raise ValueError("copy_schema names the target tables, use into_schema")
+
+    estimates = source_connection.table_row_counts(schema, startswith, contains)
+    tasks = queue.Queue()
+    for table_name in estimates:
+        tasks.put(table_name)
+    reports = {}
+
+    def copy_one(table_name: str, source: Connection, target: Connection) -> Stats:
+        into = None
+        if into_schema is not None:
+            into = f"{into_schema}.{table_name.split('.')[-1]}"
+        return copy_table(source, table_name, target, into=into, **copy_options)
+
+    def work() -> None:
+        connections = ExitStack()
+        opened = None
+        try:
+            while True:
+                try:
+                    table_name = tasks.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                try:
+                    if opened is None:
+                        opened = (
+                            connections.enter_context(
+                                source_connection.clone().connect()
+                            ),
+                            connections.enter_context(
+                                target_connection.clone().connect()
+                            ),
+                        )
+                    stats = copy_one(table_name, *opened)
+                except Exception as e:
+                    logger.error("copy of %s failed: %s", table_name, e)
+                    reports[table_name] = TableCopyReport(
+                        table_name,
+                        "failed",
+                        None,
+                        time.perf_counter() - start,
+                        estimates[table_name],
+                        error=e,
+                    )
+                    # the connections may be left in a broken state, start over
+                    try:
+                        connections.close()
+                    except Exception as close_error:
+                        logger.warning("closing connections failed: %s", close_error)
+                    opened = None
+                else:
+                    duration = time.perf_counter() - start
+                    rows = stats["copy"].rows
+                    logger.info(
+                        "copied %s rows of %s in %.1fs", rows, table_name, duration
+                    )
+                    reports[table_name] = TableCopyReport(
+                        table_name,
+                        "copied",
+                        rows,
+                        duration,
+                        estimates[table_name],
+                        stats=stats,
+                    )
+        finally:
+            connections.close()
+
+    threads = [
+        threading.Thread(target=work, name=f"copy_schema-{i}", daemon=True)
+        for i in range(min(workers, len(estimates)))
+    ]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    except BaseException:
+        # e.g. KeyboardInterrupt, let the workers finish their current table
+        while not tasks.empty():
+            try:
+                tasks.get_nowait()
+            except queue.Empty:
+                break
+        for t in threads:
+            t.join()
+        raise
+
+    report = [reports[t] for t in estimates if t in reports]
+    failed = sum(1 for r in report if r.status == "failed")
+    logger.info(
+        "copied %s tables of %s, %s failed", len(report) - failed, schema, failed
+    )
+    return report
+
+
+def compare_insert_engines(
+    connection: SQLserverconnection,
+    table: str | Table,
+    rows: Iterable[list],
+    engines: Sequence[str | type[InsertEngine]] = ("fast_executemany", "values", "tvp"),
+    repeat: int = 3,
+) -> list[dict]:
+    """
+    Time each insert engine on a sample of rows (lists in column order) and
+    return one result per engine, fastest first:
+
+        {"engine": "values", "rows": 1000, "seconds": 0.12, "rows_per_second": ...}
+
+    Every run is rolled back, so the table is left as it was; the fastest of
+    repeat runs counts. An engine that fails, e.g. tvp without the permission
+    to create a type, gets its error instead of timings. The winner is logged,
+    pass it as insert_engine to the connection or as engine to the inserts.
+    """
+    if connection._transaction_depth:
+        raise ValueError("can't compare insert engines inside a transaction")
+    if repeat < 1:
+        raise ValueError(f"repeat must be at least 1, got {repeat}")
+    if isinstance(table, str):
+        table = Table.from_connection(connection, table)
+    rows = list(rows)
+
+    results = []
+    for engine in engines:
+        name = engine if isinstance(engine, str) else engine.name
+        result = {"engine": name, "rows": len(rows)}
+        timings = []
+        try:
+            # one plan, so a tvp type is created once
+            plan = connection.insert_plan(table, mapping=False, engine=engine)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                try:
+                    plan.write(rows, commit=False)
+                    timings.append(time.perf_counter() - start)
+                finally:
+                    connection.connection.rollback()
+        except pyodbc.Error as e:
+            logger.warning("insert engine %s failed: %s", name, e)
+            result["error"] = str(e)
+        if timings:
+            best = min(timings)
+            result["seconds"] = best
+            result["rows_per_second"] = len(rows) / best if best else None
+        results.append(result)
+
+    results.sort(key=lambda r: -(r.get("rows_per_second") or 0))
+    winner = results[0] if results and "seconds" in results[0] else None
+    if winner is not None:
+        logger.info(
+            "insert engine %s won on %s: %.0f rows/s",
+            winner["engine"],
+            table.name,
+            winner["rows_per_second"] or 0,
+        )
+    return results
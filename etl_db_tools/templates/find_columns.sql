@@ -0,0 +1,21 @@
+
+select concat(sc.name, '.', s.[name]) as table_name
+    ,c.COLUMN_NAME
+    ,c.DATA_TYPE
+    ,convert(bit, iif(c.IS_NULLABLE = 'YES' , 1, 0)) as IS_NULLABLE
+    ,c.CHARACTER_MAXIMUM_LENGTH
+    ,c.NUMERIC_PRECISION
+    ,c.NUMERIC_SCALE
+    ,case 
+        when c.COLUMN_DEFAULT = '(getdate())' then 'getdate()'
+        when left(c.COLUMN_DEFAULT, 3) = '(N''' then substring(c.COLUMN_DEFAULT, 4, len(c.COLUMN_DEFAULT)-5) 
+        else substring(c.COLUMN_DEFAULT, 3, len(c.COLUMN_DEFAULT)-4) 
+        end as COLUMN_DEFAULT
+from sys.tables as s
+inner join sys.schemas as sc
+on s.schema_id = sc.schema_id
+inner join information_schema.columns as c
+on c.TABLE_SCHEMA = sc.name and c.TABLE_NAME = s.name
+where 1=1
+{% include "table_filters.sql" %}
+order by s.object_id, c.ORDINAL_POSITION
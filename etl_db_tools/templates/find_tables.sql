@@ -4,13 +4,5 @@ from sys.tables as s
 inner join sys.schemas as sc
 on s.schema_id = sc.schema_id
 where 1=1
-    and sc.name = '{{data.schema}}'
-    {% if data.startswith %}
-    and s.name like '{{data.startswith}}%'
-    {% endif %}
-    and sc.name = '{{data.schema}}'
-    {% if data.contains %}
-    and s.name like '%{{data.contains}}%'
-    {% endif %}       
-    and s.[type] = 'U'
+{% include "table_filters.sql" %}
 order by s.object_id
\ No newline at end of file
@@ -0,0 +1,21 @@
+merge {{data.target_name}} as t
+using {{data.source_name}} as s
+on {% for c in data.key_columns -%}
+    t.{{c.quoted_name()}} = s.{{c.quoted_name()}}{{ " and " if not loop.last else "" }}
+    {%- endfor %}
+{% if data.update_columns -%}
+when matched then update set
+    {%- for c in data.update_columns %}
+    {{c.quoted_name()}} = s.{{c.quoted_name()}}{{ "," if not loop.last else "" }}
+    {%- endfor %}
+{% endif -%}
+when not matched by target then insert (
+    {%- for c in data.columns -%}
+    {{c.quoted_name()}}{{ ", " if not loop.last else "" }}
+    {%- endfor -%})
+values ({% for c in data.columns -%}
+    s.{{c.quoted_name()}}{{ ", " if not loop.last else "" }}
+    {%- endfor %})
+{%- if data.output %}
+output $action into {{data.output}}
+{%- endif %};
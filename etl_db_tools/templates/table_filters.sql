@@ -0,0 +1,8 @@
+    and sc.name = '{{data.schema}}'
+    {% if data.startswith %}
+    and s.name like '{{data.startswith}}%'
+    {% endif %}
+    {% if data.contains %}
+    and s.name like '%{{data.contains}}%'
+    {% endif %}
+    and s.[type] = 'U'
@@ -0,0 +1,12 @@
+
+select concat(sc.name, '.', s.[name]) as table_name, sum(p.rows) as row_count
+from sys.tables as s
+inner join sys.schemas as sc
+on s.schema_id = sc.schema_id
+inner join sys.partitions as p
+on p.object_id = s.object_id and p.index_id in (0, 1)
+where 1=1
+{% include "table_filters.sql" %}
+
+group by sc.name, s.name
+order by row_count desc, table_name
@@ -0,0 +1,9 @@
+set nocount on;
+declare @actions table ([action] nvarchar(10));
+
+{% include "merge.sql" %}
+
+select
+    count(case when [action] = 'INSERT' then 1 end) as inserted,
+    count(case when [action] = 'UPDATE' then 1 end) as updated
+from @actions;
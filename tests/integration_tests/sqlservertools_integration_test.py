@@ -4,6 +4,8 @@ import tomli
 import datetime
 from etl_db_tools.sqlservertools.sqlservertools import SQLserverconnection
 from etl_db_tools.sqlservertools.sqlservertools import Table, Column, copy_table
+from etl_db_tools.sqlservertools.sqlservertools import copy_table_incremental
+from etl_db_tools.sqlservertools.sqlservertools import copy_schema
 
 
 with open("secrets.toml", "rb") as t:
@@ -385,6 +387,149 @@ def test_can_copy_table_into_another(create_connection, create_connection_testus
     assert data_in_copy[0].get("N") == data_in_original[0].get("N")
     assert data_in_copy[0].get("total") == data_in_original[0].get("total")
 
+@pytest.mark.parametrize("partition_method", ["ntile", "range"])
+def test_can_copy_table_in_parallel(
+    create_connection, create_connection_testuser, create_test_data_long, partition_method
+):
+    cnxn = create_connection
+    cnxn2 = create_connection_testuser
+    create_test_data_long
+
+    copy_table(
+        cnxn,
+        "testing.original",
+        cnxn2,
+        into="testing.copy",
+        partition_column="id",
+        parallel=4,
+        partition_method=partition_method,
+    )
+
+    data_in_copy = list(
+        cnxn.select_data("select count(1) as N, sum(amount) as total from testing.copy")
+    )
+    data_in_original = list(
+        cnxn.select_data(
+            "select count(1) as N, sum(amount) as total from testing.original"
+        )
+    )
+
+    assert data_in_copy[0].get("N") == data_in_original[0].get("N")
+    assert data_in_copy[0].get("total") == data_in_original[0].get("total")
+
+
+def test_can_copy_schema(
+    create_connection, create_connection_testuser, create_test_data_long
+):
+    cnxn = create_connection
+    cnxn2 = create_connection_testuser
+    create_test_data_long
+
+    report = copy_schema(
+        cnxn, cnxn2, "testing", startswith="original", into_schema="testing_twee"
+    )
+
+    assert [(r.table_name, r.status) for r in report] == [
+        ("testing.original", "copied")
+    ]
+    data_in_copy = list(
+        cnxn.select_data("select count(1) as N from testing_twee.original")
+    )
+    assert data_in_copy[0].get("N") == report[0].rows
+
+
+def test_can_copy_table_incremental(
+    create_connection, create_connection_testuser, create_test_data_long
+):
+    cnxn = create_connection
+    cnxn2 = create_connection_testuser
+    create_test_data_long
+
+    cnxn2.execute_sql("drop table if exists testing.etl_watermark")
+    copied = copy_table_incremental(
+        cnxn,
+        "testing.original",
+        cnxn2,
+        watermark_column="id",
+        into="testing.copy",
+        state_table="testing.etl_watermark",
+    )
+    assert copied == 5005
+
+    cnxn.execute_sql(
+        "insert into testing.original (id, datum, amount) values (6000, '2040-01-01', 1.5)"
+    )
+    copied = copy_table_incremental(
+        cnxn,
+        "testing.original",
+        cnxn2,
+        watermark_column="id",
+        into="testing.copy",
+        state_table="testing.etl_watermark",
+    )
+    assert copied == 1
+
+    data_in_copy = list(
+        cnxn.select_data("select count(1) as N, sum(amount) as total from testing.copy")
+    )
+    data_in_original = list(
+        cnxn.select_data(
+            "select count(1) as N, sum(amount) as total from testing.original"
+        )
+    )
+    state = list(cnxn2.select_data("select * from testing.etl_watermark"))
+
+    assert data_in_copy[0].get("N") == data_in_original[0].get("N")
+    assert data_in_copy[0].get("total") == data_in_original[0].get("total")
+    assert state[0].get("watermark_value") == "6000"
+
+
+def test_copy_table_incremental_merges_on_key(
+    create_connection, create_connection_testuser, create_test_data_long
+):
+    cnxn = create_connection
+    cnxn2 = create_connection_testuser
+    create_test_data_long
+
+    cnxn.execute_sql("alter table testing.original add changed datetime2")
+    cnxn.execute_sql("update testing.original set changed = '2024-01-01'")
+    cnxn2.execute_sql("drop table if exists testing.etl_watermark")
+    arguments = dict(
+        watermark_column="changed",
+        into="testing.copy",
+        key_columns=["id"],
+        state_table="testing.etl_watermark",
+    )
+    copy_table_incremental(cnxn, "testing.original", cnxn2, **arguments)
+
+    cnxn.execute_sql(
+        "update testing.original set amount = 0, changed = '2024-02-01' where id = 5"
+    )
+    copied = copy_table_incremental(cnxn, "testing.original", cnxn2, **arguments)
+
+    data_in_copy = list(cnxn.select_data("select count(1) as N from testing.copy"))
+    row = list(cnxn.select_data("select amount from testing.copy where id = 5"))
+
+    assert copied == 1
+    assert data_in_copy[0].get("N") == 5005
+    assert row[0].get("amount") == 0
+
+
+def test_upsert_updates_and_inserts(create_connection, create_test_data_long):
+    cnxn = create_connection
+    create_test_data_long
+
+    rows = [{"id": i, "amount": 0} for i in (5, 6, 6000, 6001)]
+    result = cnxn.upsert("testing.original", rows, key_columns=["id"])
+
+    data = list(cnxn.select_data("select count(1) as N from testing.original"))
+    zero = list(
+        cnxn.select_data("select count(1) as N from testing.original where amount = 0")
+    )
+
+    assert result == {"inserted": 2, "updated": 2}
+    assert data[0].get("N") == 5007
+    assert zero[0].get("N") == 4
 
 
 def test_list_tables_finds_tables(clean_up_schema, create_connection):
@@ -598,3 +743,23 @@ def test_from_connection_creates_correct_colums(create_connection, create_test_d
     assert tbl.columns[7].to_sql() == 'datumtijd datetime default getdate()'
     assert tbl.columns[8].to_sql() == 'datumtijd_twee datetime2'    
 
+
+
+def test_many_from_connection_matches_from_connection(create_connection):
+    cnxn = create_connection
+
+    cnxn.execute_sql(
+        "drop table if exists testing.tabel_een; create table testing.tabel_een (id int, naam nvarchar(50))"
+    )
+    cnxn.execute_sql(
+        "drop table if exists testing.tabel_twee; create table testing.tabel_twee (id bigint not null)"
+    )
+
+    tables = Table.many_from_connection(cnxn, "testing", startswith="tabel")
+
+    assert list(tables) == ["testing.tabel_een", "testing.tabel_twee"]
+    for name, table in tables.items():
+        single = Table.from_connection(cnxn, name, use_cache=False)
+        assert [c.to_sql() for c in table.columns] == [
+            c.to_sql() for c in single.columns
+        ]
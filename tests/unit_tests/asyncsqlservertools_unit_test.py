@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import pytest
+from etl_db_tools.sqlservertools import sqlservertools
+from etl_db_tools.sqlservertools.sqlservertools import Column, Table
+from etl_db_tools.sqlservertools.asyncsqlservertools import AsyncSQLserverconnection
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rows = []
+        self.fast_executemany = False
+
+    def execute(self, query, *params):
+        self.connection.threads.add(threading.get_ident())
+        self.connection.statements.append(query)
+        self.description = [
+            ("id", int, None, 10, 10, 0, False),
+            ("name", str, None, 50, 50, 0, True),
+        ]
+        self.rows = [(i, f"row {i}") for i in range(7)]
+        return self
+
+    def fetchmany(self, size):
+        self.connection.threads.add(threading.get_ident())
+        self.connection.fetch_sizes.append(size)
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+    def executemany(self, query, rows):
+        self.connection.inserted.extend(rows)
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def commit(self):
+        self.connection.commits += 1
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.inserted = []
+        self.threads = set()
+        self.fetch_sizes = []
+        self.commits = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDbapi:
+    def __init__(self):
+        self.connections = []
+
+    def connect(self, connection_string):
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+
+@pytest.fixture
+def dbapi(monkeypatch):
+    fake = FakeDbapi()
+    monkeypatch.setattr(sqlservertools, "pyodbc", fake)
+    return fake
+
+
+def make_connection(**kwargs):
+    return AsyncSQLserverconnection(
+        "ODBC Driver 18 for SQL Server", "server", "database", **kwargs
+    )
+
+
+def test_select_data_yields_all_rows(dbapi):
+    async def main():
+        async with make_connection().connect() as cnxn:
+            return [row async for row in cnxn.select_data("select", fetch_size=3)]
+
+    rows = asyncio.run(main())
+    assert rows[0] == {"id": 0, "name": "row 0"}
+    assert len(rows) == 7
+    assert dbapi.connections[0].closed
+
+
+def test_select_data_with_auto_fetch_size(dbapi):
+    async def main():
+        async with make_connection().connect() as cnxn:
+            return [row async for row in cnxn.select_data("select", fetch_size="auto")]
+
+    rows = asyncio.run(main())
+    assert len(rows) == 7
+    assert all(isinstance(size, int) for size in dbapi.connections[0].fetch_sizes)
+
+
+def test_calls_run_on_one_thread_outside_the_loop(dbapi):
+    async def main():
+        async with make_connection().connect() as cnxn:
+            await cnxn.execute_sql("update")
+            return [row async for row in cnxn.select_data("select", row_type=tuple)]
+
+    asyncio.run(main())
+    threads = dbapi.connections[0].threads
+    assert len(threads) == 1
+    assert threading.get_ident() not in threads
+
+
+def test_each_connect_opens_its_own_connection(dbapi):
+    template = make_connection(max_connections=2)
+
+    async def query(n):
+        async with template.connect() as cnxn:
+            await cnxn.execute_sql(f"select {n}")
+
+    async def main():
+        await asyncio.gather(*(query(n) for n in range(4)))
+
+    asyncio.run(main())
+    assert len(dbapi.connections) == 4
+    assert all(c.closed for c in dbapi.connections)
+
+
+def test_insert_returns_row_count(dbapi):
+    c1 = Column(name="id", type="int", nullable=False)
+    c2 = Column(name="name", type="varchar", length=10, nullable=True)
+    table = Table(name="target", columns=[c1, c2])
+
+    async def main():
+        async with make_connection().connect() as cnxn:
+            return await cnxn.sql_insert_list(table, [[1, "a"], [2, "b"]])
+
+    assert asyncio.run(main()) == 2
+    assert dbapi.connections[0].inserted == [[1, "a"], [2, "b"]]
+
+
+def test_calls_need_a_connection():
+    with pytest.raises(RuntimeError):
+        asyncio.run(make_connection().execute_sql("select 1"))
@@ -0,0 +1,56 @@
+import datetime
+import decimal
+import pytest
+from etl_db_tools.base import batch
+from etl_db_tools.base.batch import ColumnBatch
+
+
+NAMES = ["id", "amount", "price", "datum", "name"]
+TYPES = [int, float, decimal.Decimal, datetime.date, str]
+ROWS = [
+    (1, 1.5, decimal.Decimal("1.10"), datetime.date(2024, 1, 1), "a"),
+    (2, None, decimal.Decimal("2.20"), None, None),
+]
+
+
+@pytest.fixture(scope="function")
+def without_numpy(monkeypatch):
+    monkeypatch.setattr(batch, "np", None)
+
+
+def test_batch_pivots_rows(without_numpy):
+    b = ColumnBatch.from_rows(NAMES, TYPES, ROWS)
+
+    assert b.num_rows == 2
+    assert list(b) == NAMES
+    assert list(b["id"]) == [1, 2]
+    assert b["name"] == ["a", None]
+    assert b["price"] == [decimal.Decimal("1.10"), decimal.Decimal("2.20")]
+
+
+def test_batch_keeps_numeric_columns_dense(without_numpy):
+    b = ColumnBatch.from_rows(NAMES, TYPES, ROWS)
+
+    assert b["id"].typecode == "q"
+    assert b["amount"].typecode == "d"
+    assert list(b["amount"]) == [1.5, 0.0]
+    assert b.masks["amount"] == [False, True]
+    assert b.masks["id"] is None
+
+
+def test_empty_batch(without_numpy):
+    b = ColumnBatch.from_rows(NAMES, TYPES, [])
+
+    assert b.num_rows == 0
+    assert len(b["id"]) == 0
+
+
+def test_batch_uses_numpy_when_installed():
+    np = pytest.importorskip("numpy")
+    b = ColumnBatch.from_rows(NAMES, TYPES, ROWS)
+
+    assert b["id"].dtype == np.int64
+    assert b["amount"].dtype == np.float64
+    assert b["datum"].dtype == np.dtype("datetime64[D]")
+    assert np.isnat(b["datum"][1])
+    assert b.masks["amount"].tolist() == [False, True]
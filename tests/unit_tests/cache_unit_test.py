@@ -0,0 +1,61 @@
+import pytest
+from etl_db_tools.base.cache import TableCache
+from etl_db_tools.base.schema import BaseTable, Column
+
+
+@pytest.fixture(scope="function")
+def create_table():
+    c = Column(name="tabel_id", type="int", nullable=False)
+    yield BaseTable(name="dbo.myTable", columns=[c])
+
+
+def test_cache_returns_copy(create_table):
+    cache = TableCache()
+    cache.put("db", "dbo.myTable", create_table)
+
+    t = cache.get("db", "dbo.myTable")
+    t.name = "dbo.myTable_temporary"
+
+    assert cache.get("db", "dbo.myTable").name == "dbo.myTable"
+    assert t.column_names() == ["tabel_id"]
+
+
+def test_cache_names_are_case_insensitive(create_table):
+    cache = TableCache()
+    cache.put("db", "dbo.myTable", create_table)
+
+    assert cache.get("db", "[dbo].[MYTABLE]") is not None
+    assert cache.get("other_db", "dbo.myTable") is None
+
+
+def test_cache_entries_expire(create_table):
+    cache = TableCache(ttl=0)
+    cache.put("db", "dbo.myTable", create_table)
+
+    assert cache.get("db", "dbo.myTable") is None
+
+
+def test_cache_evicts_least_recently_used(create_table):
+    cache = TableCache(maxsize=2)
+    cache.put("db", "a", create_table)
+    cache.put("db", "b", create_table)
+    cache.get("db", "a")
+    cache.put("db", "c", create_table)
+
+    assert cache.get("db", "a") is not None
+    assert cache.get("db", "b") is None
+    assert len(cache) == 2
+
+
+def test_cache_invalidate(create_table):
+    cache = TableCache()
+    cache.put("db", "a", create_table)
+    cache.put("db", "b", create_table)
+    cache.put("other_db", "a", create_table)
+
+    cache.invalidate("a", connection_key="db")
+    assert cache.get("db", "a") is None
+    assert cache.get("other_db", "a") is not None
+
+    cache.invalidate()
+    assert len(cache) == 0
@@ -0,0 +1,223 @@
+import csv
+import datetime
+import decimal
+import gzip
+import pytest
+from etl_db_tools.sqlservertools.sqlservertools import (
+    SQLserverconnection,
+    Table,
+    Column,
+)
+from etl_db_tools.filetools.filetools import export_query, load_file
+
+
+class FakeCursor:
+    """Stands in for a pyodbc cursor that returns a fixed result set."""
+
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+
+    def execute(self, query, *params):
+        self.position = 0
+
+    def fetchmany(self, size):
+        batch = self.rows[self.position : self.position + size]
+        self.position += len(batch)
+        return batch
+
+    def executemany(self, sql, params):
+        self.inserted.append((sql, list(params)))
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def commit(self):
+        pass
+
+
+@pytest.fixture(scope="function")
+def create_connection():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    description = [
+        ("id", int, None, 10, 10, 0, False),
+        ("plaatsnaam", str, None, 255, 255, 0, True),
+        ("bedrag", decimal.Decimal, None, 15, 15, 2, True),
+        ("datum", datetime.date, None, 10, 10, 0, True),
+    ]
+    rows = [
+        (i, f"plaats {i}", decimal.Decimal("1.25"), datetime.date(2024, 1, 1))
+        for i in range(2500)
+    ]
+    rows.append((2500, None, None, None))
+    cnxn.cursor = FakeCursor(description, rows)
+    yield cnxn
+
+
+@pytest.fixture(scope="function")
+def create_target():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor([], [])
+    cnxn.cursor.inserted = []
+    t = Table(
+        name="dbo.plaatsen",
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="plaatsnaam", type="nvarchar", nullable=True, length=255),
+            Column(
+                name="bedrag", type="decimal", nullable=True, precission=15, scale=2
+            ),
+            Column(name="datum", type="date", nullable=True),
+        ],
+    )
+    yield cnxn, t
+
+
+def test_export_csv(create_connection, tmp_path):
+    path = str(tmp_path / "plaatsen.csv")
+
+    written = export_query(
+        create_connection, "select * from plaatsen", path, batch_size=1000
+    )
+
+    with open(path, newline="", encoding="utf-8") as f:
+        lines = list(csv.reader(f))
+    assert written == 2501
+    assert lines[0] == ["id", "plaatsnaam", "bedrag", "datum"]
+    assert lines[1] == ["0", "plaats 0", "1.25", "2024-01-01"]
+    assert lines[-1] == ["2500", "", "", ""]
+    assert len(lines) == 2502
+
+
+def test_export_csv_gzip(create_connection, tmp_path):
+    path = str(tmp_path / "plaatsen.csv.gz")
+
+    export_query(create_connection, "select * from plaatsen", path, compression="gzip")
+
+    with gzip.open(path, "rt", newline="", encoding="utf-8") as f:
+        assert len(list(csv.reader(f))) == 2502
+
+
+def test_export_removes_partial_file(create_connection, tmp_path):
+    path = tmp_path / "plaatsen.csv"
+
+    def failing_rows():
+        yield from create_connection.cursor.rows[:10]
+        raise RuntimeError("connection lost")
+
+    create_connection.select_data = lambda *args, **kwargs: failing_rows()
+
+    with pytest.raises(RuntimeError, match="connection lost"):
+        export_query(create_connection, "select * from plaatsen", str(path))
+    assert not path.exists()
+
+
+def test_export_parquet(create_connection, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "plaatsen.parquet")
+
+    written = export_query(
+        create_connection,
+        "select * from plaatsen",
+        path,
+        format="parquet",
+        batch_size=1000,
+        row_group_size=2000,
+    )
+
+    table = pq.read_table(path)
+    assert written == 2501
+    assert table.num_rows == 2501
+    assert pq.ParquetFile(path).metadata.num_row_groups == 2
+    assert table.column("bedrag")[0].as_py() == decimal.Decimal("1.25")
+    assert table.column("plaatsnaam")[2500].as_py() is None
+
+
+def test_export_parquet_writes_full_row_groups(create_connection, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "plaatsen.parquet")
+    create_connection.cursor.rows = create_connection.cursor.rows[:25]
+
+    export_query(
+        create_connection,
+        "select * from plaatsen",
+        path,
+        format="parquet",
+        batch_size=7,
+        row_group_size=10,
+    )
+
+    metadata = pq.ParquetFile(path).metadata
+    groups = [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)]
+    assert groups == [10, 10, 5]
+    assert pq.read_table(path).column("id").to_pylist() == list(range(25))
+
+
+def test_load_csv_converts_to_column_types(create_target, tmp_path):
+    cnxn, t = create_target
+    path = tmp_path / "plaatsen.csv"
+    path.write_text("datum,id,bedrag\n2024-01-01,1,1.25\n,2,\n", encoding="utf-8")
+
+    loaded = load_file(cnxn, str(path), t)
+
+    sql, rows = cnxn.cursor.inserted[0]
+    assert loaded == 2
+    assert sql == "insert into dbo.plaatsen ([datum], [id], [bedrag])\nvalues (?, ?, ?)"
+    assert rows == [
+        [datetime.date(2024, 1, 1), 1, decimal.Decimal("1.25")],
+        [None, 2, None],
+    ]
+
+
+def test_load_csv_in_chunks(create_target, tmp_path):
+    cnxn, t = create_target
+    path = tmp_path / "plaatsen.csv.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for i in range(2500):
+            f.write(f"{i},plaats {i},1.00,2024-01-01\n")
+
+    loaded = load_file(cnxn, str(path), t, header=False, chunk_size=1000)
+
+    assert loaded == 2500
+    assert [len(rows) for _, rows in cnxn.cursor.inserted] == [1000, 1000, 500]
+
+
+def test_load_csv_rejects_unknown_column(create_target, tmp_path):
+    cnxn, t = create_target
+    path = tmp_path / "plaatsen.csv"
+    path.write_text("id,gemeente\n1,Delft\n", encoding="utf-8")
+
+    with pytest.raises(KeyError):
+        load_file(cnxn, str(path), t)
+
+
+def test_export_and_load_parquet(create_connection, create_target, tmp_path):
+    pytest.importorskip("pyarrow")
+    cnxn, t = create_target
+    path = str(tmp_path / "plaatsen.parquet")
+    export_query(create_connection, "select * from plaatsen", path, format="parquet")
+
+    loaded = load_file(cnxn, path, t, format="parquet", chunk_size=1000)
+
+    rows = [row for _, chunk in cnxn.cursor.inserted for row in chunk]
+    assert loaded == 2501
+    assert rows[0] == (
+        0,
+        "plaats 0",
+        decimal.Decimal("1.25"),
+        datetime.date(2024, 1, 1),
+    )
+    assert rows[-1] == (2500, None, None, None)
+
+
+def test_load_csv_raises_parse_error(create_target, tmp_path):
+    cnxn, t = create_target
+    path = tmp_path / "plaatsen.csv"
+    path.write_text("id,plaatsnaam\n1,Delft\ntwee,Gouda\n", encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        load_file(cnxn, str(path), t, chunk_size=1)
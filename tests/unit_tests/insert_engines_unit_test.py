@@ -0,0 +1,398 @@
+from contextlib import contextmanager
+import datetime
+import decimal
+import pytest
+import threading
+from etl_db_tools.sqlservertools import insert_engines, sqlservertools
+from etl_db_tools.sqlservertools.insert_engines import (
+    MAX_PARAMETERS,
+    AutoInsert,
+    FastExecutemany,
+    StreamingFallback,
+    TVPInsert,
+    ValuesInsert,
+    input_size,
+    input_sizes,
+    is_lob,
+    make_engine,
+    row_converter,
+)
+from etl_db_tools.sqlservertools.sqlservertools import (
+    Column,
+    InsertPlan,
+    SQLserverconnection,
+    Table,
+    compare_insert_engines,
+)
+from etl_db_tools.base.stats import Stats
+
+SQL = "insert into dbo.test ([id], [name]) values (?, ?)"
+
+
+def columns(n=2, name_length=50):
+    cols = [Column(name="id", type="int", nullable=False)]
+    for i in range(1, n):
+        cols.append(
+            Column(name=f"c{i}", type="nvarchar", nullable=True, length=name_length)
+        )
+    return cols
+
+
+class FakeCursor:
+    """Records execute and executemany calls."""
+
+    def __init__(self):
+        self.executed = []
+        self.executemany_calls = []
+        self.fast_executemany = False
+        self.commits = 0
+        self.input_sizes = []
+
+    def execute(self, query, *params):
+        self.executed.append((query, params[0] if params else None))
+
+    def executemany(self, query, rows):
+        self.executemany_calls.append((query, list(rows), self.fast_executemany))
+
+    def commit(self):
+        self.commits += 1
+
+    def setinputsizes(self, sizes):
+        self.input_sizes.append(sizes)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def fake_connection(**kwargs):
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="fake", database="test", **kwargs
+    )
+    cnxn.cursor = FakeCursor()
+    cnxn.connection = FakeConnection()
+    return cnxn
+
+
+def test_is_lob():
+    assert is_lob(Column(name="a", type="nvarchar", nullable=True, length=-1))
+    assert is_lob(Column(name="a", type="varbinary", nullable=True, length=None))
+    assert not is_lob(Column(name="a", type="nvarchar", nullable=True, length=50))
+    assert not is_lob(Column(name="a", type="int", nullable=True))
+
+
+def test_fast_executemany_sets_flag():
+    cursor = FakeCursor()
+    FastExecutemany(SQL, columns(), "dbo.test").insert(cursor, [(1, "a"), (2, "b")])
+
+    assert cursor.executemany_calls == [(SQL, [(1, "a"), (2, "b")], True)]
+
+
+def test_values_insert_batches_within_parameter_limit():
+    cols = columns(10)
+    engine = ValuesInsert(SQL, cols, "dbo.test")
+    rows = [tuple(range(10))] * 450
+    cursor = FakeCursor()
+
+    engine.insert(cursor, rows)
+
+    assert engine.batch_rows == MAX_PARAMETERS // 10
+    assert [len(params) for _, params in cursor.executed] == [2090, 2090, 320]
+    assert all(len(params) <= MAX_PARAMETERS for _, params in cursor.executed)
+
+
+def test_values_insert_statement_shape():
+    engine = ValuesInsert(SQL, columns(), "dbo.test")
+    cursor = FakeCursor()
+
+    engine.insert(cursor, [(1, "a"), (2, "b")])
+
+    query, params = cursor.executed[0]
+    assert query == "insert into dbo.test ([id], [name]) values (?, ?), (?, ?)"
+    assert params == [1, "a", 2, "b"]
+
+
+def test_values_insert_caps_rows_per_statement():
+    engine = ValuesInsert(SQL, [Column(name="id", type="int", nullable=False)], "t")
+    assert engine.batch_rows == 1000
+
+
+class FakeClone:
+    """The connection that TVPInsert.prepare opens with clone()."""
+
+    def __init__(self, error=None):
+        self.statements = []
+        self.connects = 0
+        self.error = error
+
+    def clone(self):
+        return self
+
+    @contextmanager
+    def connect(self):
+        self.connects += 1
+        yield self
+
+    def execute_sql(self, query, params=None, commit=True):
+        if self.error is not None:
+            raise self.error
+        assert commit
+        self.statements.append(query)
+
+
+def test_tvp_insert_creates_type_once_on_its_own_connection():
+    engine = TVPInsert(SQL, columns(), "sales.test")
+    cursor = FakeCursor()
+    connection = FakeClone()
+
+    for rows in ([(1, "a")], [(2, "b"), (3, "c")]):
+        engine.prepare(connection)
+        engine.insert(cursor, rows)
+
+    (create,) = connection.statements
+    first, second = cursor.executed
+    assert connection.connects == 1
+    assert engine.type_schema == "sales"
+    assert engine.type_name.startswith("etl_test_")
+    assert f"create type [sales].[{engine.type_name}] as table" in create
+    assert first[0] == "insert into dbo.test ([id], [name]) select * from ?"
+    assert first[1] == [[engine.type_name, "sales", (1, "a")]]
+    assert second[1] == [[engine.type_name, "sales", (2, "b"), (3, "c")]]
+
+
+def test_tvp_type_is_not_marked_created_when_creating_fails():
+    engine = TVPInsert(SQL, columns(), "dbo.test")
+
+    with pytest.raises(RuntimeError):
+        engine.prepare(FakeClone(RuntimeError("permission denied")))
+    engine.prepare(FakeClone())
+
+    assert engine._created
+
+
+def test_tvp_type_is_created_once_by_concurrent_writers():
+    engine = TVPInsert(SQL, columns(), "dbo.test")
+    connection = FakeClone()
+
+    threads = [
+        threading.Thread(target=engine.prepare, args=(connection,)) for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(connection.statements) == 1
+
+
+def test_bound_plans_have_their_own_engines():
+    cnxn = fake_connection(insert_engine="auto")
+    plan = cnxn.insert_plan(Table(name="dbo.test", columns=columns()))
+
+    bound = plan.bind(fake_connection())
+
+    assert bound.engine is not plan.engine
+    assert bound.engine.fast is not plan.engine.fast
+    assert bound.engine.values is not plan.engine.values
+
+
+def test_tvp_type_name_follows_columns():
+    a = TVPInsert(SQL, columns(name_length=50), "test")
+    b = TVPInsert(SQL, columns(name_length=60), "test")
+
+    assert a.type_schema == "dbo"
+    assert a.type_name != b.type_name
+
+
+def test_auto_picks_values_for_small_chunks():
+    engine = AutoInsert(SQL, columns(), "dbo.test")
+
+    assert engine.choose([(1, "a")] * 10).name == "values"
+    assert engine.choose([(1, "a")] * 5000).name == "fast_executemany"
+
+
+def test_auto_picks_values_for_lob_columns():
+    engine = AutoInsert(SQL, columns(name_length=-1), "dbo.test")
+
+    assert engine.choose([(1, "a")] * 5000).name == "values"
+
+
+class FakeSizer:
+    streaming = False
+    row_bytes = 10**6
+
+
+def test_streaming_fallback_switches_to_row_by_row():
+    sizer = FakeSizer()
+    engine = StreamingFallback(FastExecutemany(SQL, columns(), "dbo.test"), sizer)
+    cursor = FakeCursor()
+
+    engine.insert(cursor, [(1, "a")])
+    sizer.streaming = True
+    engine.insert(cursor, [(2, "b")])
+
+    assert engine.choose([]).name == "streaming"
+    assert [fast for _, _, fast in cursor.executemany_calls] == [True, False]
+
+
+def test_make_engine_rejects_unknown_name():
+    with pytest.raises(ValueError):
+        make_engine("bulk", SQL, columns(), "dbo.test")
+
+
+def test_insert_plan_uses_connection_engine():
+    cnxn = fake_connection(insert_engine="values")
+    t = Table(name="dbo.test", columns=columns())
+    stats = Stats()
+
+    n = cnxn.sql_insert_list(t, [(1, "a"), (2, "b")], stats=stats)
+
+    assert n == 2
+    assert cnxn.cursor.executemany_calls == []
+    assert len(cnxn.cursor.executed) == 1
+    assert stats["values insert"].rows == 2
+    assert cnxn.clone().insert_engine == "values"
+
+
+def test_insert_engine_argument_overrides_connection():
+    cnxn = fake_connection(insert_engine="values")
+    t = Table(name="dbo.test", columns=columns())
+
+    cnxn.sql_insert_dictionary(t, [{"id": 1, "c1": "a"}], engine="fast_executemany")
+
+    assert len(cnxn.cursor.executemany_calls) == 1
+
+
+def test_insert_plan_default_engine_is_fast_executemany():
+    cnxn = fake_connection()
+    plan = InsertPlan(cnxn, Table(name="dbo.test", columns=columns()))
+
+    assert isinstance(plan.engine, FastExecutemany)
+
+
+def test_input_size_from_column_definition():
+    pyodbc = sqlservertools.pyodbc
+    nvarchar = Column(name="a", type="nvarchar", nullable=True, length=50)
+    lob = Column(name="a", type="nvarchar", nullable=True, length=-1)
+    amount = Column(name="a", type="decimal", nullable=True, precission=12, scale=3)
+
+    assert input_size(nvarchar) == (pyodbc.SQL_WVARCHAR, 50, 0)
+    assert input_size(lob) == (pyodbc.SQL_WVARCHAR, 0, 0)
+    assert input_size(amount) == (pyodbc.SQL_DECIMAL, 12, 3)
+    assert input_size(Column(name="a", type="xml", nullable=True)) is None
+    assert input_sizes([Column(name="a", type="xml", nullable=True)]) is None
+
+
+def test_fast_executemany_applies_and_resets_input_sizes():
+    sizes = input_sizes(columns())
+    cursor = FakeCursor()
+
+    FastExecutemany(SQL, columns(), "dbo.test", sizes).insert(cursor, [(1, "a")])
+
+    assert cursor.input_sizes == [sizes, None]
+
+
+def test_values_insert_repeats_input_sizes_per_row():
+    sizes = input_sizes(columns())
+    cursor = FakeCursor()
+
+    ValuesInsert(SQL, columns(), "dbo.test", sizes).insert(cursor, [(1, "a")] * 3)
+
+    assert cursor.input_sizes == [sizes * 3, None]
+
+
+def test_row_converter_converts_to_column_types():
+    cols = [
+        Column(name="amount", type="decimal", nullable=True, precission=18, scale=2),
+        Column(name="day", type="date", nullable=True),
+        Column(name="moment", type="datetime2", nullable=True),
+        Column(name="flag", type="bit", nullable=True),
+        Column(name="name", type="nvarchar", nullable=True, length=10),
+    ]
+    convert = row_converter(cols)
+
+    row = convert(
+        (0.1, datetime.datetime(2024, 1, 2, 3, 4), datetime.date(2024, 1, 2), 1, "x")
+    )
+
+    assert row == [
+        decimal.Decimal("0.1"),
+        datetime.date(2024, 1, 2),
+        datetime.datetime(2024, 1, 2),
+        True,
+        "x",
+    ]
+
+
+def test_row_converter_keeps_rows_of_the_right_types():
+    convert = row_converter(
+        [Column(name="amount", type="float", nullable=True), columns()[0]]
+    )
+    row = (1.5, 1)
+
+    assert convert(row) is row
+    assert convert((None, 1)) == (None, 1)
+    assert row_converter(columns()) is None
+
+
+def test_insert_plan_sizes_and_converts_once():
+    cnxn = fake_connection()
+    t = Table(
+        name="dbo.test",
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="amount", type="decimal", nullable=True, precission=9, scale=2),
+        ],
+    )
+    plan = cnxn.insert_plan(t, mapping=False)
+
+    plan.write([(1, 2.5)])
+    plan.write([(2, decimal.Decimal("3.5"))])
+
+    pyodbc = sqlservertools.pyodbc
+    sizes = [(pyodbc.SQL_INTEGER, 0, 0), (pyodbc.SQL_DECIMAL, 9, 2)]
+    assert plan.engine.input_sizes == sizes
+    assert cnxn.cursor.input_sizes == [sizes, None, sizes, None]
+    assert [rows for _, rows, _ in cnxn.cursor.executemany_calls] == [
+        [[1, decimal.Decimal("2.5")]],
+        [(2, decimal.Decimal("3.5"))],
+    ]
+
+
+def test_compare_insert_engines_rolls_back_and_ranks(monkeypatch):
+    cnxn = fake_connection()
+    t = Table(name="dbo.test", columns=columns())
+    timings = iter([0.0, 2.0, 10.0, 11.0])
+    monkeypatch.setattr(sqlservertools.time, "perf_counter", lambda: next(timings))
+
+    results = compare_insert_engines(
+        cnxn, t, [(1, "a")] * 4, engines=["fast_executemany", "values"], repeat=1
+    )
+
+    assert [r["engine"] for r in results] == ["values", "fast_executemany"]
+    assert results[0]["rows_per_second"] == 4.0
+    assert cnxn.connection.rollbacks == 2
+    assert cnxn.cursor.commits == 0
+
+
+def test_compare_insert_engines_records_failures():
+    cnxn = fake_connection()
+    t = Table(name="dbo.test", columns=columns())
+
+    def fail(query, *params):
+        raise sqlservertools.pyodbc.Error("permission denied")
+
+    cnxn.cursor.execute = fail
+    cnxn.clone = lambda: FakeClone(sqlservertools.pyodbc.Error("permission denied"))
+
+    results = compare_insert_engines(
+        cnxn, t, [(1, "a")], engines=["tvp", "fast_executemany"], repeat=1
+    )
+
+    assert results[0]["engine"] == "fast_executemany"
+    assert results[1]["error"] == "permission denied"
+    assert cnxn.connection.rollbacks == 2
@@ -0,0 +1,147 @@
+import pytest
+import threading
+from etl_db_tools.sqlservertools.sqlservertools import SQLserverconnection
+from etl_db_tools.sqlservertools.pool import ConnectionPool, get_pool, close_pools
+
+
+class FakeError(Exception):
+    pass
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query):
+        if self.connection.broken:
+            raise FakeError("connection is broken")
+        return self
+
+    def fetchone(self):
+        return (1,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, connection_string):
+        self.connection_string = connection_string
+        self.broken = False
+        self.closed = False
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+class FakeDbapi:
+    """Stands in for the pyodbc module."""
+
+    Error = FakeError
+
+    def __init__(self):
+        self.opened = []
+
+    def connect(self, connection_string):
+        c = FakeConnection(connection_string)
+        self.opened.append(c)
+        return c
+
+
+@pytest.fixture(scope="function")
+def create_connection():
+    yield SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+
+
+def test_pool_reuses_connection(create_connection):
+    dbapi = FakeDbapi()
+    pool = ConnectionPool(create_connection, dbapi=dbapi)
+
+    with pool.connect() as cnxn:
+        first = cnxn.connection
+    with pool.connect() as cnxn:
+        second = cnxn.connection
+
+    assert first is second
+    assert len(dbapi.opened) == 1
+    assert first.connection_string == create_connection.to_string()
+    assert first.rollbacks == 2
+    assert cnxn.connection is None
+
+
+def test_pool_replaces_broken_connection(create_connection):
+    dbapi = FakeDbapi()
+    pool = ConnectionPool(create_connection, dbapi=dbapi)
+
+    with pool.connect() as cnxn:
+        cnxn.connection.broken = True
+    with pool.connect() as cnxn:
+        assert not cnxn.connection.broken
+
+    assert len(dbapi.opened) == 2
+    assert dbapi.opened[0].closed
+    assert pool.size == 1
+
+
+def test_pool_closes_idle_connections(create_connection):
+    dbapi = FakeDbapi()
+    pool = ConnectionPool(create_connection, idle_timeout=0, dbapi=dbapi)
+
+    with pool.connect():
+        pass
+    with pool.connect():
+        pass
+
+    assert len(dbapi.opened) == 2
+    assert dbapi.opened[0].closed
+
+
+def test_pool_is_bounded(create_connection):
+    dbapi = FakeDbapi()
+    pool = ConnectionPool(
+        create_connection, max_size=1, checkout_timeout=0.05, dbapi=dbapi
+    )
+
+    with pool.connect():
+        with pytest.raises(TimeoutError):
+            with pool.connect():
+                pass
+
+
+def test_pool_hands_connection_to_waiting_thread(create_connection):
+    dbapi = FakeDbapi()
+    pool = ConnectionPool(create_connection, max_size=2, dbapi=dbapi)
+    used = []
+
+    def work():
+        for _ in range(20):
+            with pool.connect() as cnxn:
+                used.append(cnxn.connection)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(used) == 80
+    assert len(dbapi.opened) <= 2
+
+
+def test_get_pool_is_keyed_by_connection_string(create_connection):
+    try:
+        pool = get_pool(create_connection, dbapi=FakeDbapi())
+        same = get_pool(create_connection.clone())
+
+        assert pool is same
+    finally:
+        close_pools()
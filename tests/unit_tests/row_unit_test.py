@@ -0,0 +1,47 @@
+import pytest
+from etl_db_tools.base.row import Row
+
+
+@pytest.fixture(scope="function")
+def create_row():
+    index = Row.index(["plaats_id", "plaatsnaam", "provincie"])
+    yield Row((1, "Amsterdam", "Noord-Holland"), index)
+
+
+def test_row_lookup_by_name(create_row):
+    row = create_row
+
+    assert row["plaatsnaam"] == "Amsterdam"
+    assert row.get("provincie") == "Noord-Holland"
+
+
+def test_row_get_missing_returns_default(create_row):
+    row = create_row
+
+    assert row.get("gemeente") is None
+    assert row.get("gemeente", "onbekend") == "onbekend"
+    with pytest.raises(KeyError):
+        row["gemeente"]
+
+
+def test_row_behaves_like_dict(create_row):
+    row = create_row
+
+    assert list(row.keys()) == ["plaats_id", "plaatsnaam", "provincie"]
+    assert list(row.values()) == [1, "Amsterdam", "Noord-Holland"]
+    assert "plaats_id" in row
+    assert len(row) == 3
+    assert row == {"plaats_id": 1, "plaatsnaam": "Amsterdam", "provincie": "Noord-Holland"}
+    assert dict(row) == {
+        "plaats_id": 1,
+        "plaatsnaam": "Amsterdam",
+        "provincie": "Noord-Holland",
+    }
+
+
+def test_row_has_no_instance_dict(create_row):
+    row = create_row
+
+    assert not hasattr(row, "__dict__")
+    with pytest.raises(AttributeError):
+        row.extra = 1
@@ -276,3 +276,22 @@ def test_can_remove_column_from_table():
 
     assert len(t.columns) == 1
     assert t.column_names() == ["tabel_id"]
+
+
+# Binary
+def test_varbinary_with_length_to_sql():
+    c = Column(name="Bytes", type="varbinary", nullable=True, length=16)
+
+    assert c.to_sql() == "Bytes varbinary(16)"
+
+
+def test_varbinary_should_be_max_to_sql():
+    c = Column(name="Bytes", type="varbinary", nullable=True, length=-1)
+
+    assert c.to_sql() == "Bytes varbinary(max)"
+
+
+def test_rowversion_becomes_binary_to_sql():
+    c = Column(name="versie", type="timestamp", nullable=False, length=8)
+
+    assert c.to_sql() == "versie binary(8) not null"
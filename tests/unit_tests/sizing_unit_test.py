@@ -0,0 +1,108 @@
+from etl_db_tools.base.schema import Column, BaseTable
+from etl_db_tools.base.sizing import (
+    LOB_BYTES,
+    AdaptiveBatchSize,
+    TableBatchSize,
+    column_bytes,
+    description_bytes,
+    is_lob,
+)
+from etl_db_tools.base import insert_engines
+
+
+def test_column_bytes_from_length():
+    assert (
+        column_bytes(Column(name="a", type="nvarchar", nullable=True, length=10)) == 20
+    )
+    assert (
+        column_bytes(Column(name="a", type="varchar", nullable=True, length=10)) == 10
+    )
+    assert column_bytes(Column(name="a", type="int", nullable=True)) == 4
+
+
+def test_column_bytes_max_is_lob():
+    c = Column(name="a", type="nvarchar", nullable=True, length=-1)
+    assert column_bytes(c) == LOB_BYTES
+
+
+def test_is_lob_by_type_and_length():
+    def column(type, length=None):
+        return Column(name="a", type=type, nullable=True, length=length)
+
+    assert is_lob(column("nvarchar", 4001))
+    assert not is_lob(column("nvarchar", 4000))
+    assert not is_lob(column("varbinary", 8000))
+    assert is_lob(column("varchar", None))
+    assert is_lob(column("ntext"))
+    assert is_lob(column("xml"))
+    # the engines and the chunk sizer agree on the lob columns
+    assert insert_engines.is_lob is is_lob
+
+
+def test_description_bytes_prefers_table_definition():
+    description = [
+        ("id", int, None, 10, 10, 0, False),
+        ("tekst", str, None, 0, 0, 0, True),
+    ]
+    t = BaseTable(
+        name="t",
+        columns=[Column(name="tekst", type="nvarchar", nullable=True, length=50)],
+    )
+
+    assert description_bytes(description) == 8 + LOB_BYTES
+    assert description_bytes(description, t) == 8 + 100
+
+
+def test_adaptive_batch_size_follows_observed_rows():
+    sizer = AdaptiveBatchSize(row_bytes=1000, target_bytes=100_000)
+    assert sizer.size == 100
+
+    sizer.observe([("x" * 50,)] * 10)
+    assert sizer.size == 1000
+
+
+def test_adaptive_batch_size_is_bounded():
+    sizer = AdaptiveBatchSize(row_bytes=1, target_bytes=10**9, maximum=5000)
+    assert sizer.size == 5000
+
+    sizer = AdaptiveBatchSize(row_bytes=10**9, target_bytes=1, minimum=10)
+    assert sizer.size == 10
+
+
+def test_table_batch_size_counts_declared_lengths():
+    t = BaseTable(
+        name="t",
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="name", type="nvarchar", nullable=True, length=98),
+        ],
+    )
+    sizer = TableBatchSize(t, target_bytes=2000)
+    assert sizer.size == 10
+
+    # the driver buffers the full length, whatever the values
+    sizer.observe([(1, "x")] * 10)
+    assert sizer.size == 10
+    assert not sizer.streaming
+
+
+def test_table_batch_size_measures_lob_columns():
+    t = BaseTable(
+        name="t",
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="note", type="nvarchar", nullable=True, length=-1),
+        ],
+    )
+    sizer = TableBatchSize(t, target_bytes=10**9, probe=50)
+    assert sizer.size == 50
+
+    sizer.observe([(1, "x" * 998)] * 10)
+    assert sizer.row_bytes == 4 + 1996
+    assert sizer.size == 100_000
+    assert not sizer.streaming
+
+    sizer = TableBatchSize(t, target_bytes=100_000)
+    sizer.observe([(1, "x" * 998)] * 10)
+    assert sizer.size == 50
+    assert sizer.streaming
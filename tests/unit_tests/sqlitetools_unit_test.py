@@ -0,0 +1,511 @@
+import datetime
+import decimal
+import pytest
+import sqlite3
+from etl_db_tools.sqlitetools.sqlitetools import Column, SQLiteconnection, Table
+from etl_db_tools.sqlservertools import sqlservertools
+from etl_db_tools.sqlservertools.sqlservertools import (
+    TableCheckpoint,
+    copy_table,
+    copy_table_incremental,
+)
+
+
+def make_table(name="orders"):
+    return Table(
+        name,
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="name", type="nvarchar", nullable=True, length=50),
+            Column(name="note", type="nvarchar", nullable=True, length=-1),
+            Column(
+                name="amount", type="decimal", nullable=True, precission=18, scale=2
+            ),
+            Column(name="created", type="datetime2", nullable=True),
+            Column(name="day", type="date", nullable=True),
+            Column(name="flag", type="bit", nullable=True, default=0),
+        ],
+    )
+
+
+ROWS = [
+    [
+        1,
+        "one",
+        "x" * 5000,
+        decimal.Decimal("1.25"),
+        datetime.datetime(2024, 1, 2, 3, 4, 5),
+        datetime.date(2024, 1, 2),
+        True,
+    ],
+    [2, "two", None, None, None, None, False],
+]
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "staging.db")
+
+
+def test_create_insert_and_select_keep_types(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        assert cnxn.sql_insert_list("orders", ROWS) == 2
+
+        rows = list(
+            cnxn.select_data(
+                "select * from orders order by id", row_type=tuple, table=make_table()
+            )
+        )
+
+    assert [list(r) for r in rows] == ROWS
+    assert [type(v) for v in rows[0]] == [type(v) for v in ROWS[0]]
+
+
+def test_select_data_returns_stored_values_without_table(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        cnxn.sql_insert_list("orders", ROWS[:1])
+
+        row = list(cnxn.select_data("select amount, created, day, flag from orders"))
+
+    assert row == [
+        {
+            "amount": 1.25,
+            "created": "2024-01-02 03:04:05",
+            "day": "2024-01-02",
+            "flag": 1,
+        }
+    ]
+
+
+def test_sqlite3_adapters_are_left_alone():
+    # the conversions are per connection, other sqlite3 users aren't affected
+    assert (decimal.Decimal, sqlite3.PrepareProtocol) not in sqlite3.adapters
+    assert not {"DECIMAL", "BIT", "DATETIME2"} & set(sqlite3.converters)
+
+
+@pytest.mark.parametrize("engine", ["values", "auto"])
+def test_insert_engines(database, engine):
+    rows = [[i, f"row {i}", None, None, None, None, True] for i in range(700)]
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        assert cnxn.sql_insert_list("orders", rows, engine=engine) == 700
+
+        count = list(cnxn.select_data("select count(*) as n from orders"))
+
+    assert count == [{"n": 700}]
+
+
+def test_failed_insert_rolls_back_uncommitted_chunks(database):
+    rows = [[i, None, None, None, None, None, True] for i in range(15)]
+    rows.append([15, None])
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        with pytest.raises(ValueError):
+            cnxn.sql_insert_list("orders", rows, chunk_size=10)
+        cnxn.execute_sql("create table other (a int)")
+
+        count = list(cnxn.select_data("select count(*) as n from orders"))
+
+    assert count == [{"n": 0}]
+
+
+def test_insert_dictionary_fills_missing_columns_with_defaults(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        cnxn.sql_insert_dictionary("orders", [{"id": 1, "name": "one"}])
+
+        rows = list(cnxn.select_data("select id, name, flag from orders"))
+
+    assert rows == [{"id": 1, "name": "one", "flag": False}]
+
+
+def test_table_definition_round_trips(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        table = cnxn.table_definition("orders")
+
+    assert [
+        (c.name, c.type, c.length, c.precission, c.scale, c.nullable)
+        for c in table.columns
+    ] == [
+        ("id", "int", None, None, None, False),
+        ("name", "nvarchar", 50, None, None, True),
+        ("note", "nvarchar", -1, None, None, True),
+        ("amount", "decimal", None, 18, 2, True),
+        ("created", "datetime2", None, None, None, True),
+        ("day", "date", None, None, None, True),
+        ("flag", "bit", None, None, None, True),
+    ]
+    assert table.columns[-1].default == "0"
+
+
+def test_native_types_read_as_sql_server_types(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.execute_sql("create table native (a integer, b text, c real, d blob)")
+        table = cnxn.table_definition("native")
+
+    assert [(c.type, c.length) for c in table.columns] == [
+        ("bigint", None),
+        ("nvarchar", -1),
+        ("float", None),
+        ("varbinary", -1),
+    ]
+
+
+def test_create_table_from_sql_server_definition(database):
+    t = sqlservertools.Table(
+        "dbo.orders",
+        columns=[
+            sqlservertools.Column(name="id", type="int", nullable=False),
+            sqlservertools.Column(
+                name="name", type="nvarchar", nullable=True, length=-1
+            ),
+        ],
+    )
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(t, drop_if_exists=False)
+
+        assert cnxn.if_exists("dbo.orders")
+        assert cnxn.list_tables() == ["dbo.orders"]
+        assert cnxn.quote_table_name("dbo.orders") == '"dbo.orders"'
+        assert cnxn.quote_table_name("main.orders") == '"main"."orders"'
+
+
+def test_unknown_type_is_rejected():
+    with pytest.raises(ValueError):
+        Column(name="x", type="geography", nullable=True).to_sql()
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"pipeline": True, "writers": 2},
+        {"partition_column": "id", "parallel": 3},
+    ],
+)
+def test_copy_table_between_sqlite_databases(tmp_path, options):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    rows = [
+        [i, f"name {i}", None, decimal.Decimal(i) / 4, None, None, i % 2 == 0]
+        for i in range(2500)
+    ]
+    with source.connect() as s:
+        s.create_table(make_table("dbo.orders"), drop_if_exists=True)
+        s.sql_insert_list("dbo.orders", rows)
+
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(s, "dbo.orders", t, into="orders_copy", **options)
+
+        assert stats["copy"].rows == 2500
+        assert not t.if_exists("orders_copy_temporary")
+        copied = list(
+            t.select_data(
+                "select * from orders_copy order by id",
+                row_type=tuple,
+                table=make_table(),
+            )
+        )
+
+    assert [list(r) for r in copied] == rows
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"pipeline": True, "writers": 2},
+        {"partition_column": "id", "parallel": 3},
+        {"partition_column": "id", "parallel": 3, "partition_method": "range"},
+    ],
+)
+def test_copy_table_copies_selected_columns_and_rows(tmp_path, options):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    rows = [[i, f"name {i}", None, None, None, None, i % 2 == 0] for i in range(100)]
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", rows)
+
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(
+            s,
+            "orders",
+            t,
+            columns=["name", "id"],
+            where="flag = ? and id < ?",
+            params=[True, 50],
+            **options,
+        )
+        definition = t.table_definition("orders")
+        copied = list(t.select_data("select * from orders order by id", tuple))
+
+    assert stats["copy"].rows == 25
+    assert definition.column_names() == ["name", "id"]
+    assert copied == [(f"name {i}", i) for i in range(0, 50, 2)]
+
+
+def test_copy_table_rejects_unknown_columns(tmp_path):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    with source.connect() as s, target.connect() as t:
+        s.create_table(make_table(), drop_if_exists=True)
+        with pytest.raises(KeyError):
+            copy_table(s, "orders", t, columns=["id", "colour"])
+
+
+@pytest.mark.parametrize("checkpoint", [None, TableCheckpoint("etl_cp")])
+def test_copy_table_with_table_checkpoint(tmp_path, checkpoint):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    rows = [[i, f"name {i}", None, None, None, None, True] for i in range(250)]
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", rows)
+
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(
+            s,
+            "orders",
+            t,
+            checkpoint_column="id",
+            checkpoint=checkpoint,
+            chunk_length=100,
+        )
+        name = t.quote_table_name((checkpoint or TableCheckpoint()).table_name)
+        saved = list(t.select_data(f"select * from {name}"))
+
+    assert stats["copy"].rows == 250
+    assert saved == []
+
+
+def test_copy_table_resumes_from_table_checkpoint(tmp_path, monkeypatch):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    rows = [[i, f"name {i}", None, None, None, None, True] for i in range(250)]
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", rows)
+
+    chunks = sqlservertools._chunks
+
+    def fail_after_first_chunk(rows, chunk_length):
+        iterator = chunks(rows, chunk_length)
+        yield next(iterator)
+        raise RuntimeError("connection lost")
+
+    with source.connect() as s, target.connect() as t:
+        monkeypatch.setattr(sqlservertools, "_chunks", fail_after_first_chunk)
+        with pytest.raises(RuntimeError):
+            copy_table(
+                s,
+                "orders",
+                t,
+                checkpoint_column="id",
+                commit_every=None,
+                chunk_length=100,
+            )
+        state = TableCheckpoint().load(t, "orders")
+
+        monkeypatch.setattr(sqlservertools, "_chunks", chunks)
+        stats = copy_table(s, "orders", t, checkpoint_column="id", chunk_length=100)
+        copied = list(t.select_data("select id from orders order by id", tuple))
+
+    assert state == {"last_key": "99", "chunk": 1, "rows": 100}
+    assert stats["copy"].rows == 250
+    assert copied == [(i,) for i in range(250)]
+
+
+def test_copy_table_streams_large_rows(tmp_path):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    rows = [[i, None, "x" * 5000, None, None, None, True] for i in range(300)]
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", rows)
+
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(s, "orders", t, memory_budget=500_000)
+        count = list(t.select_data("select count(*) as n from orders"))
+
+    assert count == [{"n": 300}]
+    # about 49 rows fit in the budget, too few to buffer: sent row by row
+    assert "executemany" not in stats
+    assert stats["streaming insert"].rows == 300
+
+
+def test_copy_table_sizes_chunks_within_memory_budget(tmp_path):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    rows = [[i, None, "x" * 100, None, None, None, True] for i in range(1000)]
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", rows)
+
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(s, "orders", t, memory_budget=200_000)
+
+    # a probe of 100 rows, then 200_000 // (133 + 200) = 600 rows per chunk
+    assert stats["executemany"].rows == 1000
+    assert stats["executemany"].calls == 3
+
+
+def test_replace_table_swaps_tables(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.execute_sql("create table target (a int)")
+        cnxn.execute_sql("create table target_temporary (b int)")
+
+        cnxn.replace_table("target_temporary", "target")
+
+        assert cnxn.list_tables() == ["target"]
+        assert cnxn.table_definition("target").column_names() == ["b"]
+
+
+def test_transaction_rolls_back_table_changes(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        with pytest.raises(RuntimeError):
+            with cnxn.transaction():
+                cnxn.create_table(make_table(), drop_if_exists=True)
+                cnxn.sql_insert_list("orders", ROWS)
+                raise RuntimeError("copy failed")
+
+        assert not cnxn.if_exists("orders")
+
+
+def test_copy_table_in_a_single_transaction(tmp_path):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", ROWS)
+
+    with source.connect() as s, target.connect() as t:
+        stats = copy_table(s, "orders", t, single_transaction=True)
+
+        assert stats["copy"].rows == 2
+        assert t.list_tables() == ["orders"]
+
+
+def test_copy_table_incremental_copies_rows_above_the_watermark(tmp_path):
+    source = SQLiteconnection(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    with source.connect() as s:
+        s.create_table(make_table(), drop_if_exists=True)
+        s.sql_insert_list("orders", ROWS)
+
+    with source.connect() as s, target.connect() as t:
+        assert copy_table_incremental(s, "orders", t, "id", state_table="state") == 2
+        s.sql_insert_list("orders", [[3, "three", None, None, None, None, True]])
+        assert copy_table_incremental(s, "orders", t, "id", state_table="state") == 1
+        assert copy_table_incremental(s, "orders", t, "id", state_table="state") == 0
+
+        ids = [r[0] for r in t.select_data("select id from orders", row_type=tuple)]
+        state = list(t.select_data("select watermark_value from state"))
+
+    assert sorted(ids) == [1, 2, 3]
+    assert state == [{"watermark_value": "3"}]
+
+
+class RowversionSource(SQLiteconnection):
+    """SQLite source whose version column is a rowversion, with a fixed
+    min_active_rowversion()."""
+
+    bound = None
+
+    def table_definition(self, table_name):
+        table = super().table_definition(table_name)
+        for column in table.columns:
+            if column.name == "version":
+                column.type = "timestamp"
+        return table
+
+    def select_data(self, query, *args, **kwargs):
+        if "min_active_rowversion()" in query:
+            return iter([{"bound": self.bound}])
+        return super().select_data(query, *args, **kwargs)
+
+
+def test_copy_table_incremental_stops_at_the_lowest_active_rowversion(tmp_path):
+    source = RowversionSource(str(tmp_path / "source.db"))
+    target = SQLiteconnection(str(tmp_path / "target.db"))
+    table = Table(
+        "items",
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="version", type="binary", nullable=False, length=8),
+        ],
+    )
+    version = [v.to_bytes(8, "big") for v in range(6)]
+    with source.connect() as s:
+        s.create_table(table, drop_if_exists=True)
+        # rows 1 and 2 are committed, version 3 is still being written
+        s.sql_insert_list("items", [[1, version[1]], [2, version[2]]])
+
+    with source.connect() as s, target.connect() as t:
+        s.bound = version[3]
+        assert (
+            copy_table_incremental(s, "items", t, "version", state_table="state") == 2
+        )
+        state = list(t.select_data("select watermark_value from state"))
+        assert state == [{"watermark_value": version[3].hex()}]
+
+        # version 3 commits after the first copy, next to a newer row
+        s.sql_insert_list("items", [[3, version[3]], [4, version[4]]])
+        s.bound = version[5]
+        assert (
+            copy_table_incremental(s, "items", t, "version", state_table="state") == 2
+        )
+
+        ids = [r[0] for r in t.select_data("select id from items", row_type=tuple)]
+
+    assert sorted(ids) == [1, 2, 3, 4]
+
+
+def test_upsert_updates_existing_keys_and_inserts_new_ones(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        cnxn.sql_insert_list("orders", ROWS)
+
+        counts = cnxn.upsert(
+            "orders",
+            [
+                {"id": 2, "name": "second", "amount": decimal.Decimal("2.50")},
+                {"id": 3, "name": "three", "amount": decimal.Decimal("3.75")},
+            ],
+            key_columns=["id"],
+        )
+        rows = list(
+            cnxn.select_data(
+                "select id, name, amount, flag from orders order by id",
+                table=make_table(),
+            )
+        )
+        tables = cnxn.list_tables("temp")
+
+    assert counts == {"inserted": 1, "updated": 1}
+    assert rows == [
+        {"id": 1, "name": "one", "amount": decimal.Decimal("1.25"), "flag": True},
+        {"id": 2, "name": "second", "amount": decimal.Decimal("2.50"), "flag": False},
+        {"id": 3, "name": "three", "amount": decimal.Decimal("3.75"), "flag": False},
+    ]
+    assert tables == []
+
+
+def test_upsert_keeps_the_column_order_of_list_rows(database):
+    with SQLiteconnection(database).connect() as cnxn:
+        cnxn.create_table(make_table(), drop_if_exists=True)
+        cnxn.sql_insert_list("orders", ROWS)
+
+        counts = cnxn.upsert(
+            "orders",
+            [["uno", 1], ["tres", 3]],
+            key_columns=["id"],
+            columns=["name", "id"],
+        )
+        rows = list(cnxn.select_data("select id, name from orders order by id", tuple))
+
+    assert counts == {"inserted": 1, "updated": 1}
+    assert rows == [(1, "uno"), (2, "two"), (3, "tres")]
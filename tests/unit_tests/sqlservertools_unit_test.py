@@ -1,8 +1,26 @@
 import pytest
+import datetime
+import decimal
+import threading
+from contextlib import contextmanager
+from etl_db_tools.base.stats import Stats
+from etl_db_tools.sqlservertools import sqlservertools
 from etl_db_tools.sqlservertools.sqlservertools import (
     SQLserverconnection,
     Table,
     Column,
+    FileCheckpoint,
+    InsertPlan,
+    Row,
+    copy_schema,
+    copy_table,
+    _partition_bounds,
+    _partition_filters,
+    _pipelined_insert,
+    _range_bounds,
+    _resumable_insert,
+    _value_from_text,
+    _value_to_text,
 )
 
 
@@ -58,3 +76,843 @@ def test_insert_dictionary_checks_columns():
 
     with pytest.raises(KeyError):
         cnxn.sql_insert_dictionary(table=t, data=data)
+
+
+class FakeCursor:
+    """Stands in for a pyodbc cursor, records every executemany call."""
+
+    def __init__(self, fail_after=None, shared=None):
+        self.fail_after = fail_after
+        self.inserted = shared if shared is not None else []
+        self.commits = 0
+
+    def executemany(self, sql, params):
+        if self.fail_after is not None and len(self.inserted) >= self.fail_after:
+            raise RuntimeError("insert failed")
+        self.sql = sql
+        self.inserted.append(list(params))
+
+    def commit(self):
+        self.commits += 1
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def execute(self, query, *params):
+        pass
+
+
+class FakeRollbackConnection:
+    def __init__(self):
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakeSelectCursor:
+    """Stands in for a pyodbc cursor that returns a fixed result set."""
+
+    def __init__(self, columns, rows):
+        self.description = [(c, None, None, None, None, None, True) for c in columns]
+        self.rows = list(rows)
+        self.fetch_sizes = []
+
+    def execute(self, query, *params):
+        self.position = 0
+
+    def fetchmany(self, size):
+        self.fetch_sizes.append(size)
+        batch = self.rows[self.position : self.position + size]
+        self.position += len(batch)
+        return batch
+
+
+class FakeTarget:
+    """Stands in for a connected target connection."""
+
+    def __init__(self, fail_after=None, shared=None):
+        self.cursor = FakeCursor(fail_after=fail_after, shared=shared)
+        self.rollbacks = 0
+        self.clones = []
+
+    def clone(self):
+        clone = FakeTarget(
+            fail_after=self.cursor.fail_after, shared=self.cursor.inserted
+        )
+        self.clones.append(clone)
+        return clone
+
+    @contextmanager
+    def connect(self):
+        yield self
+
+    def commit(self):
+        self.cursor.commit()
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def test_pipelined_insert_writes_all_rows():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    target = FakeTarget()
+    rows = ({"id": i} for i in range(2500))
+    plan = InsertPlan(target, t)
+
+    written = _pipelined_insert(
+        rows, plan, target, chunk_length=1000, queue_depth=2, writers=3
+    )
+
+    assert written == 2500
+    inserted = target.cursor.inserted
+    assert sorted(len(c) for c in inserted) == [500, 1000, 1000]
+    assert sorted(r[0] for c in inserted for r in c) == list(range(2500))
+
+
+def test_pipelined_insert_raises_writer_error():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    target = FakeTarget(fail_after=1)
+    rows = ({"id": i} for i in range(10000))
+    plan = InsertPlan(target, t)
+
+    with pytest.raises(RuntimeError, match="insert failed"):
+        _pipelined_insert(rows, plan, target, chunk_length=10, queue_depth=1, writers=2)
+
+
+def test_failed_pipelined_insert_rolls_back_every_writer():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    target = FakeTarget(fail_after=5)
+    rows = ({"id": i} for i in range(10000))
+    plan = InsertPlan(target, t)
+
+    with pytest.raises(RuntimeError, match="insert failed"):
+        _pipelined_insert(
+            rows,
+            plan,
+            target,
+            chunk_length=10,
+            queue_depth=1,
+            writers=3,
+            commit_every=None,
+        )
+
+    writers = [target] + target.clones
+    assert len(writers) == 3
+    assert all(w.rollbacks == 1 for w in writers)
+    assert all(w.cursor.commits == 0 for w in writers)
+
+
+def test_pipelined_insert_raises_reader_error():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+
+    def rows():
+        yield {"id": 1}
+        raise ValueError("source failed")
+
+    target = FakeTarget()
+    plan = InsertPlan(target, t)
+
+    with pytest.raises(ValueError, match="source failed"):
+        _pipelined_insert(
+            rows(), plan, target, chunk_length=10, queue_depth=1, writers=1
+        )
+
+
+def test_clone_keeps_settings():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS",
+        server="SQLMACHINE_01",
+        database="Databasename",
+        rando="nobody",
+    )
+
+    clone = cnxn.clone()
+
+    assert clone is not cnxn
+    assert clone.to_string() == cnxn.to_string()
+
+
+def test_insert_plan_renders_columns_in_given_order():
+    c1 = Column(name="id", type="int", nullable=False)
+    c2 = Column(name="place", type="nvarchar", nullable=False, length=255)
+    t = Table(name="test", columns=[c1, c2])
+
+    plan = InsertPlan(FakeTarget(), t, columns=["place", "id"])
+
+    assert plan.sql == "insert into test ([place], [id])\nvalues (?, ?)"
+    assert t.column_names() == ["id", "place"]
+
+
+def test_insert_plan_extracts_rows_from_dicts():
+    c1 = Column(name="id", type="int", nullable=False)
+    c2 = Column(name="place", type="nvarchar", nullable=False, length=255)
+    t = Table(name="test", columns=[c1, c2])
+    target = FakeTarget()
+    plan = InsertPlan(target, t)
+
+    plan.write([{"place": "Delft", "id": 1}, {"id": 2}])
+
+    assert target.cursor.inserted == [[[1, "Delft"], [2, None]]]
+    assert target.cursor.commits == 1
+
+
+def test_insert_plan_checks_row_length():
+    c1 = Column(name="id", type="int", nullable=False)
+    c2 = Column(name="place", type="nvarchar", nullable=False, length=255)
+    t = Table(name="test", columns=[c1, c2])
+    plan = InsertPlan(FakeTarget(), t, mapping=False)
+
+    with pytest.raises(ValueError, match="expected a row with 2 values, got 1"):
+        plan.write([[1, "Delft"], [2]])
+
+
+def test_insert_plan_rejects_unknown_column():
+    c1 = Column(name="id", type="int", nullable=False)
+    t = Table(name="test", columns=[c1])
+
+    with pytest.raises(KeyError):
+        InsertPlan(FakeTarget(), t, columns=["id", "placemat"])
+
+
+@pytest.mark.parametrize("row_type", [dict, Row])
+def test_select_data_rows_have_dict_interface(row_type):
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(["id", "place"], [(1, "Delft"), (2, "Gouda")])
+
+    rows = list(cnxn.select_data("select id, place from test", row_type=row_type))
+
+    assert [type(r) for r in rows] == [row_type, row_type]
+    assert rows[1]["place"] == "Gouda"
+    assert rows[0].get("id") == 1
+
+
+def test_select_data_as_tuples():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(["id", "place"], [(1, "Delft"), (2, "Gouda")])
+
+    rows = list(cnxn.select_data("select id, place from test", row_type=tuple))
+
+    assert rows == [(1, "Delft"), (2, "Gouda")]
+
+
+def test_select_data_rejects_unknown_row_type():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(["id"], [(1,)])
+
+    with pytest.raises(ValueError, match="row_type must be"):
+        list(cnxn.select_data("select id from test", row_type=list))
+
+
+def test_select_data_uses_fetch_size():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(["id"], [(i,) for i in range(25)])
+
+    rows = list(cnxn.select_data("select id from test", fetch_size=10))
+
+    assert len(rows) == 25
+    assert cnxn.cursor.fetch_sizes == [10, 10, 10, 10]
+
+
+def test_select_data_auto_fetch_size_adapts():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(["tekst"], [("x" * 100,)] * 50)
+    cnxn.cursor.description = [("tekst", str, None, 0, 0, 0, True)]
+
+    rows = list(
+        cnxn.select_data("select tekst from test", fetch_size="auto", fetch_bytes=2000)
+    )
+
+    # unknown (max) width at first, 200 bytes per row once rows are seen
+    assert len(rows) == 50
+    assert cnxn.cursor.fetch_sizes[:2] == [1, 10]
+
+
+def test_range_bounds_split_integers_evenly():
+    assert _range_bounds(1, 100, 4) == [26, 51, 76]
+
+
+def test_range_bounds_drop_duplicates():
+    assert _range_bounds(1, 2, 4) == [2]
+
+
+def test_range_bounds_split_decimals_and_dates():
+    assert _range_bounds(decimal.Decimal("0.00"), decimal.Decimal("100.00"), 4) == [
+        decimal.Decimal("25.00"),
+        decimal.Decimal("50.00"),
+        decimal.Decimal("75.00"),
+    ]
+    assert _range_bounds(datetime.date(2024, 1, 1), datetime.date(2024, 1, 31), 3) == [
+        datetime.date(2024, 1, 11),
+        datetime.date(2024, 1, 21),
+    ]
+
+
+def test_range_partition_bounds_on_a_decimal_key():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(
+        ["lowest", "highest"], [(decimal.Decimal("1.50"), decimal.Decimal("9.50"))]
+    )
+
+    bounds = _partition_bounds(cnxn, "dbo.test", "amount", 2, "range")
+
+    assert bounds == [decimal.Decimal("5.50")]
+
+
+def test_partition_filters_cover_all_rows():
+    filters = _partition_filters("id", [10, 20])
+
+    assert filters == [
+        (" where [id] < ? or [id] is null", [10]),
+        (" where [id] >= ? and [id] < ?", [10, 20]),
+        (" where [id] >= ?", [20]),
+    ]
+
+
+def test_partition_filters_without_bounds_is_one_partition():
+    assert _partition_filters("id", []) == [("", [])]
+
+
+def test_partition_filters_add_a_condition():
+    filters = _partition_filters("id", [10], where="day > ?", params=["2024-01-01"])
+
+    assert filters == [
+        (" where (day > ?) and ([id] < ? or [id] is null)", ["2024-01-01", 10]),
+        (" where (day > ?) and ([id] >= ?)", ["2024-01-01", 10]),
+    ]
+    assert _partition_filters("id", [], where="day > ?", params=[1]) == [
+        (" where day > ?", [1])
+    ]
+
+
+def test_from_connection_uses_table_cache():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    definition = [("test", "id", "int", False, None, 10, 0, None)]
+    cnxn.cursor = FakeSelectCursor(
+        [
+            "TABLE_NAME",
+            "COLUMN_NAME",
+            "DATA_TYPE",
+            "IS_NULLABLE",
+            "CHARACTER_MAXIMUM_LENGTH",
+            "NUMERIC_PRECISION",
+            "NUMERIC_SCALE",
+            "COLUMN_DEFAULT",
+        ],
+        definition,
+    )
+
+    Table.from_connection(cnxn, "dbo.test")
+    t = Table.from_connection(cnxn, "dbo.test")
+    assert t.column_names() == ["id"]
+    assert len(cnxn.cursor.fetch_sizes) == 2
+
+    cnxn.invalidate_table_cache("dbo.test")
+    Table.from_connection(cnxn, "dbo.test")
+    assert len(cnxn.cursor.fetch_sizes) == 4
+
+
+def test_clone_shares_table_cache():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    no_cache = SQLserverconnection(
+        driver="SQL Server 18 for MS",
+        server="SQLMACHINE_01",
+        database="Databasename",
+        table_cache=False,
+    )
+
+    assert cnxn.clone().table_cache is cnxn.table_cache
+    assert no_cache.clone().table_cache is None
+    assert "table_cache" not in cnxn.to_string()
+
+
+def test_many_from_connection_builds_all_tables():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(
+        [
+            "table_name",
+            "COLUMN_NAME",
+            "DATA_TYPE",
+            "IS_NULLABLE",
+            "CHARACTER_MAXIMUM_LENGTH",
+            "NUMERIC_PRECISION",
+            "NUMERIC_SCALE",
+            "COLUMN_DEFAULT",
+        ],
+        [
+            ("staging.een", "id", "int", False, None, 10, 0, None),
+            ("staging.een", "naam", "nvarchar", True, 255, None, None, "onbekend"),
+            ("staging.twee", "id", "bigint", False, None, 19, 0, None),
+        ],
+    )
+
+    tables = Table.many_from_connection(cnxn, "staging")
+
+    assert list(tables) == ["staging.een", "staging.twee"]
+    assert tables["staging.een"].column_names() == ["id", "naam"]
+    assert tables["staging.een"].columns[1].length == 255
+    assert isinstance(tables["staging.twee"], Table)
+    assert len(cnxn.cursor.fetch_sizes) == 2
+
+    # the definitions are cached for Table.from_connection
+    assert Table.from_connection(cnxn, "staging.twee").columns[0].type == "bigint"
+    assert len(cnxn.cursor.fetch_sizes) == 2
+
+
+@pytest.mark.parametrize(
+    "value, type",
+    [
+        (12345678901, "bigint"),
+        (b"\x00\x00\x00\x00\x00\x00\x07\xd1", "timestamp"),
+        (datetime.datetime(2024, 5, 1, 13, 45, 10, 123000), "datetime2"),
+        (datetime.date(2024, 5, 1), "date"),
+    ],
+)
+def test_value_round_trips_through_text(value, type):
+    c = Column(name="watermark", type=type, nullable=False)
+
+    assert _value_from_text(_value_to_text(value), c) == value
+
+
+class FakeKeySource:
+    """Stands in for a source connection, returns (id,) rows above the ? param."""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.queries = []
+
+    def select_data(self, query, row_type=dict, table=None, params=None, stats=None):
+        self.queries.append(query)
+        start = params[0] if params else None
+        return ((i,) for i in self.ids if start is None or i > start)
+
+
+def test_file_checkpoint_saves_and_clears(tmp_path):
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+
+    assert checkpoint.load(None, "dbo.copy") is None
+    checkpoint.save(None, "dbo.copy", "10", 2, 2000)
+    assert checkpoint.load(None, "dbo.copy") == {
+        "last_key": "10",
+        "chunk": 2,
+        "rows": 2000,
+    }
+    checkpoint.clear(None, "dbo.copy")
+    assert checkpoint.load(None, "dbo.copy") is None
+
+
+def test_resumable_insert_continues_after_checkpoint(tmp_path):
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+    source = FakeKeySource(list(range(1, 101)))
+
+    failing = FakeTarget(fail_after=3)
+    with pytest.raises(RuntimeError):
+        _resumable_insert(
+            source,
+            "dbo.source",
+            InsertPlan(failing, t, mapping=False),
+            copy_name="dbo.copy",
+            checkpoint_column="id",
+            checkpoint=checkpoint,
+            state=None,
+            chunk_length=10,
+        )
+    state = checkpoint.load(None, "dbo.copy")
+    assert state == {"last_key": "30", "chunk": 3, "rows": 30}
+
+    target = FakeTarget()
+    _resumable_insert(
+        source,
+        "dbo.source",
+        InsertPlan(target, t, mapping=False),
+        copy_name="dbo.copy",
+        checkpoint_column="id",
+        checkpoint=checkpoint,
+        state=state,
+        chunk_length=10,
+    )
+
+    assert source.queries[-1] == "select * from dbo.source where [id] > ? order by [id]"
+    assert [r[0] for c in target.cursor.inserted for r in c] == list(range(31, 101))
+    assert checkpoint.load(None, "dbo.copy") == {
+        "last_key": "100",
+        "chunk": 10,
+        "rows": 100,
+    }
+
+
+def test_resumable_insert_adds_the_condition_to_the_checkpoint(tmp_path):
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    checkpoint = FileCheckpoint(str(tmp_path / "checkpoint.json"))
+    source = FakeKeySource([])
+
+    _resumable_insert(
+        source,
+        "dbo.source",
+        InsertPlan(FakeTarget(), t, mapping=False),
+        copy_name="dbo.copy",
+        checkpoint_column="id",
+        checkpoint=checkpoint,
+        state={"last_key": "30", "chunk": 3, "rows": 30},
+        chunk_length=10,
+        select="[id]",
+        where="region = ?",
+        params=["north"],
+    )
+
+    assert source.queries[-1] == (
+        "select [id] from dbo.source where (region = ?) and [id] > ? order by [id]"
+    )
+
+
+def test_insert_dictionary_accepts_generator():
+    c1 = Column(name="id", type="int", nullable=False)
+    c2 = Column(name="place", type="nvarchar", nullable=False, length=255)
+    t = Table(name="test", columns=[c1, c2])
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor()
+
+    inserted = cnxn.sql_insert_dictionary(
+        t, ({"id": i} for i in range(25)), chunk_size=10, commit_every=20
+    )
+
+    assert inserted == 25
+    assert [len(c) for c in cnxn.cursor.inserted] == [10, 10, 5]
+    assert cnxn.cursor.inserted[0][0] == (0,)
+    assert cnxn.cursor.commits == 2
+
+
+def test_insert_list_commits_once_by_default():
+    c1 = Column(name="id", type="int", nullable=False)
+    t = Table(name="test", columns=[c1])
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor()
+
+    inserted = cnxn.sql_insert_list(t, iter([[1], [2], [3]]), chunk_size=2)
+
+    assert inserted == 3
+    assert [len(c) for c in cnxn.cursor.inserted] == [2, 1]
+    assert cnxn.cursor.commits == 1
+
+
+def test_insert_dictionary_without_rows():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor()
+
+    assert cnxn.sql_insert_dictionary(t, []) == 0
+    assert cnxn.cursor.inserted == []
+
+
+class FakeSchemaSource(FakeTarget):
+    def __init__(self, estimates):
+        super().__init__()
+        self.estimates = estimates
+        self.connects = 0
+
+    def clone(self):
+        return self
+
+    @contextmanager
+    def connect(self):
+        self.connects += 1
+        yield self
+
+    def table_row_counts(self, schema, startswith=None, contains=None):
+        return self.estimates
+
+
+def test_copy_schema_reports_every_table(monkeypatch):
+    source = FakeSchemaSource({"dbo.big": 300, "dbo.broken": 200, "dbo.small": 1})
+    started = []
+
+    def fake_copy_table(source, table_name, target, into=None):
+        started.append((table_name, into))
+        if table_name == "dbo.broken":
+            raise RuntimeError("copy failed")
+        stats = Stats()
+        stats.add("copy", 0.1, rows=source.estimates[table_name])
+        return stats
+
+    monkeypatch.setattr(sqlservertools, "copy_table", fake_copy_table)
+
+    report = copy_schema(source, source, "dbo", into_schema="stage", workers=1)
+
+    assert started == [
+        ("dbo.big", "stage.big"),
+        ("dbo.broken", "stage.broken"),
+        ("dbo.small", "stage.small"),
+    ]
+    assert [(r.table_name, r.status, r.rows) for r in report] == [
+        ("dbo.big", "copied", 300),
+        ("dbo.broken", "failed", None),
+        ("dbo.small", "copied", 1),
+    ]
+    assert str(report[1].error) == "copy failed"
+    # a worker reconnects after a failed copy
+    assert source.connects == 4
+
+
+def test_copy_schema_rejects_into():
+    with pytest.raises(ValueError, match="into_schema"):
+        copy_schema(None, None, "dbo", into="stage.table")
+
+
+def test_copy_schema_runs_workers_in_parallel(monkeypatch):
+    estimates = {f"dbo.t{i}": 10 - i for i in range(6)}
+    source = FakeSchemaSource(estimates)
+    threads = set()
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fake_copy_table(source, table_name, target, into=None):
+        threads.add(threading.get_ident())
+        if len(threads) <= 3 and table_name in ("dbo.t0", "dbo.t1", "dbo.t2"):
+            barrier.wait()
+        stats = Stats()
+        stats.add("copy", 0.1, rows=1)
+        return stats
+
+    monkeypatch.setattr(sqlservertools, "copy_table", fake_copy_table)
+
+    report = copy_schema(source, source, "dbo", workers=3)
+
+    assert len(threads) == 3
+    assert [r.table_name for r in report] == list(estimates)
+    assert all(r.status == "copied" for r in report)
+
+
+def test_select_data_records_stats():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeSelectCursor(["id"], [(i,) for i in range(25)])
+    cnxn.cursor.description = [("id", int, None, 10, 10, 0, False)]
+    stats = Stats()
+
+    rows = list(cnxn.select_data("select id from test", fetch_size=10, stats=stats))
+
+    assert len(rows) == 25
+    assert stats["execute"].calls == 1
+    assert stats["fetch"].calls == 4
+    assert stats["fetch"].rows == 25
+    assert stats["fetch"].bytes > 0
+    assert stats["build rows"].rows == 25
+
+
+def test_insert_records_stats():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor()
+    stats = Stats()
+
+    cnxn.sql_insert_list(t, [[i] for i in range(5)], chunk_size=2, stats=stats)
+
+    assert stats["render insert"].calls == 1
+    assert stats["prepare rows"].rows == 5
+    assert stats["executemany"].calls == 3
+    assert stats["executemany"].rows == 5
+    assert stats["commit"].calls == 1
+
+
+def test_transaction_suppresses_commits_until_the_end():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor()
+
+    with cnxn.transaction():
+        cnxn.sql_insert_list(t, [[1], [2]])
+        cnxn.execute_sql("update test set id = id + 1")
+        with cnxn.transaction():
+            cnxn.sql_insert_list(t, [[3]], commit_every=1)
+        assert cnxn.cursor.commits == 0
+
+    assert cnxn.cursor.commits == 1
+    cnxn.execute_sql("update test set id = id + 1")
+    assert cnxn.cursor.commits == 2
+
+
+def test_transaction_rolls_back_on_error():
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="SQLMACHINE_01", database="Databasename"
+    )
+    cnxn.cursor = FakeCursor()
+    cnxn.connection = FakeRollbackConnection()
+
+    with pytest.raises(RuntimeError):
+        with cnxn.transaction():
+            cnxn.execute_sql("delete from test")
+            raise RuntimeError("failed")
+
+    assert cnxn.cursor.commits == 0
+    assert cnxn.connection.rollbacks == 1
+
+
+def test_pipelined_insert_commits_every_n_rows():
+    t = Table(name="test", columns=[Column(name="id", type="int", nullable=False)])
+    target = FakeTarget()
+    rows = ({"id": i} for i in range(105))
+    plan = InsertPlan(target, t)
+
+    _pipelined_insert(
+        rows,
+        plan,
+        target,
+        chunk_length=10,
+        queue_depth=2,
+        writers=1,
+        commit_every=50,
+    )
+
+    # after 50 and 100 rows, and the rest at the end
+    assert target.cursor.commits == 3
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"partition_column": "id"},
+        {"checkpoint_column": "id"},
+        {"pipeline": True, "writers": 2},
+    ],
+)
+def test_single_transaction_needs_one_target_connection(options):
+    with pytest.raises(ValueError, match="single_transaction"):
+        copy_table(None, "dbo.test", None, single_transaction=True, **options)
+
+
+class FakeUpsertCursor(FakeCursor):
+    """Records the statements, the merge returns fixed counts."""
+
+    def __init__(self, inserted, updated):
+        super().__init__()
+        self.statements = []
+        self.counts = [(inserted, updated)]
+        self.description = None
+
+    def execute(self, query, *params):
+        self.statements.append(query)
+        self.description = None
+        if "output $action" in query:
+            self.description = [
+                ("inserted", int, None, 10, 10, 0, False),
+                ("updated", int, None, 10, 10, 0, False),
+            ]
+            self.results = list(self.counts)
+
+    def fetchmany(self, size):
+        batch, self.results = self.results[:size], self.results[size:]
+        return batch
+
+
+def upsert_connection(inserted=0, updated=0):
+    cnxn = SQLserverconnection(
+        driver="SQL Server 18 for MS", server="fake", database="test"
+    )
+    cnxn.cursor = FakeUpsertCursor(inserted, updated)
+    cnxn.connection = FakeRollbackConnection()
+    return cnxn
+
+
+def upsert_table():
+    return Table(
+        name="dbo.test",
+        columns=[
+            Column(name="id", type="int", nullable=False),
+            Column(name="place", type="nvarchar", nullable=True, length=50),
+            Column(
+                name="changed", type="datetime2", nullable=True, default="getdate()"
+            ),
+        ],
+    )
+
+
+def test_upsert_stages_rows_and_merges():
+    cnxn = upsert_connection(inserted=1, updated=2)
+    rows = [{"id": i, "place": f"place {i}"} for i in range(3)]
+
+    result = cnxn.upsert(upsert_table(), rows, key_columns=["id"])
+
+    drop, create, merge, drop_again = cnxn.cursor.statements
+    assert result == {"inserted": 1, "updated": 2}
+    assert drop == drop_again == "drop table if exists #upsert_test"
+    assert create.startswith("create table #upsert_test")
+    assert "default" not in create
+    assert "merge dbo.test as t\nusing #upsert_test as s\non t.[id] = s.[id]" in merge
+    assert "[place] = s.[place]" in merge
+    assert "[changed]" not in merge
+    assert cnxn.cursor.inserted == [[(0, "place 0"), (1, "place 1"), (2, "place 2")]]
+    # one commit for the whole upsert
+    assert cnxn.cursor.commits == 1
+
+
+def test_upsert_lists_take_the_given_columns():
+    cnxn = upsert_connection(inserted=2)
+
+    result = cnxn.upsert(
+        upsert_table(),
+        [[1, "a"], [2, "b"]],
+        key_columns=["id"],
+        columns=["id", "place"],
+    )
+
+    assert result == {"inserted": 2, "updated": 0}
+    assert cnxn.cursor.inserted == [[[1, "a"], [2, "b"]]]
+
+
+def test_upsert_lists_keep_the_order_of_the_given_columns():
+    cnxn = upsert_connection(inserted=1)
+
+    cnxn.upsert(
+        upsert_table(), [["alice", 1]], key_columns=["id"], columns=["place", "id"]
+    )
+
+    create = cnxn.cursor.statements[1]
+    assert create.index("place nvarchar") < create.index("id int")
+    assert cnxn.cursor.inserted == [[["alice", 1]]]
+    assert cnxn.cursor.sql.startswith("insert into #upsert_test ([place], [id])")
+
+
+def test_upsert_checks_key_columns():
+    cnxn = upsert_connection()
+
+    with pytest.raises(KeyError):
+        cnxn.upsert(upsert_table(), [{"place": "a"}], key_columns=["id"])
+
+
+def test_upsert_without_rows_does_nothing():
+    cnxn = upsert_connection()
+
+    assert cnxn.upsert(upsert_table(), [], key_columns=["id"]) == {
+        "inserted": 0,
+        "updated": 0,
+    }
+    assert cnxn.cursor.statements == []
@@ -0,0 +1,82 @@
+import logging
+import threading
+from etl_db_tools.base.stats import NO_STATS, Stats
+
+
+def test_measure_adds_time_and_counts():
+    stats = Stats()
+
+    for n in (3, 4):
+        with stats.measure("fetch") as counts:
+            counts.rows = n
+            counts.bytes = n * 10
+
+    assert stats["fetch"].calls == 2
+    assert stats["fetch"].rows == 7
+    assert stats["fetch"].bytes == 70
+    assert stats["fetch"].seconds >= 0
+
+
+def test_measure_records_failed_calls():
+    stats = Stats()
+
+    try:
+        with stats.measure("executemany"):
+            raise RuntimeError("insert failed")
+    except RuntimeError:
+        pass
+
+    assert stats["executemany"].calls == 1
+
+
+def test_add_is_thread_safe():
+    stats = Stats()
+
+    def work():
+        for _ in range(1000):
+            stats.add("write", 0.001, rows=1)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert stats["write"].calls == 4000
+    assert stats["write"].rows == 4000
+
+
+def test_merge_and_to_dict():
+    first = Stats()
+    first.add("fetch", 1.0, rows=10)
+    second = Stats()
+    second.add("fetch", 2.0, rows=5)
+    second.add("commit", 0.5)
+
+    first.merge(second)
+
+    assert first.to_dict() == {
+        "fetch": {"seconds": 3.0, "calls": 2, "rows": 15, "bytes": 0},
+        "commit": {"seconds": 0.5, "calls": 1, "rows": 0, "bytes": 0},
+    }
+
+
+def test_log_writes_a_line_per_stage(caplog):
+    stats = Stats()
+    stats.add("fetch", 1.0, rows=10)
+    stats.add("commit", 0.5)
+
+    with caplog.at_level(logging.DEBUG, logger="etl_db_tools.base.stats"):
+        stats.log(logging.DEBUG, title="copy of dbo.test")
+
+    assert len(caplog.records) == 2
+    assert caplog.records[0].levelno == logging.DEBUG
+    assert "copy of dbo.test fetch" in caplog.records[0].getMessage()
+
+
+def test_no_stats_records_nothing():
+    with NO_STATS.measure("fetch") as counts:
+        counts.rows = 10
+    NO_STATS.add("fetch", 1.0)
+
+    assert "fetch" not in NO_STATS